@@ -2,15 +2,19 @@
 # Licensed under the Apache License, Version 2.0
 
 import importlib
+import os
 from types import MappingProxyType
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.engine.url import URL
 from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy import create_engine
 
-from controller import create_labels_for_available_pages, make_pages_dict
+from controller import (
+    create_labels_for_available_pages,
+    get_data_version_for_pages,
+    make_pages_dict,
+    prewarm_pages,
+)
 from utility.constants import (
     APP_CONFIG_JSON,
     AVAILABLE_PAGES,
@@ -18,10 +22,33 @@ from utility.constants import (
     AVAILABLE_PAGES_DICT,
     DATA_BACKEND,
     POSTGRES,
-    SQLALCHEMY_DATABASE_URI,
     DEVELOPMENT,
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_MAX_BYTES,
+    GRAPHIC_CACHE_MAX_ENTRIES,
+    GRAPHIC_CACHE_MAX_BYTES,
+    COMPRESSION_CACHE_MAX_ENTRIES,
+    COMPRESSION_CACHE_MAX_BYTES,
+    RENDER_CACHE_MAX_ENTRIES,
+    RENDER_CACHE_MAX_BYTES,
+    CACHE_PREWARM_ENABLED,
+    CACHE_PREWARM_INTERVAL_SECONDS,
+    CACHE_STALE_MAX_SECONDS,
+    SINGLE_FLIGHT_LOCK_DIR,
+    SINGLE_FLIGHT_TIMEOUT_SECONDS,
+    SQLALCHEMY_DATABASE_URI,
+    SELECTABLE_REGISTRY_MAX_ENTRIES,
+    STATEMENT_CACHE_MAX_ENTRIES,
+    UPLOAD_METADATA_MAX_AGE_SECONDS,
+    ORM_FETCH_ENGINE,
+    SAMPLE_ROWS,
 )
 from app_deploy_data.app_settings import DATABASE_CONFIG
+from graphics.utils.json_encoding import STDLIB_JSON_BACKEND
+from utility.cache import LRUCache, make_cache_key
+from utility.cache_prewarmer import CachePrewarmer, LEADER_LOCK_FILE
+from utility.compression import compress_response
+from utility.single_flight import SingleFlight
 from version import VERSION
 from views.dashboard import dashboard_blueprint
 from views.file_upload import upload_blueprint
@@ -47,6 +74,73 @@ def create_app(db_uri=None, env=None):
         SQLALCHEMY_DATABASE_URI=sqlalchemy_database_uri,
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         VERSION=VERSION,
+        # each worker process holds at most DATABASE_POOL_SIZE + DATABASE_POOL_MAX_OVERFLOW
+        # connections, shared by the queries and the bulk copies
+        DATABASE_POOL_SIZE=5,
+        DATABASE_POOL_MAX_OVERFLOW=10,
+        DATABASE_POOL_TIMEOUT_SECONDS=30,
+        DATABASE_POOL_RECYCLE_SECONDS=1800,
+        DATABASE_POOL_PRE_PING=True,
+        # set the max entries to 0 to turn off a cache
+        QUERY_CACHE_MAX_ENTRIES=256,
+        QUERY_CACHE_MAX_BYTES=512 * 1024 ** 2,
+        GRAPHIC_CACHE_MAX_ENTRIES=1024,
+        GRAPHIC_CACHE_MAX_BYTES=256 * 1024 ** 2,
+        # the last render of the default state of each graphic, kept across data changes
+        RENDER_CACHE_MAX_ENTRIES=512,
+        RENDER_CACHE_MAX_BYTES=128 * 1024 ** 2,
+        # one worker renders the default state of the dashboards in a background thread
+        # after the data changes, and every CACHE_PREWARM_INTERVAL_SECONDS (None for never).
+        # Until it is done, its viewers are served the previous renders for up to
+        # CACHE_STALE_MAX_SECONDS after the change (0 to always render for the viewer).
+        # The caches are per worker, the other workers fill theirs from their viewers.
+        # The workers take the lock in SINGLE_FLIGHT_LOCK_DIR, without it every worker
+        # prewarms, multiplying the prewarm queries by the number of workers
+        CACHE_PREWARM_ENABLED=True,
+        CACHE_PREWARM_INTERVAL_SECONDS=3600,
+        CACHE_STALE_MAX_SECONDS=120,
+        # identical graphics requested at the same time are built once, across the
+        # worker processes sharing this directory, in a subdirectory per database.
+        # None to only do so within a process. The workers unpickle the results they
+        # find there, so anyone who can write to it can run code in the app:
+        # a directory that other users can write to is only used within a process
+        SINGLE_FLIGHT_LOCK_DIR=os.path.join(app.instance_path, "single_flight"),
+        SINGLE_FLIGHT_TIMEOUT_SECONDS=300,
+        SELECTABLE_REGISTRY_MAX_ENTRIES=256,
+        STATEMENT_CACHE_MAX_ENTRIES=1024,
+        # how long a worker trusts its copy of the upload metadata without a local
+        # write- picks up uploads and admin changes made through other workers
+        UPLOAD_METADATA_MAX_AGE_SECONDS=10,
+        # "copy" streams query results through COPY ... TO STDOUT into pandas' csv
+        # parser rather than building a python tuple per row
+        QUERY_FETCH_ENGINE=ORM_FETCH_ENGINE,
+        # rows are fetched through a server-side cursor this many at a time
+        QUERY_FETCH_CHUNK_SIZE=50000,
+        UPLOAD_CHUNK_SIZE=50000,
+        # no graphic loads more rows than this, a graphic config can set a lower max_rows
+        GRAPHIC_MAX_ROWS=1000000,
+        GRAPHIC_MAX_ROWS_FALLBACK=SAMPLE_ROWS,
+        # set to 1 to build the graphics of a page one after another
+        GRAPHIC_ASSEMBLY_MAX_WORKERS=4,
+        DEFERRED_GRAPHIC_LOADING=False,
+        # "orjson" encodes the plots faster, if the orjson package is installed
+        PLOT_JSON_BACKEND=STDLIB_JSON_BACKEND,
+        # numeric and datetime trace arrays of the plotly graphics are sent as base64
+        # typed arrays rather than json lists, optionally as float32.
+        # PLOTLY_SIGNIFICANT_DIGITS rounds the floats of trace arrays, e.g. {"x": 6}
+        PLOTLY_TYPED_ARRAYS=False,
+        PLOTLY_TYPED_ARRAY_FLOAT32=False,
+        PLOTLY_SIGNIFICANT_DIGITS={},
+        # groupby transforms of the plotly graphics are split into one trace per group
+        # by the server, rather than by the browser from the group of each point
+        PLOTLY_SERVER_GROUPBY=False,
+        # gzip level of the html, json and csv responses, 0 to send them uncompressed.
+        # Smaller responses aren't worth compressing
+        RESPONSE_COMPRESSION_LEVEL=6,
+        RESPONSE_COMPRESSION_MIN_BYTES=1024,
+        # compressed bodies, reused while a response doesn't change
+        COMPRESSION_CACHE_MAX_ENTRIES=256,
+        COMPRESSION_CACHE_MAX_BYTES=64 * 1024 ** 2,
     )
 
     # register url blueprints with the app object
@@ -60,6 +154,13 @@ def create_app(db_uri=None, env=None):
         # only include the wizard blueprint when running in debug mode
         app.register_blueprint(wizard_blueprint)
 
+    app.compression_cache = LRUCache(
+        max_entries=app.config[COMPRESSION_CACHE_MAX_ENTRIES],
+        max_size=app.config[COMPRESSION_CACHE_MAX_BYTES],
+        sizeof=len,
+    )
+    app.after_request(compress_response)
+
     @app.context_processor
     def get_dashboard_pages():
         # used for the navigation bar
@@ -82,23 +183,80 @@ def configure_app(app, config_dict, config_file_folder):
     app.config[APP_CONFIG_JSON] = MappingProxyType(config_dict)
     config_file_folder = config_file_folder
     app.config[CONFIG_FILE_FOLDER] = config_file_folder
-    app.config[AVAILABLE_PAGES_DICT] = make_pages_dict(
-        config_dict.get(AVAILABLE_PAGES, []), app.config[CONFIG_FILE_FOLDER]
-    )
+    # the page plans render templates, which needs an app context
+    with app.app_context():
+        app.config[AVAILABLE_PAGES_DICT] = make_pages_dict(
+            config_dict.get(AVAILABLE_PAGES, []), app.config[CONFIG_FILE_FOLDER]
+        )
     configure_backend(app)
+    if app.config[CACHE_PREWARM_ENABLED]:
+        app.cache_prewarmer.start()
     return app
 
 
 def configure_backend(app):
     # setup steps unique to SQL-backended apps
+    from database.connection_pool import create_pooled_engine
     from database.sql_handler import SqlHandler, SqlDataInventory
+    from database.upload_metadata_registry import UploadMetadataRegistry
 
-    app.db = SQLAlchemy()
-    engine = create_engine(app.config[SQLALCHEMY_DATABASE_URI], convert_unicode=True)
+    app.engine = create_pooled_engine(app.config)
     app.db_session = scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        sessionmaker(autocommit=False, autoflush=False, bind=app.engine)
+    )
+    app.upload_metadata_registry = UploadMetadataRegistry(
+        max_age_seconds=app.config[UPLOAD_METADATA_MAX_AGE_SECONDS]
+    )
+    # query results and rendered graphics are reused until the uploaded data changes
+    app.query_cache = LRUCache(
+        max_entries=app.config[QUERY_CACHE_MAX_ENTRIES],
+        max_size=app.config[QUERY_CACHE_MAX_BYTES],
+        sizeof=lambda df: int(df.memory_usage(index=True).sum()),
+    )
+    # joined tables and column lookups of SqlHandler, keyed by the data sources spec
+    app.selectable_registry = LRUCache(
+        max_entries=app.config[SELECTABLE_REGISTRY_MAX_ENTRIES]
+    )
+    # compiled sql of the dashboard queries, keyed by query shape, see get_cached_statement
+    app.statement_cache = LRUCache(max_entries=app.config[STATEMENT_CACHE_MAX_ENTRIES])
+    app.graphic_cache = LRUCache(
+        max_entries=app.config[GRAPHIC_CACHE_MAX_ENTRIES],
+        max_size=app.config[GRAPHIC_CACHE_MAX_BYTES],
+        sizeof=get_graphic_info_size,
+    )
+    app.render_cache = LRUCache(
+        max_entries=app.config[RENDER_CACHE_MAX_ENTRIES],
+        max_size=app.config[RENDER_CACHE_MAX_BYTES],
+        sizeof=get_graphic_info_size,
+    )
+    single_flight_lock_dir = app.config[SINGLE_FLIGHT_LOCK_DIR]
+    if single_flight_lock_dir is not None:
+        # apps on other databases can have the same config and data versions,
+        # so their results are kept apart
+        single_flight_lock_dir = os.path.join(
+            single_flight_lock_dir,
+            make_cache_key(str(app.config[SQLALCHEMY_DATABASE_URI])),
+        )
+    app.single_flight = SingleFlight(
+        lock_dir=single_flight_lock_dir,
+        timeout_seconds=app.config[SINGLE_FLIGHT_TIMEOUT_SECONDS],
+    )
+    # the worker holding the lock prewarms, rather than each of them running the queries
+    prewarm_lock_path = None
+    if app.single_flight.lock_dir is not None:
+        prewarm_lock_path = os.path.join(app.single_flight.lock_dir, LEADER_LOCK_FILE)
+    app.cache_prewarmer = CachePrewarmer(
+        app,
+        refresh=lambda: prewarm_pages(app.config.get(AVAILABLE_PAGES_DICT, {})),
+        get_version=lambda: get_data_version_for_pages(
+            app.config.get(AVAILABLE_PAGES_DICT, {})
+        ),
+        interval_seconds=app.config[CACHE_PREWARM_INTERVAL_SECONDS],
+        # writes of other workers show up in the upload metadata after its max age
+        poll_seconds=app.config[UPLOAD_METADATA_MAX_AGE_SECONDS],
+        stale_max_seconds=app.config[CACHE_STALE_MAX_SECONDS],
+        leader_lock_path=prewarm_lock_path,
     )
-    app.db.init_app(app)
 
     data_backend_class = SqlHandler
     data_backend_writer = SqlDataInventory
@@ -112,3 +270,7 @@ def configure_backend(app):
 
     app.config.data_handler = data_backend_class
     app.config.data_backend_writer = data_backend_writer
+
+
+def get_graphic_info_size(graphic_info: dict) -> int:
+    return sum(len(str(value)) for value in graphic_info.values())
@@ -1,97 +1,459 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
 
-import copy
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
+import pickle
 
 from flask import current_app
 
 from database.data_handler import DataHandler
+from database.page_query_planner import PageQueryPlanner
 from graphics.utils.available_graphics import AVAILABLE_GRAPHICS
+from utility.cache import make_cache_key
 from utility.constants import *
 
 
-def get_data_for_page(single_page_config_dict: dict, addendum_dict=None) -> list:
+class GraphicPlan:
     """
+    The parts of a graphic that only depend on its config, built once when the app is configured.
+    Each request gets its own copy of the graphic dict to merge its selections into,
+    the plan itself is never modified.
+    """
+
+    def __init__(self, graphic_dict: dict):
+        """
+        Needs an app context, to render the templates of the graphic
+        :param graphic_dict: config dict of a single graphic, as read from its json file
+        """
+        self.graphic_class = AVAILABLE_GRAPHICS[graphic_dict[PLOT_MANAGER]][OBJECT]
+        # identifies the config in etags and cache keys, without serializing it per request
+        self.config_cache_key = make_cache_key(graphic_dict)
+        data_sources = graphic_dict[DATA_SOURCES]
+        self.data_source_names = [data_sources[MAIN_DATA_SOURCE][DATA_SOURCE_TYPE]] + [
+            data_source[DATA_SOURCE_TYPE]
+            for data_source in data_sources.get(ADDITIONAL_DATA_SOURCES, [])
+        ]
+        # unpickling a copy is several times faster than a deepcopy of the dict
+        self.pickled_graphic_dict = pickle.dumps(graphic_dict)
+        # most requests use the default selections, so those are applied only once
+        default_graphic_object = self.graphic_class(
+            pickle.loads(self.pickled_graphic_dict)
+        )
+        default_graphic_object.add_instructions_to_config_dict()
+        self.pickled_default_graphic_dict = pickle.dumps(
+            default_graphic_object.graphic_dict
+        )
+        self.rendered_templates = default_graphic_object.render_templates()
+
+    def make_graphic_object(self, addendum_dict: dict = None):
+        """
+        :param addendum_dict: the selections of the graphic from the html form, see get_data_for_page
+        :return: Graphic instance with the addendum instructions already added
+        """
+        if addendum_dict:
+            graphic_object = self.graphic_class(
+                pickle.loads(self.pickled_graphic_dict),
+                addendum_dict,
+                self.rendered_templates,
+            )
+            graphic_object.add_instructions_to_config_dict()
+            return graphic_object
+        return self.graphic_class(
+            pickle.loads(self.pickled_default_graphic_dict),
+            rendered_templates=self.rendered_templates,
+        )
+
+
+def make_page_plan(single_page_config_dict: dict) -> dict:
+    """
+    :param single_page_config_dict: dict of graphic config dicts keyed by graphic name
+    :return: dict of GraphicPlan keyed by graphic name
+    """
+    return {
+        graphic_name: GraphicPlan(graphic_dict)
+        for graphic_name, graphic_dict in single_page_config_dict.items()
+    }
+
 
-    :param single_page_config_dict: A dictionary containing all the information from the config json file
+def get_data_for_page(
+    page_plan: dict,
+    addendum_dict=None,
+    load_deferred: bool = None,
+    catch_errors: bool = True,
+) -> list:
+    """
+
+    :param page_plan: dict of GraphicPlan keyed by graphic name, see make_page_plan
     :param addendum_dict: json received from post. # todo: describe how this form is structured, and how we restructure it in reformat_html_form_dict
+    :param load_deferred: whether to leave the plots to graphic_data, defaults to DEFERRED_GRAPHIC_LOADING
+    :param catch_errors: whether a graphic that fails to build is shown with an error notice,
+    rather than raising the error
     :return: dictionary to be read by jinja to build the page
     """
-
-    single_page_config_dict = copy.deepcopy(single_page_config_dict)
-    graphic_object_dict = make_dict_of_graphic_objects(
-        single_page_config_dict, addendum_dict
+    if addendum_dict is None:
+        addendum_dict = {}
+    plot_specs = assemble_html_with_graphs_from_page_config(
+        page_plan, addendum_dict, load_deferred, catch_errors
     )
-    plot_specs = assemble_html_with_graphs_from_page_config(graphic_object_dict)
 
     return plot_specs
 
 
-def make_dict_of_graphic_objects(
-    single_page_graphic_config_dict: dict, addendum_dict: dict = None
-) -> dict:
+def assemble_html_with_graphs_from_page_config(
+    page_plan: dict,
+    addendum_dict: dict = None,
+    load_deferred: bool = None,
+    catch_errors: bool = True,
+) -> list:
     """
-    We build a page based on 2 dictonaries, what is in the config and what is submitted in the HTML form.
-    :param single_page_graphic_config_dict: Copy of part of the original config dict.
-    :param addendum_dict: e.g ImmutableMultiDict([('graphic_name', 'graphic_0'), ('selection_0', 'SHOW_ALL_ROW'),
-     ('selection_2_upper_operation', '<='), ('selection_2_upper_value', '4'))])
-    Should not pass an empty ImmutableMultiDict
-    :return: dictionary of Graphic classes
+    creates dictionary to be read in by the html file to plot the graphics and selectors
+    Independent graphics are built concurrently, up to GRAPHIC_ASSEMBLY_MAX_WORKERS at a time,
+    so that their database queries overlap.
+    Graphics that read the same data share their queries, see PageQueryPlanner
+    :param page_plan: dict of GraphicPlan keyed by graphic name, see make_page_plan
+    :param addendum_dict: the selections of each graphic keyed by graphic name, see get_data_for_page
+    :param load_deferred: whether to leave the plots to graphic_data, defaults to DEFERRED_GRAPHIC_LOADING
+    :param catch_errors: whether a graphic that fails to build is shown with an error notice
+    :return: list of dicts for the jinja template, in the order of page_plan
     """
     if addendum_dict is None:
         addendum_dict = {}
-    graphic_object_dict = {}
-    for graphic_name, graphic_dict in single_page_graphic_config_dict.items():
-        graphic_class = AVAILABLE_GRAPHICS[graphic_dict[PLOT_MANAGER]][OBJECT]
-        graphic_object = graphic_class(
-            graphic_dict, addendum_dict.get(graphic_name, {})
+    if load_deferred is None:
+        load_deferred = current_app.config[DEFERRED_GRAPHIC_LOADING]
+    graphic_object_dict = {
+        graphic_name: graphic_plan.make_graphic_object(
+            addendum_dict.get(graphic_name, {})
         )
-        graphic_object.add_instructions_to_config_dict()
-        graphic_object_dict[graphic_name] = graphic_object
-    return graphic_object_dict
+        for graphic_name, graphic_plan in page_plan.items()
+    }
+    query_planner = PageQueryPlanner()
+    data_sources_keys = {
+        plot_key: plan_graphic_queries(query_planner, graphic_object)
+        for plot_key, graphic_object in graphic_object_dict.items()
+    }
+    max_workers = min(
+        current_app.config[GRAPHIC_ASSEMBLY_MAX_WORKERS], len(graphic_object_dict)
+    )
+    if max_workers <= 1:
+        return [
+            assemble_graphic_html_dict(
+                plot_key,
+                graphic_object,
+                page_plan[plot_key].config_cache_key,
+                load_deferred,
+                query_planner,
+                data_sources_keys[plot_key],
+                catch_errors,
+            )
+            for plot_key, graphic_object in graphic_object_dict.items()
+        ]
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                run_in_app_context,
+                app,
+                assemble_graphic_html_dict,
+                plot_key,
+                graphic_object,
+                page_plan[plot_key].config_cache_key,
+                load_deferred,
+                query_planner,
+                data_sources_keys[plot_key],
+                catch_errors,
+            )
+            for plot_key, graphic_object in graphic_object_dict.items()
+        ]
+        return [future.result() for future in futures]
 
 
-def assemble_html_with_graphs_from_page_config(graphic_object_dict: dict) -> list:
+def run_in_app_context(app, function, *args):
     """
-    creates dictionary to be read in by the html file to plot the graphics and selectors
-    :param plot_list:
-    :param filter_dict:
-    :param axes_to_show_per_plot: keyed by html_id of plot, value is dict with some of xyz keys and valued by column name
-    :return:
+    Runs a function in a worker thread with its own app context.
+    db_session is scoped to the thread, and is removed when the app context is torn down
+    """
+    with app.app_context():
+        return function(*args)
+
+
+def plan_graphic_queries(query_planner: PageQueryPlanner, graphic_object) -> str:
+    """
+    Adds the queries of make_graphic_select_info and make_graphic_plot_info to the plan of the page
+    :param query_planner: PageQueryPlanner of the page request
+    :param graphic_object: Graphic instance with the addendum instructions already added
+    :return: key of the data sources of the graphic in the plan
+    """
+    graphic_dict = graphic_object.graphic_dict
+    return query_planner.plan_graphic(
+        graphic_dict[DATA_SOURCES],
+        graphic_object.get_data_columns(),
+        graphic_dict.get(DATA_FILTERS, []),
+        graphic_dict.get(MAX_ROWS),
+        graphic_dict.get(MAX_ROWS_FALLBACK),
+        graphic_object.get_columns_that_need_unique_entries(),
+    )
+
+
+def assemble_graphic_html_dict(
+    plot_key: str,
+    graphic_object,
+    config_cache_key: str,
+    load_deferred: bool = False,
+    query_planner: PageQueryPlanner = None,
+    data_sources_key: str = None,
+    catch_errors: bool = True,
+) -> dict:
+    """
+    Builds the jinja template dict of a single graphic.
+    With load_deferred, only the selectors are built here,
+    and the page fetches the plot from graphic_data once the graphic is scrolled into view
+    :param plot_key: name of the graphic in the page config
+    :param graphic_object: Graphic instance with the addendum instructions already added
+    :param config_cache_key: config_cache_key of the GraphicPlan of the graphic
+    :param load_deferred: whether to leave the plot to graphic_data
+    :param query_planner: optional PageQueryPlanner the graphic was planned in
+    :param data_sources_key: key of the data sources of the graphic in the plan
+    :param catch_errors: whether a graphic that fails to build is shown with an error notice
+    :return: dict for the jinja template
     """
-    plot_specs = []
+    info_functions = [make_graphic_select_info]
+    if not load_deferred:
+        info_functions.append(make_graphic_plot_info)
+    graphic_info = get_graphic_info(
+        plot_key,
+        graphic_object,
+        config_cache_key,
+        info_functions,
+        query_planner,
+        data_sources_key,
+        catch_errors=catch_errors,
+    )
+    return {
+        JINJA_GRAPH_HTML_FILE: graphic_object.get_graph_html_template(),
+        JINJA_SELECT_INFO: graphic_info[JINJA_SELECT_INFO],
+        GRAPHIC_TITLE: graphic_object.graphic_dict.get(GRAPHIC_TITLE, plot_key),
+        GRAPHIC_DESC: graphic_object.graphic_dict.get(GRAPHIC_DESC, ""),
+        JINJA_PLOT_INFO: graphic_info[JINJA_PLOT_INFO],
+        DATA_NOTICE: graphic_info[DATA_NOTICE],
+        STALE_RENDER: graphic_info[STALE_RENDER],
+        LOAD_DEFERRED: load_deferred,
+        PLOT_ID: plot_key,
+    }
 
-    for plot_key, graphic_object in graphic_object_dict.items():
+
+def get_single_graphic_info(
+    page_plan: dict,
+    graphic_name: str,
+    addendum_dict: dict = None,
+    with_select_info: bool = False,
+) -> dict:
+    """
+    Builds a single graphic of a page, for loading or updating graphics separately from their page
+    :param page_plan: dict of GraphicPlan keyed by graphic name, see make_page_plan
+    :param graphic_name: name of the graphic in the page config
+    :param addendum_dict: json received from post, see get_data_for_page
+    :param with_select_info: whether to also build the selectors of the graphic
+    :return: dict with the plot json string, data notice and select info used by the html template
+    """
+    if addendum_dict is None:
+        addendum_dict = {}
+    graphic_plan = page_plan[graphic_name]
+    graphic_object = graphic_plan.make_graphic_object(
+        addendum_dict.get(graphic_name, {})
+    )
+    info_functions = [make_graphic_plot_info]
+    if with_select_info:
+        info_functions.append(make_graphic_select_info)
+    return get_graphic_info(
+        graphic_name, graphic_object, graphic_plan.config_cache_key, info_functions
+    )
+
+
+def get_graphic_info(
+    plot_key: str,
+    graphic_object,
+    config_cache_key: str,
+    info_functions: list,
+    query_planner: PageQueryPlanner = None,
+    data_sources_key: str = None,
+    allow_stale: bool = True,
+    catch_errors: bool = True,
+) -> dict:
+    """
+    Builds parts of a graphic with the given functions, reusing cached parts until the data changes.
+    Right after a data change, the default state of a graphic may be served from its previous render
+    while the background refresh renders it, see CachePrewarmer.
+    A graphic that fails to build is shown with an error notice instead of failing the page,
+    unless catch_errors is off, e.g. for the wizard preview, which shows the error instead
+    :param plot_key: name of the graphic in the page config
+    :param graphic_object: Graphic instance with the addendum instructions already added
+    :param config_cache_key: config_cache_key of the GraphicPlan of the graphic
+    :param info_functions: functions taking the graphic object and a data handler,
+    and returning a dict of template info
+    :param query_planner: optional PageQueryPlanner the graphic was planned in
+    :param data_sources_key: key of the data sources of the graphic in the plan
+    :param allow_stale: whether the previous render may be served
+    :param catch_errors: whether to log build errors and return the error notice, or raise them
+    :return: dict with the select info, plot json string and data notice used by the html template,
+    and whether any of it is from a previous render of the data
+    """
+    graphic_info = {
+        JINJA_SELECT_INFO: [],
+        JINJA_PLOT_INFO: None,
+        DATA_NOTICE: None,
+        STALE_RENDER: False,
+    }
+    try:
         plot_data_handler = current_app.config.data_handler(
             graphic_object.graphic_dict[DATA_SOURCES]
         )
-
-        data_filters = graphic_object.graphic_dict.get(DATA_FILTERS, [])
-        plot_data = plot_data_handler.get_column_data(
-            graphic_object.get_data_columns(), data_filters,
+        if query_planner is not None:
+            plot_data_handler = query_planner.get_data_handler(
+                plot_data_handler, data_sources_key
+            )
+        # the graphic dict is the config with the selections of the addendum applied,
+        # so the precomputed key of the config stands in for it
+        graphic_cache_key = make_cache_key(
+            config_cache_key,
+            graphic_object.addendum_dict,
+            plot_data_handler.get_data_version(),
         )
-        # makes a json file as required by js plotting documentation
-        graphic_object.data = plot_data
-        graphic_object.make_dict_for_html_plot()
-
-        unique_entry_dict = plot_data_handler.get_column_unique_entries(
-            graphic_object.get_columns_that_need_unique_entries(), filters=data_filters
+        # the render cache keeps the default state of the graphics across data versions
+        render_cache_key = None
+        if not graphic_object.addendum_dict:
+            render_cache_key = config_cache_key
+        serve_stale = (
+            allow_stale
+            and render_cache_key is not None
+            and current_app.cache_prewarmer.serves_stale()
+        )
+        for info_function in info_functions:
+            info_cache_key = make_cache_key(graphic_cache_key, info_function.__name__)
+            info = current_app.graphic_cache.get(info_cache_key)
+            if info is None and serve_stale:
+                info = current_app.render_cache.get(
+                    make_cache_key(render_cache_key, info_function.__name__)
+                )
+                if info is not None:
+                    graphic_info[STALE_RENDER] = True
+            if info is None:
+                # concurrent requests for the same graphic wait for one to build it
+                info = current_app.single_flight.run(
+                    info_cache_key,
+                    lambda: info_function(graphic_object, plot_data_handler),
+                )
+                current_app.graphic_cache.set(info_cache_key, info)
+                if render_cache_key is not None:
+                    current_app.render_cache.set(
+                        make_cache_key(render_cache_key, info_function.__name__), info
+                    )
+            graphic_info.update(info)
+    except Exception:
+        if not catch_errors:
+            raise
+        current_app.logger.exception(f"Failed to build graphic {plot_key}")
+        graphic_info.update(
+            {JINJA_PLOT_INFO: None, DATA_NOTICE: "This graphic could not be loaded."}
         )
-        graphic_object.unique_entry_dict = unique_entry_dict
-        graphic_object.create_data_subselect_info_for_plot()
-
-        html_dict = {
-            JINJA_GRAPH_HTML_FILE: graphic_object.get_graph_html_template(),
-            JINJA_SELECT_INFO: graphic_object.select_info,
-            GRAPHIC_TITLE: graphic_object.graphic_dict.get(GRAPHIC_TITLE, plot_key),
-            GRAPHIC_DESC: graphic_object.graphic_dict.get(GRAPHIC_DESC, ""),
-            JINJA_PLOT_INFO: graphic_object.graph_json_str,
-            PLOT_ID: plot_key,
+    return graphic_info
+
+
+def make_graphic_select_info(graphic_object, plot_data_handler) -> dict:
+    """
+    Queries the unique entries of the selectors of a graphic
+    :param graphic_object: Graphic instance with the addendum instructions already added
+    :param plot_data_handler: DataHandler instance for the data sources of the graphic
+    :return: dict with the select info used by the html template
+    """
+    unique_entry_dict = plot_data_handler.get_column_unique_entries(
+        graphic_object.get_columns_that_need_unique_entries(),
+        filters=graphic_object.graphic_dict.get(DATA_FILTERS, []),
+    )
+    graphic_object.unique_entry_dict = unique_entry_dict
+    graphic_object.create_data_subselect_info_for_plot()
+    return {JINJA_SELECT_INFO: graphic_object.select_info}
+
+
+def make_graphic_plot_info(graphic_object, plot_data_handler) -> dict:
+    """
+    Queries the data for a graphic and renders its plot json
+    :param graphic_object: Graphic instance with the addendum instructions already added
+    :param plot_data_handler: DataHandler instance for the data sources of the graphic
+    :return: dict with the plot json string and data notice used by the html template
+    """
+    plot_data = plot_data_handler.get_column_data(
+        graphic_object.get_data_columns(),
+        # get_column_data adds to the filters, leave the graphic dict as it was
+        list(graphic_object.graphic_dict.get(DATA_FILTERS, [])),
+        max_rows=graphic_object.graphic_dict.get(MAX_ROWS),
+        max_rows_fallback=graphic_object.graphic_dict.get(MAX_ROWS_FALLBACK),
+    )
+    # makes a json file as required by js plotting documentation
+    graphic_object.data = plot_data
+    graphic_object.make_dict_for_html_plot()
+    return {
+        JINJA_PLOT_INFO: graphic_object.graph_json_str,
+        # tells the user when the data of the graphic was cut down to the row budget
+        DATA_NOTICE: plot_data.attrs.get(DATA_NOTICE),
+    }
+
+
+def get_data_version_for_graphics(graphic_plans) -> dict:
+    """
+    Identifies the state of the data behind a set of graphics without querying the data tables,
+    for checking whether a response built from them has changed
+    :param graphic_plans: iterable of GraphicPlan
+    :return: dict keyed by table name, valued with the sorted active upload ids
+    """
+    data_source_names = set()
+    for graphic_plan in graphic_plans:
+        data_source_names.update(graphic_plan.data_source_names)
+    return current_app.config.data_backend_writer.get_active_upload_ids(
+        sorted(data_source_names)
+    )
+
+
+def get_data_version_for_pages(available_pages_dict: dict) -> dict:
+    """
+    :param available_pages_dict: dict of page plans keyed by url endpoint, see make_pages_dict
+    :return: the data version of every graphic of the dashboards, see get_data_version_for_graphics
+    """
+    return get_data_version_for_graphics(
+        graphic_plan
+        for page_plan in available_pages_dict.values()
+        for graphic_plan in page_plan.values()
+    )
+
+
+def prewarm_pages(available_pages_dict: dict):
+    """
+    Renders the default state of every graphic of the dashboards into the graphic and render caches.
+    Graphics that are already cached for the current data are not rendered again
+    :param available_pages_dict: dict of page plans keyed by url endpoint, see make_pages_dict
+    """
+    for page_plan in available_pages_dict.values():
+        graphic_object_dict = {
+            graphic_name: graphic_plan.make_graphic_object()
+            for graphic_name, graphic_plan in page_plan.items()
         }
-        plot_specs.append(html_dict)
-    return plot_specs
+        query_planner = PageQueryPlanner()
+        data_sources_keys = {
+            graphic_name: plan_graphic_queries(query_planner, graphic_object)
+            for graphic_name, graphic_object in graphic_object_dict.items()
+        }
+        # one graphic at a time, to leave the database to the viewers
+        for graphic_name, graphic_object in graphic_object_dict.items():
+            get_graphic_info(
+                graphic_name,
+                graphic_object,
+                page_plan[graphic_name].config_cache_key,
+                [make_graphic_select_info, make_graphic_plot_info],
+                query_planner,
+                data_sources_keys[graphic_name],
+                allow_stale=False,
+            )
 
 
 def create_labels_for_available_pages(available_pages_list: list) -> list:
@@ -114,9 +476,10 @@ def create_labels_for_available_pages(available_pages_list: list) -> list:
 def make_pages_dict(available_pages_list, config_file_folder) -> dict:
     """
     Pulls in all the config files referenced in the main config to make a large dictionary.
+    Needs an app context, see GraphicPlan
     :param config_file_folder:
     :param available_pages_list:
-    :return:
+    :return: dict of page plans keyed by url endpoint, see make_page_plan
     """
     available_pages_dict = {}
     for page in available_pages_list:
@@ -130,7 +493,7 @@ def make_pages_dict(available_pages_list, config_file_folder) -> dict:
                 0
             ]
             page_dict[graphic_key] = config_dict
-        available_pages_dict[page[URL_ENDPOINT]] = page_dict
+        available_pages_dict[page[URL_ENDPOINT]] = make_page_plan(page_dict)
     return available_pages_dict
 
 
@@ -0,0 +1,145 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from itertools import chain
+
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from sqlalchemy.types import Integer, Float, Numeric, String, DateTime, Date, Boolean
+
+from database.sql_handler import CopyStreamReader
+
+
+# checked in order, the first sqlalchemy type a column is an instance of sets its arrow type
+ARROW_TYPE_BY_SQL_TYPE = [
+    (Boolean, pa.bool_()),
+    (Integer, pa.int64()),
+    (Float, pa.float64()),
+    (Numeric, pa.float64()),
+    (String, pa.string()),
+    (DateTime, pa.timestamp("us")),
+    (Date, pa.date32()),
+]
+
+
+def get_arrow_type(sql_type) -> pa.DataType:
+    """
+    :param sql_type: sqlalchemy type instance of a query column
+    :return: arrow type for the column, string for the types without a direct match,
+    which are exported in their postgres text format
+    """
+    for sql_type_class, arrow_type in ARROW_TYPE_BY_SQL_TYPE:
+        if isinstance(sql_type, sql_type_class):
+            return arrow_type
+    return pa.string()
+
+
+def get_arrow_schema(query, column_names: list) -> pa.Schema:
+    """
+    :param query: sqlalchemy query object
+    :param column_names: names of the query columns in the export, in query order
+    :return: arrow schema for the query results
+    """
+    return pa.schema(
+        [
+            pa.field(column_name, get_arrow_type(column["type"]))
+            for column_name, column in zip(column_names, query.column_descriptions)
+        ]
+    )
+
+
+def csv_chunks_to_record_batches(csv_chunks, schema: pa.Schema, chunk_size: int):
+    """
+    Parses the csv that postgres streams with COPY (query) TO STDOUT into arrow record batches,
+    column by column in arrow, without building a python object for every value
+    :param csv_chunks: iterable of csv bytes chunks without a header row,
+    see psycopg2_copy_query_to_csv_chunks
+    :param schema: arrow schema of the query results, see get_arrow_schema
+    :param chunk_size: maximum number of rows per record batch
+    :return: generator of arrow record batches
+    """
+    csv_chunks = iter(csv_chunks)
+    first_chunk = next(csv_chunks, None)
+    # the arrow csv reader doesn't take an empty file
+    if first_chunk is None:
+        return
+    reader = pcsv.open_csv(
+        CopyStreamReader(chain([first_chunk], csv_chunks)),
+        read_options=pcsv.ReadOptions(column_names=schema.names),
+        parse_options=pcsv.ParseOptions(newlines_in_values=True),
+        convert_options=pcsv.ConvertOptions(
+            column_types=schema,
+            # COPY writes nulls unquoted and empty strings quoted
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=["t"],
+            false_values=["f"],
+        ),
+    )
+    for record_batch in reader:
+        # the reader batches by bytes, slicing doesn't copy the columns
+        for offset in range(0, record_batch.num_rows, chunk_size):
+            yield record_batch.slice(offset, chunk_size)
+
+
+class ChunkSink:
+    """
+    Write-only file-like object that collects what is written until it is taken,
+    so arrow writers can be streamed out as they go
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def record_batches_to_arrow_stream_chunks(schema: pa.Schema, record_batches):
+    """
+    :param schema: arrow schema of the record batches
+    :param record_batches: iterable of arrow record batches
+    :return: generator of bytes of the arrow IPC stream format
+    """
+    sink = ChunkSink()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema) as writer:
+        yield sink.take()
+        for record_batch in record_batches:
+            writer.write_batch(record_batch)
+            yield sink.take()
+    yield sink.take()
+
+
+def record_batches_to_parquet_chunks(schema: pa.Schema, record_batches):
+    """
+    Writes each record batch as a parquet row group, so only one batch is held in memory
+    :param schema: arrow schema of the record batches
+    :param record_batches: iterable of arrow record batches
+    :return: generator of bytes of the parquet file
+    """
+    sink = ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema) as writer:
+        for record_batch in record_batches:
+            writer.write_table(pa.Table.from_batches([record_batch], schema=schema))
+            yield sink.take()
+    yield sink.take()
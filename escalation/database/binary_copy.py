@@ -0,0 +1,265 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+"""
+Encodes dataframes in the postgres binary COPY format, see:
+https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+Numbers and datetimes are written as their binary values straight from the numpy columns,
+rather than formatted as text by pandas and parsed again by postgres
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.types import (
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    SmallInteger,
+    REAL,
+    String,
+)
+
+BINARY_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + np.array([0, 0], dtype=">i4").tobytes()
+BINARY_COPY_TRAILER = np.array([-1], dtype=">i2").tobytes()
+NULL_FIELD_LENGTH = -1
+# postgres dates and timestamps count from 2000-01-01
+POSTGRES_EPOCH = np.datetime64("2000-01-01")
+TEXT_SEPARATOR = "\x00"
+# rows encoded at a time, which bounds the memory of the byte offsets of the interleave
+BINARY_COPY_SLICE_ROWS = 100000
+
+
+class BinaryCopyUnsupported(ValueError):
+    """Raised for a column that can't be written in the binary format"""
+
+    pass
+
+
+def encode_integer_column(width: int):
+    bounds = np.iinfo(f"i{width}")
+
+    def encode(column: pd.Series):
+        if not (
+            pd.api.types.is_integer_dtype(column)
+            or pd.api.types.is_bool_dtype(column)
+        ):
+            # pandas stores integers with nulls as floats
+            if not pd.api.types.is_float_dtype(column) or (
+                column.dropna() % 1 != 0
+            ).any():
+                raise BinaryCopyUnsupported(f"{column.name} is not an integer column")
+        null_mask = column.isna().to_numpy()
+        values = column.fillna(0).to_numpy().astype("int64")
+        if len(values) and (values.min() < bounds.min or values.max() > bounds.max):
+            raise ValueError(f"{column.name} has values out of range for its column")
+        return values.astype(f">i{width}"), null_mask
+
+    return encode
+
+
+def encode_float_column(width: int):
+    def encode(column: pd.Series):
+        if not (
+            pd.api.types.is_numeric_dtype(column)
+            and not pd.api.types.is_bool_dtype(column)
+        ):
+            raise BinaryCopyUnsupported(f"{column.name} is not a numerical column")
+        null_mask = column.isna().to_numpy()
+        values = column.to_numpy(dtype="float64", na_value=0)
+        return values.astype(f">f{width}"), null_mask
+
+    return encode
+
+
+def encode_boolean_column(column: pd.Series):
+    null_mask = column.isna().to_numpy()
+    # pandas stores booleans with nulls as objects
+    if not pd.api.types.is_bool_dtype(column) and not all(
+        isinstance(value, (bool, np.bool_)) for value in column[~null_mask]
+    ):
+        raise BinaryCopyUnsupported(f"{column.name} is not a boolean column")
+    return column.fillna(False).to_numpy().astype("uint8"), null_mask
+
+
+def get_datetime_values(column: pd.Series):
+    # timezone aware datetimes are converted by postgres depending on the column type
+    if not pd.api.types.is_datetime64_dtype(column):
+        raise BinaryCopyUnsupported(f"{column.name} is not a datetime column")
+    null_mask = column.isna().to_numpy()
+    values = column.to_numpy(dtype="datetime64[us]").copy()
+    values[null_mask] = POSTGRES_EPOCH
+    return values, null_mask
+
+
+def encode_datetime_column(column: pd.Series):
+    values, null_mask = get_datetime_values(column)
+    microseconds = (values - POSTGRES_EPOCH).astype("int64")
+    return microseconds.astype(">i8"), null_mask
+
+
+def encode_date_column(column: pd.Series):
+    values, null_mask = get_datetime_values(column)
+    if (values != values.astype("datetime64[D]")).any():
+        raise BinaryCopyUnsupported(f"{column.name} has times in a date column")
+    days = (values.astype("datetime64[D]") - POSTGRES_EPOCH).astype("int64")
+    return days.astype(">i4"), null_mask
+
+
+def encode_text_column(column: pd.Series, encoding: str):
+    null_mask = column.isna().to_numpy()
+    # e.g. numbers in a text column, formatted by pandas as for csv
+    values = column[~null_mask].astype(str).tolist()
+    # postgres text can't hold NUL characters, which makes them a safe separator,
+    # so the column is encoded at once rather than value by value
+    buffer = np.frombuffer(TEXT_SEPARATOR.join(values).encode(encoding), dtype="uint8")
+    is_separator = buffer == 0
+    separator_positions = np.flatnonzero(is_separator)
+    if len(separator_positions) != max(len(values) - 1, 0):
+        raise BinaryCopyUnsupported(f"{column.name} has NUL characters")
+    value_ends = np.append(separator_positions, len(buffer))
+    lengths = np.zeros(len(column), dtype="int64")
+    lengths[~null_mask] = np.diff(value_ends, prepend=-1) - 1
+    return buffer[~is_separator], lengths, null_mask
+
+
+# checked in order, the first sqlalchemy type a column is an instance of sets its encoder
+FIXED_WIDTH_ENCODER_BY_SQL_TYPE = [
+    (Boolean, encode_boolean_column),
+    (SmallInteger, encode_integer_column(2)),
+    (BigInteger, encode_integer_column(8)),
+    (Integer, encode_integer_column(4)),
+    (REAL, encode_float_column(4)),
+    (Float, encode_float_column(8)),
+    (DateTime, encode_datetime_column),
+    (Date, encode_date_column),
+]
+
+
+def get_column_encoder(sql_type):
+    """
+    :param sql_type: sqlalchemy type instance of a table column
+    :return: function encoding a dataframe column for the table column, or None if the
+    type isn't supported (e.g. arrays, json and numeric), in which case the csv format is used
+    """
+    # timezone aware timestamps take the same binary values, but are not produced by pandas
+    if isinstance(sql_type, DateTime) and sql_type.timezone:
+        return None
+    for sql_type_class, encoder in FIXED_WIDTH_ENCODER_BY_SQL_TYPE:
+        if isinstance(sql_type, sql_type_class):
+            return encoder
+    if isinstance(sql_type, String):
+        return encode_text_column
+    return None
+
+
+def supports_binary_copy(column_types: list) -> bool:
+    """
+    :param column_types: sqlalchemy type instances of the columns of a table
+    :return: whether all of the columns can be written in the binary format
+    """
+    return all(get_column_encoder(sql_type) is not None for sql_type in column_types)
+
+
+def encode_column_pieces(column: pd.Series, sql_type, encoding: str) -> list:
+    """
+    :param encoding: python codec of the client encoding of the connection, for text
+    :return: list of (uint8 buffer, per row sizes) tuples, for the field length and the
+    field value of each row
+    """
+    encoder = get_column_encoder(sql_type)
+    null_mask = column.isna().to_numpy()
+    if null_mask.all():
+        # pandas gives a column of nulls a float or object dtype
+        buffer = np.empty(0, dtype="uint8")
+        value_sizes = np.zeros(len(column), dtype="int64")
+    elif encoder is encode_text_column:
+        buffer, value_sizes, null_mask = encoder(column, encoding)
+    else:
+        values, null_mask = encoder(column)
+        # null values are left out of the buffer
+        values = values[~null_mask]
+        buffer = values.view("uint8")
+        value_sizes = np.where(null_mask, 0, values.itemsize)
+    field_lengths = np.where(null_mask, NULL_FIELD_LENGTH, value_sizes).astype(">i4")
+    return [
+        (field_lengths.view("uint8"), np.full(len(column), 4)),
+        (buffer, value_sizes),
+    ]
+
+
+def encode_df_as_binary_copy(
+    df: pd.DataFrame, column_types: list, encoding: str = "utf-8"
+) -> bytes:
+    """
+    Encodes the rows of a dataframe as binary COPY tuples, without the header and trailer,
+    BINARY_COPY_SLICE_ROWS rows at a time
+    :param df: dataframe with the columns in the order of the table
+    :param column_types: sqlalchemy type instances of the table columns
+    :param encoding: python codec of the client encoding of the connection, for text
+    :return: bytes of the binary COPY tuples
+    Raises BinaryCopyUnsupported if a column doesn't have a dtype that can be written to its table column
+    """
+    return b"".join(
+        encode_df_slice_as_binary_copy(
+            df.iloc[start : start + BINARY_COPY_SLICE_ROWS], column_types, encoding
+        )
+        for start in range(0, len(df), BINARY_COPY_SLICE_ROWS)
+    )
+
+
+def encode_df_slice_as_binary_copy(
+    df: pd.DataFrame, column_types: list, encoding: str
+) -> bytes:
+    """
+    Each column is encoded as a whole, then the fields are interleaved into rows with numpy
+    """
+    num_rows = len(df)
+    pieces = [
+        (
+            np.tile(np.array([len(df.columns)], dtype=">i2").view("uint8"), num_rows),
+            np.full(num_rows, 2),
+        )
+    ]
+    for column_name, sql_type in zip(df.columns, column_types):
+        pieces.extend(encode_column_pieces(df[column_name], sql_type, encoding))
+    # the output is laid out row by row and piece by piece within the rows,
+    # so the start of each piece in the output is the running total of the sizes
+    piece_sizes = np.stack([sizes for _, sizes in pieces], axis=1).astype("int64")
+    flat_piece_sizes = piece_sizes.ravel()
+    piece_starts = (np.cumsum(flat_piece_sizes) - flat_piece_sizes).reshape(
+        piece_sizes.shape
+    )
+    output = np.empty(int(flat_piece_sizes.sum()), dtype="uint8")
+    for piece_index, (buffer, sizes) in enumerate(pieces):
+        sizes = piece_sizes[:, piece_index]
+        # each byte of the buffer moves by the offset of its row's piece in the output
+        buffer_starts = np.cumsum(sizes) - sizes
+        offsets = np.repeat(piece_starts[:, piece_index] - buffer_starts, sizes)
+        output[np.arange(len(buffer)) + offsets] = buffer
+    return output.tobytes()
+
+
+def make_binary_copy_chunks(
+    df_chunks, column_types: list, encoding: str, csv_dfs: list
+):
+    """
+    Encodes a stream of dataframes as a binary COPY stream, header and trailer included.
+    The stream ends early at the first dataframe that can't be encoded,
+    which is added to csv_dfs so the rest of the stream can be sent as csv
+    :param df_chunks: iterator of dataframes, with the columns in the order of the table
+    :param column_types: sqlalchemy type instances of the table columns
+    :param encoding: python codec of the client encoding of the connection, for text
+    :param csv_dfs: list the dataframe that couldn't be encoded is added to
+    :return: generator of bytes
+    """
+    yield BINARY_COPY_HEADER
+    for df in df_chunks:
+        try:
+            chunk = encode_df_as_binary_copy(df, column_types, encoding)
+        except BinaryCopyUnsupported:
+            csv_dfs.append(df)
+            break
+        yield chunk
+    yield BINARY_COPY_TRAILER
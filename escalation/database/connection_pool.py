@@ -0,0 +1,46 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from sqlalchemy import create_engine
+
+from utility.constants import (
+    SQLALCHEMY_DATABASE_URI,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT_SECONDS,
+    DATABASE_POOL_RECYCLE_SECONDS,
+    DATABASE_POOL_PRE_PING,
+)
+
+
+def create_pooled_engine(app_config):
+    """
+    Creates the single engine of the app. Its connection pool serves both the ORM session
+    and the raw psycopg2 connections used for COPY, see engine.raw_connection()
+    :param app_config: flask app config with the DATABASE_POOL settings
+    :return: sqlalchemy engine
+    """
+    return create_engine(
+        app_config[SQLALCHEMY_DATABASE_URI],
+        convert_unicode=True,
+        pool_size=app_config[DATABASE_POOL_SIZE],
+        max_overflow=app_config[DATABASE_POOL_MAX_OVERFLOW],
+        pool_timeout=app_config[DATABASE_POOL_TIMEOUT_SECONDS],
+        pool_recycle=app_config[DATABASE_POOL_RECYCLE_SECONDS],
+        pool_pre_ping=app_config[DATABASE_POOL_PRE_PING],
+    )
+
+
+def get_pool_statistics(engine) -> dict:
+    """
+    :param engine: sqlalchemy engine with a QueuePool
+    :return: dict of the number of connections in the pool, by state
+    """
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        # negative while the pool has not yet opened pool_size connections
+        "overflow": pool.overflow(),
+    }
@@ -10,11 +10,19 @@ class DataHandler(ABC):
         pass
 
     @abstractmethod
-    def get_column_data(self, cols: set, filters: dict) -> list:
+    def get_column_data(
+        self,
+        cols: set,
+        filters: dict,
+        max_rows: int = None,
+        max_rows_fallback: str = None,
+    ) -> list:
         """
         :param cols: set of column names, including all columns for which data should be returned
         :param filters: a dict keyed by column name and valued with the filters to be applied
         # todo: document the filtering allowed: equality, presence in list, inequality?
+        :param max_rows: Optional maximum number of rows to return
+        :param max_rows_fallback: Optional SAMPLE_ROWS or REFUSE_ROWS- what to do when over max_rows
         :return: a dict keyed by column name and valued with lists of row datapoints for the column
         """
         pass
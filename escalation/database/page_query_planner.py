@@ -0,0 +1,179 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from collections import defaultdict
+import threading
+
+from utility.cache import make_cache_key
+from utility.constants import DATA_NOTICE
+
+
+class PageQueryPlanner:
+    """
+    Shares the queries of the graphics of one page request.
+    Graphics reading the same data sources with the same filters and row budget are fetched
+    in a single query for the union of their columns, and each graphic gets its own columns.
+    Unique entries are fetched once per data sources and filters, for all of the columns
+    of the graphics using them.
+    Build one per request, plan every graphic, then get the data handlers of the graphics
+    """
+
+    def __init__(self):
+        self.column_data_groups = defaultdict(set)
+        self.unique_entry_groups = defaultdict(list)
+        self.graphic_counts = defaultdict(int)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_column_data_key(
+        data_sources_key: str, filters: list, max_rows: int, max_rows_fallback: str
+    ) -> str:
+        return make_cache_key(
+            "column_data", data_sources_key, filters, max_rows, max_rows_fallback
+        )
+
+    @staticmethod
+    def get_unique_entries_key(data_sources_key: str, filters: list) -> str:
+        return make_cache_key("unique_entries", data_sources_key, filters)
+
+    def plan_graphic(
+        self,
+        data_sources: dict,
+        columns: set,
+        filters: list,
+        max_rows: int,
+        max_rows_fallback: str,
+        unique_entry_columns: list,
+    ) -> str:
+        """
+        Adds the queries of a graphic to the plan.
+        Call before the data handler of the graphic is built, as it adds to the data sources
+        :param data_sources: data sources of the graphic config
+        :param columns: set of columns of the graphic data, see get_column_data
+        :param filters: filters of the graphic
+        :param max_rows: row budget of the graphic
+        :param max_rows_fallback: what to do when over max_rows
+        :param unique_entry_columns: list of columns of the graphic selectors, see get_column_unique_entries
+        :return: key of the data sources, to pass to get_data_handler
+        """
+        data_sources_key = make_cache_key(data_sources)
+        column_data_key = self.get_column_data_key(
+            data_sources_key, filters, max_rows, max_rows_fallback
+        )
+        self.column_data_groups[column_data_key].update(columns)
+        self.graphic_counts[column_data_key] += 1
+        unique_entries_key = self.get_unique_entries_key(data_sources_key, filters)
+        group_columns = self.unique_entry_groups[unique_entries_key]
+        group_columns.extend(
+            column for column in unique_entry_columns if column not in group_columns
+        )
+        self.graphic_counts[unique_entries_key] += 1
+        return data_sources_key
+
+    def get_data_handler(self, data_handler, data_sources_key: str):
+        """
+        :param data_handler: DataHandler instance of a planned graphic
+        :param data_sources_key: as returned by plan_graphic for the graphic
+        :return: data handler sharing the planned queries
+        """
+        return CoalescedDataHandler(self, data_handler, data_sources_key)
+
+    def is_shared(self, group_key: str) -> bool:
+        return self.graphic_counts.get(group_key, 0) > 1
+
+    def fetch_once(self, group_key: str, fetch):
+        """
+        Runs the fetch of a group the first time it is needed, graphics assembled
+        in other threads wait for it rather than running their own
+        :param group_key: key of the query group
+        :param fetch: function returning the result of the group
+        :return: the result, or None if the fetch failed
+        """
+        with self._lock:
+            if group_key not in self._results:
+                self._results[group_key] = [threading.Lock(), False, None]
+            result_entry = self._results[group_key]
+        fetch_lock = result_entry[0]
+        with fetch_lock:
+            if not result_entry[1]:
+                try:
+                    result_entry[2] = fetch()
+                except Exception:
+                    # e.g. a bad column in one graphic- each graphic runs its own query
+                    result_entry[2] = None
+                result_entry[1] = True
+        return result_entry[2]
+
+
+class CoalescedDataHandler:
+    """
+    Data handler of a single graphic that serves the planned queries from the shared results
+    of its page. Calls that weren't planned go straight to the graphic's own data handler
+    """
+
+    def __init__(
+        self, query_planner: PageQueryPlanner, data_handler, data_sources_key: str
+    ):
+        self.query_planner = query_planner
+        self.data_handler = data_handler
+        self.data_sources_key = data_sources_key
+
+    def __getattr__(self, name):
+        return getattr(self.data_handler, name)
+
+    def get_column_data(
+        self,
+        columns: set,
+        filters: list = None,
+        max_rows: int = None,
+        max_rows_fallback: str = None,
+    ):
+        if filters is None:
+            filters = []
+        group_key = self.query_planner.get_column_data_key(
+            self.data_sources_key, filters, max_rows, max_rows_fallback
+        )
+        group_columns = self.query_planner.column_data_groups.get(group_key, set())
+        if self.query_planner.is_shared(group_key) and columns <= group_columns:
+            group_data = self.query_planner.fetch_once(
+                group_key,
+                lambda: self.data_handler.get_column_data(
+                    set(group_columns), list(filters), max_rows, max_rows_fallback
+                ),
+            )
+            # over the row budget, the sampled or aggregated rows depend on the columns
+            if group_data is not None and group_data.attrs.get(DATA_NOTICE) is None:
+                graphic_data = group_data[list(columns)].copy()
+                graphic_data.attrs[DATA_NOTICE] = None
+                return graphic_data
+        return self.data_handler.get_column_data(
+            columns, filters, max_rows, max_rows_fallback
+        )
+
+    def get_column_unique_entries(
+        self, cols: list, filter_active_data: bool = True, filters: list = None
+    ) -> dict:
+        if filters is None:
+            filters = []
+        group_key = self.query_planner.get_unique_entries_key(
+            self.data_sources_key, filters
+        )
+        group_columns = self.query_planner.unique_entry_groups.get(group_key, [])
+        if (
+            filter_active_data
+            and self.query_planner.is_shared(group_key)
+            and set(cols) <= set(group_columns)
+        ):
+            group_entries = self.query_planner.fetch_once(
+                group_key,
+                lambda: self.data_handler.get_column_unique_entries(
+                    list(group_columns), filters=filters
+                ),
+            )
+            if group_entries is not None:
+                # graphics sort and add to their entry lists
+                return {col: list(group_entries[col]) for col in cols}
+        return self.data_handler.get_column_unique_entries(
+            cols, filter_active_data, filters
+        )
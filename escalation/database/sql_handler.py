@@ -1,17 +1,31 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
 from collections import OrderedDict, defaultdict
+import csv
 from datetime import datetime
 from io import StringIO
-import sys
+from itertools import chain, islice
+import queue
+import threading
+import zlib
 
 from flask import current_app
 import pandas as pd
 import psycopg2
-from sqlalchemy import and_, func, create_engine, MetaData, Column, Table
+from sqlalchemy import (
+    and_,
+    cast,
+    func,
+    literal,
+    null,
+    MetaData,
+    Column,
+    Table,
+)
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.types import (
     Integer,
+    String,
     Text,
     DateTime,
     Float,
@@ -23,8 +37,16 @@ from sqlalchemy.types import (
     Interval,
 )
 
+from database import binary_copy
 from database.data_handler import DataHandler
-from database.utils import sql_handler_filter_operation
+from database.statement_cache import CachedStatement, get_cached_statement
+from database.utils import (
+    sql_handler_filter_operation,
+    get_filter_shape,
+    get_filter_param,
+)
+from utility.cache import make_cache_key
+from utility.exceptions import ValidationError
 
 from utility.constants import (
     DATA_SOURCE_TYPE,
@@ -43,7 +65,6 @@ from utility.constants import (
     ADDITIONAL_DATA_SOURCES,
     DATA_UPLOAD_METADATA,
     ACTIVE,
-    SQLALCHEMY_DATABASE_URI,
     SELECTOR_TYPE,
     NUMERICAL_FILTER,
     USERNAME,
@@ -51,6 +72,18 @@ from utility.constants import (
     NOTES,
     DATETIME_FORMAT,
     MAX_ENTRIES_FOR_FILTER_SELECTOR,
+    TABLE_NAME,
+    QUERY_FETCH_ENGINE,
+    COPY_FETCH_ENGINE,
+    QUERY_FETCH_CHUNK_SIZE,
+    GRAPHIC_MAX_ROWS,
+    GRAPHIC_MAX_ROWS_FALLBACK,
+    REFUSE_ROWS,
+    DATA_NOTICE,
+    CSV_FORMAT,
+    ARROW_FORMAT,
+    PARQUET_FORMAT,
+    UPLOAD_CHUNK_SIZE,
 )
 
 # from: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.api.types.infer_dtype.html
@@ -75,6 +108,20 @@ SQL_DATA_TYPE_MAP = {
 }
 
 
+# resolved once per declarative base, see get_sqlalchemy_model_class_for_data_upload_metadata
+DATA_UPLOAD_METADATA_CLASS_BY_BASE = {}
+
+# column types psycopg2_copy_query_to_df can parse back from csv into the same values as the ORM
+COPY_FETCH_COLUMN_TYPES = (Integer, Float, String, DateTime, Boolean)
+COPY_CSV_NULL = r"\N"
+# csv streamed with COPY TO STDOUT is handed over in chunks of about this size,
+# with at most COPY_STREAM_QUEUE_CHUNKS waiting to be sent
+COPY_STREAM_CHUNK_BYTES = 1024 ** 2
+COPY_STREAM_QUEUE_CHUNKS = 4
+# planner estimates can be off either way, only an estimate this many times over
+# the row budget of a graphic skips fetching the query to check it
+MAX_ROWS_ESTIMATE_MARGIN = 2
+
 REPLACE = "replace"
 APPEND = "append"
 FAIL = "fail"
@@ -84,45 +131,415 @@ def connect_to_db_using_psycopg2():
     # bulk copy of the contents using psycopg2 copy_from, which is much faster, see:
     # https://naysan.ca/2020/05/09/pandas-to-postgresql-using-psycopg2-bulk-insert-performance-benchmark/
 
-    """ Connect to the PostgreSQL database server """
-    url_obj = current_app.config[SQLALCHEMY_DATABASE_URI]
-    psycopg2_config_dict = {
-        "host": url_obj.host,
-        "database": url_obj.database,
-        "user": url_obj.username,
-        "password": url_obj.password,
-    }
-    try:
-        # connect to the PostgreSQL server
-        conn = psycopg2.connect(**psycopg2_config_dict)
-    except (Exception, psycopg2.DatabaseError) as error:
-        print(error)
-        sys.exit(1)
-    return conn
+    """
+    Checks out a psycopg2 connection from the connection pool of the app.
+    Close it to return it to the pool, e.g. in a finally block
+    """
+    return current_app.engine.raw_connection()
+
+
+class CopyStreamReader:
+    """
+    File-like object for psycopg2 copy_expert that reads from an iterable of strings or bytes,
+    so each chunk is built only when COPY is ready for it.
+    An exception raised while building the chunks is kept in self.error,
+    as psycopg2 replaces it with its own error when it aborts the copy
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = None
+        self.position = 0
+        self.error = None
+        # checked by the arrow file wrappers
+        self.closed = False
+
+    def read(self, size=-1):
+        try:
+            while self.buffer is None or size < 0 or len(self.buffer) - self.position < size:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                # keep the position in the buffer rather than slicing it on every read
+                self.buffer = (
+                    chunk if self.buffer is None else self.buffer[self.position :] + chunk
+                )
+                self.position = 0
+        except Exception as error:
+            self.error = error
+            raise
+        if self.buffer is None:
+            return ""
+        end = len(self.buffer) if size < 0 else self.position + size
+        data = self.buffer[self.position : end]
+        self.position += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def __iter__(self):
+        # pandas only takes file-like objects that are iterable, though it reads them with read
+        while True:
+            data = self.read(COPY_STREAM_CHUNK_BYTES)
+            if not data:
+                return
+            yield data
 
 
-def psycopg2_copy_from_stringio(conn, df, table_name):
+def get_csv_dtypes_for_table(table) -> dict:
+    """
+    :param table: sqlalchemy table
+    :return: dict of the pandas dtypes to read the text and number columns of the table as,
+    for read_csv
     """
-    Here we are going save the dataframe in memory
-    and use copy_from() to copy it to the table
+    dtypes = {}
+    for column in table.columns:
+        if isinstance(column.type, String):
+            dtypes[column.name] = str
+        elif isinstance(column.type, Integer):
+            dtypes[column.name] = "Int64"
+        elif isinstance(column.type, Float):
+            dtypes[column.name] = "float64"
+    return dtypes
+
+
+def psycopg2_copy_from_df_chunks(conn, df_chunks, table_name, column_types=None):
     """
-    # save dataframe to an in-memory buffer to use with copy_from, which requires fil
-    buffer = StringIO()
-    df.to_csv(buffer, index=False, header=False)
-    buffer.seek(0)
+    Copies a stream of dataframes to a table in a single transaction.
+    The dataframes are serialized one at a time as the copy reads them,
+    so the stream can be larger than memory.
+    When the types of the table columns can all be written in the binary format,
+    the stream is copied in it, until a dataframe that can't be encoded for them:
+    that dataframe and the rest of the stream are then copied as csv, by a second COPY.
+    Raises the error of the stream or the database after rolling back
+    :param conn: psycopg2 connection
+    :param df_chunks: iterable of dataframes, with the columns in the order of the table
+    :param table_name: name of the table to write to
+    :param column_types: optional list of the sqlalchemy type instances of the table columns
+    """
+    df_chunks = iter(df_chunks)
+    # text is sent in the client encoding, as psycopg2 does for the csv
+    encoding = psycopg2.extensions.encodings[conn.encoding]
+    reader = None
     cursor = conn.cursor()
-    # todo: assert that the column order matches expectation
     try:
+        if column_types is not None and binary_copy.supports_binary_copy(column_types):
+            csv_dfs = []
+            reader = CopyStreamReader(
+                binary_copy.make_binary_copy_chunks(
+                    df_chunks, column_types, encoding, csv_dfs
+                )
+            )
+            cursor.copy_expert(f"copy {table_name} from stdin (format binary)", reader)
+            if not csv_dfs:
+                conn.commit()
+                return
+            df_chunks = chain(csv_dfs, df_chunks)
+        reader = CopyStreamReader(
+            df.to_csv(index=False, header=False) for df in df_chunks
+        )
         # issues with separators here cause Error: extra data after last expected column
-        cursor.copy_expert(f"copy {table_name} from stdin (format csv)", buffer)
+        cursor.copy_expert(f"copy {table_name} from stdin (format csv)", reader)
         conn.commit()
+    except Exception as error:
+        conn.rollback()
+        if reader is not None and reader.error is not None:
+            raise reader.error from error
+        raise
+    finally:
+        cursor.close()
+
+
+def psycopg2_copy_from_stringio(conn, df, table_name, column_types=None):
+    """
+    Copies a dataframe to a table
+    :param column_types: optional list of the sqlalchemy type instances of the table columns,
+    for writing in the binary format
+    :return: whether the copy succeeded
+    """
+    # todo: assert that the column order matches expectation
+    try:
+        psycopg2_copy_from_df_chunks(conn, [df], table_name, column_types)
         return True
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error: {error}")
-        conn.rollback()
         return False
+
+
+def psycopg2_compile_query(statement, cursor) -> str:
+    """
+    Renders a compiled statement as a sql string with its parameters bound,
+    for use in statements that wrap it (e.g. COPY and EXPLAIN)
+    :param statement: CachedStatement
+    :param cursor: psycopg2 cursor used to quote the parameters
+    :return: sql string
+    """
+    return cursor.mogrify(
+        statement.compiled.string, statement.get_bound_params()
+    ).decode(psycopg2.extensions.encodings[cursor.connection.encoding])
+
+
+def psycopg2_estimate_query_rows(statement) -> int:
+    """
+    Asks the postgres planner how many rows a query returns, without running it.
+    Cheap, and usually within an order of magnitude for simple filters and joins
+    :param statement: CachedStatement
+    :return: estimated number of rows
+    """
+    conn = current_app.db_session.connection().connection
+    with conn.cursor() as cursor:
+        select_sql = psycopg2_compile_query(statement, cursor)
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {select_sql}")
+        query_plan = cursor.fetchone()[0]
+    return int(query_plan[0]["Plan"]["Plan Rows"])
+
+
+class CopyStreamCancelled(Exception):
+    pass
+
+
+class CopyStreamWriter:
+    """
+    File-like object for psycopg2 copy_expert that hands the COPY output to another thread in
+    chunks of about chunk_bytes, blocking while chunk_queue is full
+    """
+
+    def __init__(self, chunk_queue, cancelled, chunk_bytes: int):
+        self.chunk_queue = chunk_queue
+        self.cancelled = cancelled
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+
+    def write(self, data):
+        # psycopg2 writes the rows one at a time
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                # raising in write aborts the copy
+                raise CopyStreamCancelled
+            try:
+                self.chunk_queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def psycopg2_copy_to_queue(conn, copy_sql: str, chunk_queue, cancelled):
+    """
+    Runs a COPY ... TO STDOUT statement, putting the output on chunk_queue, see CopyStreamWriter.
+    Meant to run in its own thread. The output is followed by None when the copy finishes,
+    or by the exception that stopped it. Setting cancelled aborts the copy
+    :param conn: psycopg2 connection
+    :param copy_sql: COPY statement
+    :param chunk_queue: bounded queue.Queue
+    :param cancelled: threading.Event
+    """
+    writer = CopyStreamWriter(chunk_queue, cancelled, COPY_STREAM_CHUNK_BYTES)
+    try:
+        with conn.cursor() as copy_cursor:
+            copy_cursor.copy_expert(copy_sql, writer)
+        writer.flush()
+        writer.put(None)
+    except CopyStreamCancelled:
+        pass
+    except Exception as error:
+        try:
+            writer.put(error)
+        except CopyStreamCancelled:
+            pass
+
+
+def psycopg2_copy_query_to_csv_chunks(query, header: list = None):
+    """
+    Runs a query using COPY (query) TO STDOUT, yielding the csv as it arrives from postgres.
+    The copy runs in a separate thread on its own pooled connection, at most
+    COPY_STREAM_QUEUE_CHUNKS chunks ahead of the consumer, so memory use doesn't depend on
+    the size of the response. The query is compiled right away, so the returned generator
+    doesn't need an app context. The connection is only checked out once the generator
+    is iterated, so a generator that is never iterated doesn't hold one.
+    :param query: sqlalchemy query object
+    :param header: optional list of column names to write as the first row
+    :return: generator of csv bytes chunks
+    """
+    bind = query.session.get_bind()
+    statement = CachedStatement.from_query(query)
+    chunk_queue = queue.Queue(maxsize=COPY_STREAM_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def csv_chunks():
+        conn = bind.raw_connection()
+        copy_thread = None
+        finished = False
+        try:
+            with conn.cursor() as cursor:
+                select_sql = psycopg2_compile_query(statement, cursor)
+            encoding = psycopg2.extensions.encodings[conn.connection.encoding]
+            copy_thread = threading.Thread(
+                target=psycopg2_copy_to_queue,
+                args=(
+                    conn,
+                    f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv)",
+                    chunk_queue,
+                    cancelled,
+                ),
+                daemon=True,
+            )
+            copy_thread.start()
+            if header:
+                header_buffer = StringIO()
+                csv.writer(header_buffer, lineterminator="\n").writerow(header)
+                yield header_buffer.getvalue().encode(encoding)
+            while True:
+                chunk = chunk_queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            finished = True
+        finally:
+            # the consumer may stop early, e.g. when a download is cancelled
+            cancelled.set()
+            if copy_thread is not None:
+                copy_thread.join()
+            if finished or copy_thread is None:
+                conn.close()
+            else:
+                # an aborted copy can leave the connection mid-copy, keep it out of the pool
+                conn.invalidate()
+
+    return csv_chunks()
+
+
+def gzip_chunks(chunks, level: int = zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Compresses a stream of bytes chunks on the fly into the gzip format
+    :param chunks: iterable of bytes
+    :param level: zlib compression level
+    :return: generator of gzip bytes chunks
+    """
+    compressor = zlib.compressobj(level, wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def psycopg2_copy_query_to_df(statement) -> pd.DataFrame:
+    """
+    Fetches the result of a query using COPY (query) TO STDOUT.
+    The rows are streamed as csv straight into the pandas csv parser,
+    skipping the python tuple that query.all() builds for every row.
+    The copy runs in a separate thread, at most COPY_STREAM_QUEUE_CHUNKS chunks ahead of
+    the parser, so the csv is never held in memory as a whole.
+    Only supports columns of the types in COPY_FETCH_COLUMN_TYPES
+    :param statement: CachedStatement
+    :return: dataframe keyed by the column labels of the query
+    """
+    # use the connection of the session so that the copy sees the same transaction
+    session_connection = current_app.db_session.connection()
+    conn = session_connection.connection
+    with conn.cursor() as cursor:
+        select_sql = psycopg2_compile_query(statement, cursor)
+    encoding = psycopg2.extensions.encodings[conn.encoding]
+    chunk_queue = queue.Queue(maxsize=COPY_STREAM_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    copy_thread = threading.Thread(
+        target=psycopg2_copy_to_queue,
+        args=(
+            conn,
+            f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, NULL '{COPY_CSV_NULL}')",
+            chunk_queue,
+            cancelled,
+        ),
+        daemon=True,
+    )
+    copy_ended = False
+
+    def csv_chunks():
+        nonlocal copy_ended
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is None:
+                copy_ended = True
+                return
+            if isinstance(chunk, Exception):
+                copy_ended = True
+                raise chunk
+            yield chunk
+
+    column_names = statement.column_names
+    dtypes = {}
+    date_columns = []
+    for column_name, column_type in zip(column_names, statement.column_types):
+        if isinstance(column_type, (String, Boolean)):
+            dtypes[column_name] = object
+        elif isinstance(column_type, DateTime):
+            date_columns.append(column_name)
+    copy_thread.start()
+    try:
+        response_as_df = pd.read_csv(
+            CopyStreamReader(csv_chunks()),
+            header=None,
+            names=column_names,
+            dtype=dtypes,
+            parse_dates=date_columns,
+            encoding=encoding,
+            # only the explicit null marker is missing data- empty strings stay empty strings
+            keep_default_na=False,
+            na_values=[COPY_CSV_NULL],
+        )
     finally:
-        cursor.close()
+        cancelled.set()
+        copy_thread.join()
+        if not copy_ended:
+            # the parser stopped mid-copy, which can leave the connection mid-copy
+            session_connection.invalidate()
+    for column_name, column_type in zip(column_names, statement.column_types):
+        if isinstance(column_type, Boolean):
+            response_as_df[column_name] = response_as_df[column_name].map(
+                {"t": True, "f": False}
+            )
+        if isinstance(column_type, (String, Boolean)):
+            # match the None that the ORM returns for nulls
+            response_as_df[column_name] = response_as_df[column_name].where(
+                response_as_df[column_name].notna(), None
+            )
+    return response_as_df
+
+
+def invalidate_data_caches():
+    """
+    Drops the cached upload metadata, query results and rendered graphics of this process,
+    and has the dashboards rendered again in the background.
+    Called whenever the uploaded data or the active status of an upload changes.
+    """
+    current_app.upload_metadata_registry.invalidate()
+    current_app.query_cache.clear()
+    current_app.graphic_cache.clear()
+    current_app.cache_prewarmer.request_refresh()
+
+
+def invalidate_table_definition_caches():
+    """
+    Drops the joined selectables and compiled statements of this process,
+    along with the data caches.
+    Called whenever a table is created, dropped or replaced.
+    """
+    current_app.selectable_registry.clear()
+    current_app.statement_cache.clear()
+    invalidate_data_caches()
 
 
 class SqlHandler(DataHandler):
@@ -133,18 +550,37 @@ class SqlHandler(DataHandler):
         :param data_sources:
         """
         self.data_sources = data_sources
-        self.table_lookup_by_name = {}
         self.only_use_active = only_use_active
         # create a flattened list from the data_sources object
         self.flat_data_sources = [
             self.data_sources[MAIN_DATA_SOURCE]
         ] + self.data_sources.get(ADDITIONAL_DATA_SOURCES, [])
+        # the tables and joined columns only depend on the data sources spec,
+        # so they are built once per spec and shared by the handlers of every request
+        selectable_key = make_cache_key(self.get_data_sources_cache_key())
+        lookups = current_app.selectable_registry.get(selectable_key)
+        if lookups is None:
+            lookups = self.build_lookups()
+            current_app.selectable_registry.set(selectable_key, lookups)
+        self.table_lookup_by_name, self.column_lookup_by_name = lookups
+        for data_source in self.flat_data_sources:
+            data_source.update(
+                {DATA_LOCATION: self.table_lookup_by_name[data_source[DATA_SOURCE_TYPE]]}
+            )
+
+    def build_lookups(self) -> tuple:
+        """
+        Resolves the tables of the data sources and joins them
+        :return: tuple of dicts of the table objects keyed by table name,
+        and of the joined column objects keyed by column name
+        """
+        self.table_lookup_by_name = {}
         for data_source in self.flat_data_sources:
             table_name = data_source[DATA_SOURCE_TYPE]
             table_class = self.get_class_name_from_table_name(table_name)
             self.table_lookup_by_name[table_name] = table_class
             data_source.update({DATA_LOCATION: table_class})
-        self.column_lookup_by_name = self.build_combined_data_table()
+        return self.table_lookup_by_name, self.build_combined_data_table()
 
     @staticmethod
     def get_class_name_from_table_name(table_name):
@@ -155,19 +591,46 @@ class SqlHandler(DataHandler):
         """
         return current_app.Base.metadata.tables[table_name]
 
-    def apply_filters_to_query(self, query, filters):
+    @staticmethod
+    def get_applied_filters(filters) -> list:
+        """
+        :param filters: list of filters
+        :return: the filters that change the query, leaving out selectors with nothing selected
+        """
+        return [
+            filter_dict
+            for filter_dict in filters
+            if filter_dict[SELECTOR_TYPE] == NUMERICAL_FILTER or filter_dict[SELECTED]
+        ]
+
+    @staticmethod
+    def get_filter_params(filters, bind_prefix: str) -> dict:
+        """
+        :param filters: list of applied filters, see get_applied_filters
+        :param bind_prefix: prefix of the bound parameter names, as passed to apply_filters_to_query
+        :return: dict of the filter values keyed by bound parameter name
+        """
+        return {
+            f"{bind_prefix}_{filter_index}": get_filter_param(filter_dict)
+            for filter_index, filter_dict in enumerate(filters)
+        }
+
+    def apply_filters_to_query(self, query, filters, bind_prefix: str = None):
+        """
+        :param query: sqlalchemy query object
+        :param filters: list of filters
+        :param bind_prefix: optional prefix of bound parameter names to use for the filter values,
+        instead of putting the values in the query. The values are then passed at execution, see get_filter_params
+        :return: sqlalchemy query object
+        """
         # add filters to the query dynamically
         filter_tuples = []
-        for filter_dict in filters:
-            if not (
-                filter_dict[SELECTOR_TYPE] == NUMERICAL_FILTER or filter_dict[SELECTED]
-            ):
-                # No filter has been applied
-                continue
+        for filter_index, filter_dict in enumerate(self.get_applied_filters(filters)):
             column_name = self.sanitize_column_name(filter_dict[OPTION_COL])
             column_object = self.column_lookup_by_name[column_name]
+            bind_name = f"{bind_prefix}_{filter_index}" if bind_prefix else None
             filter_tuples.append(
-                sql_handler_filter_operation(column_object, filter_dict)
+                sql_handler_filter_operation(column_object, filter_dict, bind_name)
             )
         if filter_tuples:
             query = query.filter(*filter_tuples)
@@ -207,22 +670,37 @@ class SqlHandler(DataHandler):
 
     def build_filters_from_active_data_source(self):
         current_tables = list(self.table_lookup_by_name.keys())
-        upload_rows = SqlDataInventory.get_data_upload_metadata(current_tables)
-        active_upload_rows = {
-            table_name: [r for r in rows if r.get(ACTIVE)]
-            for table_name, rows in upload_rows.items()
-        }
+        active_upload_ids = SqlDataInventory.get_active_upload_ids(current_tables)
         active_data_source_filters = []
-        for (table_name, upload_rows,) in active_upload_rows.items():
+        for (table_name, upload_ids,) in active_upload_ids.items():
             active_data_source_filters.append(
                 {
                     OPTION_TYPE: FILTER,
                     OPTION_COL: f"{table_name}:{UPLOAD_ID}",
-                    SELECTED: [r[UPLOAD_ID] for r in upload_rows],
+                    SELECTED: upload_ids,
                 }
             )
         return active_data_source_filters
 
+    def get_data_version(self) -> dict:
+        """
+        Identifies the state of the data behind this handler,
+        which changes whenever there is a new upload or an upload is (de)activated
+        :return: dict keyed by table name, valued with the sorted active upload ids
+        """
+        return SqlDataInventory.get_active_upload_ids(
+            list(self.table_lookup_by_name.keys())
+        )
+
+    def get_data_sources_cache_key(self) -> list:
+        """
+        :return: json-serializable description of the tables and joins of this handler
+        """
+        return [
+            [data_source[DATA_SOURCE_TYPE], data_source.get(JOIN_KEYS, [])]
+            for data_source in self.flat_data_sources
+        ]
+
     @staticmethod
     def sanitize_column_name(column_name):
         # todo: better match how our auto schema is working to catch all rename logic
@@ -250,11 +728,145 @@ class SqlHandler(DataHandler):
             for c in column_object.columns
         }
 
-    def get_column_data(self, columns: set, filters: [] = None) -> dict:
+    @staticmethod
+    def fetch_query_as_df(statement) -> pd.DataFrame:
+        """
+        Runs a compiled statement with the fetch engine set in the app config
+        :param statement: CachedStatement, see get_cached_statement
+        :return: dataframe keyed by the column labels of the query, with no rows if the query returns none
+        """
+        column_names = statement.column_names
+        if current_app.config[QUERY_FETCH_ENGINE] == COPY_FETCH_ENGINE and all(
+            isinstance(column_type, COPY_FETCH_COLUMN_TYPES)
+            for column_type in statement.column_types
+        ):
+            return psycopg2_copy_query_to_df(statement)
+        # a server-side cursor, so only one chunk of row tuples is held in python at a time
+        chunk_size = current_app.config[QUERY_FETCH_CHUNK_SIZE]
+        result = statement.execute(
+            current_app.db_session.connection(), stream_results=True
+        )
+        chunk_dfs = []
+        try:
+            while True:
+                chunk = result.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                chunk_dfs.append(
+                    pd.DataFrame([tuple(row) for row in chunk], columns=column_names)
+                )
+        finally:
+            result.close()
+        if not chunk_dfs:
+            # label the columns explicitly so that an empty response has them too
+            return pd.DataFrame(columns=column_names)
+        if len(chunk_dfs) == 1:
+            return chunk_dfs[0]
+        return pd.concat(chunk_dfs, ignore_index=True)
+
+    @staticmethod
+    def get_max_rows(max_rows=None, max_rows_fallback=None) -> tuple:
+        """
+        Combines the row budget of a graphic with the global one set in the app config
+        :param max_rows: optional row budget of the graphic, can only lower the global one
+        :param max_rows_fallback: optional SAMPLE_ROWS or REFUSE_ROWS
+        :return: tuple of the row budget (None for no budget) and the fallback to use over it
+        """
+        global_max_rows = current_app.config[GRAPHIC_MAX_ROWS]
+        budgets = [budget for budget in [max_rows, global_max_rows] if budget]
+        return (
+            min(budgets) if budgets else None,
+            max_rows_fallback or current_app.config[GRAPHIC_MAX_ROWS_FALLBACK],
+        )
+
+    @staticmethod
+    def get_max_rows_fallback(
+        max_rows: int, max_rows_fallback: str, num_rows_text: str
+    ) -> tuple:
+        """
+        How to change a query that returns more rows than the row budget, based on the fallback
+        :param max_rows: row budget
+        :param max_rows_fallback: SAMPLE_ROWS or REFUSE_ROWS
+        :param num_rows_text: how many rows the query returns, for the notice to the user
+        :return: tuple of a function changing the query to fit the budget (None if it should not be run),
+        and the notice to show on the graphic
+        """
+        if max_rows_fallback == REFUSE_ROWS:
+            notice = (
+                f"{num_rows_text} rows match, more than the limit of {max_rows:,}."
+                f" Filter the data to show this graphic."
+            )
+            return None, notice
+        notice = (
+            f"{num_rows_text} rows match, more than the limit of {max_rows:,}."
+            f" Showing a random sample of {max_rows:,} rows."
+        )
+        return lambda query: query.order_by(func.random()).limit(max_rows), notice
+
+    def fetch_query_as_df_with_max_rows(
+        self,
+        shape_key_parts: list,
+        build_query,
+        params: dict,
+        max_rows: int,
+        max_rows_fallback: str,
+    ) -> tuple:
+        """
+        Checks the planner estimate of the number of rows against the row budget first,
+        going straight to the fallback when it is clearly over, see MAX_ROWS_ESTIMATE_MARGIN.
+        Otherwise fetches at most one row over the row budget, which tells whether the query
+        is over it without loading an oversized response into the worker
+        :param shape_key_parts: description of the query shape, see get_cached_statement
+        :param build_query: function building the sqlalchemy query, called on a cache miss
+        :param params: dict of values for the bindparams of the query
+        :param max_rows: row budget
+        :param max_rows_fallback: SAMPLE_ROWS or REFUSE_ROWS
+        :return: tuple of the dataframe and the notice to show on the graphic (None if under budget)
+        """
+
+        def get_statement(variant: list, change_query):
+            # each change to the query is a shape of its own
+            return get_cached_statement(
+                shape_key_parts + [variant],
+                lambda: change_query(build_query()),
+                params,
+            )
+
+        statement = get_cached_statement(shape_key_parts, build_query, params)
+        estimated_rows = psycopg2_estimate_query_rows(statement)
+        if estimated_rows > max_rows * MAX_ROWS_ESTIMATE_MARGIN:
+            change_query, notice = self.get_max_rows_fallback(
+                max_rows, max_rows_fallback, f"About {estimated_rows:,}"
+            )
+        else:
+            response_as_df = self.fetch_query_as_df(
+                get_statement(
+                    ["limit", max_rows + 1], lambda query: query.limit(max_rows + 1)
+                )
+            )
+            if len(response_as_df) <= max_rows:
+                return response_as_df, None
+            change_query, notice = self.get_max_rows_fallback(
+                max_rows, max_rows_fallback, "More than"
+            )
+        if change_query is None:
+            return pd.DataFrame(columns=statement.column_names), notice
+        statement = get_statement([max_rows_fallback, max_rows], change_query)
+        return self.fetch_query_as_df(statement), notice
+
+    def get_column_data(
+        self,
+        columns: set,
+        filters: [] = None,
+        max_rows: int = None,
+        max_rows_fallback: str = None,
+    ) -> dict:
         """
         :param columns: A complete set of the columns to be returned
         :param filters: Optional list specifying how to filter the requested columns based on the row values
-        :return: a dict keyed by column name and valued with lists of row datapoints for the column
+        :param max_rows: Optional row budget, lower than the GRAPHIC_MAX_ROWS app config
+        :param max_rows_fallback: Optional SAMPLE_ROWS or REFUSE_ROWS- what to do when over max_rows
+        :return: a dataframe keyed by column name, with any notice about the row budget in attrs[DATA_NOTICE]
         """
         if filters is None:
             filters = []
@@ -265,29 +877,61 @@ class SqlHandler(DataHandler):
         all_column_rename_dict = {
             self.sanitize_column_name(c): c for c in all_to_include_cols
         }
-        # build basic query requesting all of the columns needed
-        query = current_app.db_session.query(
-            *[self.column_lookup_by_name[c] for c in all_column_rename_dict.keys()]
-        )
+        # sorted, so that the same columns always make the same statement
+        query_column_names = sorted(all_column_rename_dict.keys())
         if self.only_use_active:
             active_data_filters = self.build_filters_from_active_data_source()
             filters.extend(active_data_filters)
-        query = self.apply_filters_to_query(query, filters)
-        response_rows = query.all()
-        if response_rows:
+        max_rows, max_rows_fallback = self.get_max_rows(max_rows, max_rows_fallback)
+        # the active data filters are part of the key,
+        # so a new or (de)activated upload never returns stale results
+        cache_key = make_cache_key(
+            self.get_data_sources_cache_key(),
+            sorted(columns),
+            filters,
+            max_rows,
+            max_rows_fallback,
+        )
+        response_as_df = current_app.query_cache.get(cache_key)
+        if response_as_df is None:
+            applied_filters = self.get_applied_filters(filters)
+            # the statement only depends on which filters are applied, not their values
+            shape_key_parts = [
+                self.get_data_sources_cache_key(),
+                query_column_names,
+                [get_filter_shape(filter_dict) for filter_dict in applied_filters],
+            ]
+            params = self.get_filter_params(applied_filters, "filter")
+
+            def build_query():
+                # build basic query requesting all of the columns needed
+                query = current_app.db_session.query(
+                    *[self.column_lookup_by_name[c] for c in query_column_names]
+                )
+                return self.apply_filters_to_query(query, applied_filters, "filter")
+
+            if max_rows is None:
+                statement = get_cached_statement(shape_key_parts, build_query, params)
+                response_as_df, notice = self.fetch_query_as_df(statement), None
+            else:
+                response_as_df, notice = self.fetch_query_as_df_with_max_rows(
+                    shape_key_parts, build_query, params, max_rows, max_rows_fallback
+                )
             # rename is switching the '_' separation back to TABLE_COLUMN_SEPARATOR
-            response_as_df = pd.DataFrame(response_rows).rename(
-                columns=all_column_rename_dict
-            )
-        else:
-            # if the sql query returns no rows, we want an empty df to format our response
-            response_as_df = pd.DataFrame(columns=columns)
-        return response_as_df[columns]
+            response_as_df = response_as_df.rename(columns=all_column_rename_dict)
+            if len(all_to_include_cols) > len(columns):
+                # drop the columns that were only needed for filtering
+                response_as_df = response_as_df[list(columns)]
+            response_as_df.attrs[DATA_NOTICE] = notice
+            current_app.query_cache.set(cache_key, response_as_df)
+        # graphics modify their data in place (e.g. sorting), never hand out the cached df
+        return response_as_df.copy()
 
-    def get_table_data(self, filters: [] = None) -> dict:
+    def build_table_query(self, filters: [] = None) -> tuple:
         """
         :param filters: Optional list specifying how to filter the requested columns based on the row values
-        :return: a dict keyed by column name and valued with lists of row datapoints for the column
+        :return: tuple of the sqlalchemy query for all of the columns of the data sources,
+        and a dict mapping the query column names to the column names without the table name prefix
         """
 
         def remove_tablename_prefix_from_column_name(text, list_prefix):
@@ -311,16 +955,60 @@ class SqlHandler(DataHandler):
             active_data_filters = self.build_filters_from_active_data_source()
             filters.extend(active_data_filters)
         query = self.apply_filters_to_query(query, filters)
-        response_rows = query.all()
-        if response_rows:
-            # rename is switching the '_' separation back to TABLE_COLUMN_SEPARATOR
-            response_as_df = pd.DataFrame(response_rows).rename(
-                columns=column_rename_dict
-            )
-        else:
-            # if the sql query returns no rows, we want an empty df to format our response
-            response_as_df = pd.DataFrame(columns=column_rename_dict.values())
-        return response_as_df
+        return query, column_rename_dict
+
+    def get_table_data(self, filters: [] = None) -> dict:
+        """
+        :param filters: Optional list specifying how to filter the requested columns based on the row values
+        :return: a dict keyed by column name and valued with lists of row datapoints for the column
+        """
+        query, column_rename_dict = self.build_table_query(filters)
+        return self.fetch_query_as_df(CachedStatement.from_query(query)).rename(
+            columns=column_rename_dict
+        )
+
+    def get_table_data_as_csv_chunks(self, filters: [] = None):
+        """
+        Streams the table as csv without loading it into the worker
+        :param filters: Optional list specifying how to filter the requested columns based on the row values
+        :return: generator of csv bytes chunks, starting with the header row
+        """
+        query, column_rename_dict = self.build_table_query(filters)
+        return psycopg2_copy_query_to_csv_chunks(
+            query, list(column_rename_dict.values())
+        )
+
+    def get_table_data_as_export_chunks(
+        self, filters: [] = None, export_format: str = CSV_FORMAT
+    ):
+        """
+        Streams the table in a download format. The arrow formats are parsed from the csv
+        that COPY streams, at most QUERY_FETCH_CHUNK_SIZE rows to a record batch or parquet row group
+        :param filters: Optional list specifying how to filter the requested columns based on the row values
+        :param export_format: one of DOWNLOAD_FORMATS
+        :return: generator of bytes chunks of the file
+        """
+        if export_format == CSV_FORMAT:
+            return self.get_table_data_as_csv_chunks(filters)
+        # pyarrow is only needed for the arrow formats
+        from database import arrow_export
+
+        export_functions = {
+            ARROW_FORMAT: arrow_export.record_batches_to_arrow_stream_chunks,
+            PARQUET_FORMAT: arrow_export.record_batches_to_parquet_chunks,
+        }
+        if export_format not in export_functions:
+            raise ValueError(f"Unknown export format {export_format}")
+        query, column_rename_dict = self.build_table_query(filters)
+        schema = arrow_export.get_arrow_schema(
+            query, list(column_rename_dict.values())
+        )
+        record_batches = arrow_export.csv_chunks_to_record_batches(
+            psycopg2_copy_query_to_csv_chunks(query),
+            schema,
+            current_app.config[QUERY_FETCH_CHUNK_SIZE],
+        )
+        return export_functions[export_format](schema, record_batches)
 
     def get_column_unique_entries(
         self, cols: list, filter_active_data=True, filters: list = None
@@ -331,34 +1019,116 @@ class SqlHandler(DataHandler):
         :param filter_active_data: Whether to filter the column entries to only include those for active data sources
         :return: A dict keyed by column names and valued with the unique values in that column
         """
+        unique_count_dict = self.get_column_unique_entry_counts(
+            cols, filter_active_data, filters
+        )
+        return {col: list(counts.keys()) for col, counts in unique_count_dict.items()}
+
+    def get_column_unique_entry_counts(
+        self, cols: list, filter_active_data=True, filters: list = None
+    ) -> dict:
+        """
+        Gets the unique values of all of the columns in a single sql statement,
+        along with the number of rows having each value
+        :param cols: a list of column names
+        :param filters: Optional list specifying how to filter the requested columns based on the row values
+        :param filter_active_data: Whether to filter the column entries to only include those for active data sources
+        :return: A dict keyed by column names and valued with dicts of row counts keyed by unique value
+        """
         if filters is None:
             filters = []
-        unique_dict = {}
-        for col in cols:
-            renamed_col = self.sanitize_column_name(col)
-            sql_col_class = self.column_lookup_by_name[renamed_col]
-            query = current_app.db_session.query(sql_col_class).distinct()
-            if filter_active_data:
-                active_data_filters = self.build_filters_from_active_data_source()
-                query = self.apply_filters_to_query(query, active_data_filters)
+        if not cols:
+            return {}
+        active_data_filters = self.get_applied_filters(
+            self.build_filters_from_active_data_source() if filter_active_data else []
+        )
+        filters = self.get_applied_filters(filters)
+        filtered_selector_cols = sorted(
+            {
+                filter_[COLUMN_NAME]
+                for filter_ in filters
+                if filter_.get(FILTERED_SELECTOR, False)
+            }.intersection(cols)
+        )
+        # the filters are only part of the statement for filtered selector columns
+        if not filtered_selector_cols:
+            filters = []
+        shape_key_parts = [
+            self.get_data_sources_cache_key(),
+            cols,
+            [get_filter_shape(filter_dict) for filter_dict in active_data_filters],
+            filtered_selector_cols,
+            [get_filter_shape(filter_dict) for filter_dict in filters],
+        ]
+        params = {
+            **self.get_filter_params(active_data_filters, "active_filter"),
+            **self.get_filter_params(filters, "filter"),
+        }
+        statement = get_cached_statement(
+            shape_key_parts,
+            lambda: self.build_column_unique_entries_query(
+                cols, active_data_filters, filtered_selector_cols, filters
+            ),
+            params,
+        )
+        unique_count_dict = {col: OrderedDict() for col in cols}
+        for row in statement.execute(current_app.db_session.connection()):
+            col_index, count = row[0], row[-1]
+            value = row[col_index + 1]
+            if value is not None:
+                unique_count_dict[cols[col_index]][str(value)] = count
+        return unique_count_dict
+
+    def build_column_unique_entries_query(
+        self,
+        cols: list,
+        active_data_filters: list,
+        filtered_selector_cols: list,
+        filters: list,
+    ):
+        """
+        Builds one UNION ALL query with a branch per column. Each branch groups on its
+        column and keeps its own limit, so a column with many values doesn't crowd out the others.
+        Rows are (branch index, one typed column per requested column, row count),
+        the columns of the other branches are null.
+        The filter values are bound parameters named by get_filter_params,
+        with the prefix "active_filter" for the active data filters and "filter" for the others
+        :param cols: a list of column names
+        :param active_data_filters: list of filters for the active data sources, applied to every column
+        :param filtered_selector_cols: the columns to apply the filters to
+        :param filters: list of filters, applied to the columns marked as filtered selectors
+        :return: sqlalchemy query object
+        """
+        sql_columns = [
+            self.column_lookup_by_name[self.sanitize_column_name(col)] for col in cols
+        ]
+        # we never show more than MAX_ENTRIES_NUMERICAL_COLUMN- adding one here
+        # tells downstream users that there are too many values to render
+        limit_values_returned = MAX_ENTRIES_FOR_FILTER_SELECTOR + 1
+        column_queries = []
+        for col_index, (col, sql_col_class) in enumerate(zip(cols, sql_columns)):
+            branch_columns = [
+                sql_col_class.label(f"value_{i}")
+                if i == col_index
+                else cast(null(), other_sql_col_class.type).label(f"value_{i}")
+                for i, other_sql_col_class in enumerate(sql_columns)
+            ]
+            query = current_app.db_session.query(
+                literal(col_index).label("col_index"),
+                *branch_columns,
+                func.count().label("row_count"),
+            )
+            query = self.apply_filters_to_query(
+                query, active_data_filters, "active_filter"
+            )
             # if the current column matches one in the filter list marked as filtered,
             # apply the filters before looking for unique values
-            if any(
-                [
-                    (
-                        filter_[COLUMN_NAME] == col
-                        and filter_.get(FILTERED_SELECTOR, False)
-                    )
-                    for filter_ in filters
-                ]
-            ):
-                query = self.apply_filters_to_query(query, filters)
-            # we never show more than MAX_ENTRIES_NUMERICAL_COLUMN- adding one here
-            # tells downstream users that there are too many values to render
-            limit_values_returned = MAX_ENTRIES_FOR_FILTER_SELECTOR + 1
-            response = query.limit(limit_values_returned).all()
-            unique_dict[col] = [str(r[0]) for r in response if r[0] is not None]
-        return unique_dict
+            if col in filtered_selector_cols:
+                query = self.apply_filters_to_query(query, filters, "filter")
+            query = query.group_by(sql_col_class).limit(limit_values_returned)
+            # wrapping in a subquery keeps the limit local to this branch of the union
+            column_queries.append(current_app.db_session.query(query.subquery()))
+        return column_queries[0].union_all(*column_queries[1:])
 
 
 class DataFrameConverter:
@@ -379,6 +1149,32 @@ class DataFrameConverter:
 
         return data.apply(convert_to_nullable_int_if_able)
 
+    @staticmethod
+    def cast_dataframe_datatypes_for_table(data, table):
+        """
+        Casts the columns of an upload that the table types as integers to the nullable Int64,
+        and parses those it types as datetimes or dates, which read_csv leaves as text,
+        so that the upload can be copied in the binary format, see binary_copy.
+        Goes by the table rather than the values, so a chunk of a text column
+        that only holds digits keeps them as text, e.g. "007"
+        :param data: pandas df
+        :param table: sqlalchemy table the df is written to
+        :return: df with the integer and datetime columns cast where their values allow it
+        """
+        cast_columns = {}
+        for column in table.columns:
+            if column.name not in data.columns:
+                continue
+            try:
+                if isinstance(column.type, Integer):
+                    cast_columns[column.name] = data[column.name].astype("Int64")
+                elif isinstance(column.type, (DateTime, Date)):
+                    cast_columns[column.name] = pd.to_datetime(data[column.name])
+            except (TypeError, ValueError, OverflowError):
+                # left for the copy as they are, which postgres parses or rejects
+                pass
+        return data.assign(**cast_columns)
+
     @classmethod
     def get_schema_from_df(cls, data):
         """
@@ -435,10 +1231,20 @@ class SqlDataInventory(SqlHandler, DataFrameConverter):
          because we use different paths for testing environments
         :return: sqlalchemy model class for DATA_UPLOAD_METADATA
         """
-        for c in current_app.Base._decl_class_registry.values():
-            if hasattr(c, "__tablename__") and c.__tablename__ == DATA_UPLOAD_METADATA:
-                return c
-        raise KeyError(f"{DATA_UPLOAD_METADATA} not found in available model classes")
+        base = current_app.Base
+        if base not in DATA_UPLOAD_METADATA_CLASS_BY_BASE:
+            for c in base._decl_class_registry.values():
+                if (
+                    hasattr(c, "__tablename__")
+                    and c.__tablename__ == DATA_UPLOAD_METADATA
+                ):
+                    DATA_UPLOAD_METADATA_CLASS_BY_BASE[base] = c
+                    break
+            else:
+                raise KeyError(
+                    f"{DATA_UPLOAD_METADATA} not found in available model classes"
+                )
+        return DATA_UPLOAD_METADATA_CLASS_BY_BASE[base]
 
     @staticmethod
     def get_available_data_sources():
@@ -467,6 +1273,7 @@ class SqlDataInventory(SqlHandler, DataFrameConverter):
         )
         current_app.db_session.add(row)
         current_app.db_session.commit()
+        invalidate_data_caches()
 
     @classmethod
     def update_data_upload_metadata_active(cls, data_source_name, active_data_dict):
@@ -487,32 +1294,61 @@ class SqlDataInventory(SqlHandler, DataFrameConverter):
             active_boolean = active_status == ACTIVE
             row.active = active_boolean
             current_app.db_session.commit()
+        invalidate_data_caches()
+
+    @classmethod
+    def load_data_upload_metadata_rows(cls):
+        """
+        Queries every row of the data_upload_metadata table
+        :return: list of dicts describing each upload
+        """
+        data_upload_metadata = cls.get_sqlalchemy_model_class_for_data_upload_metadata()
+        results = current_app.db_session.query(data_upload_metadata).all()
+        return [
+            {
+                TABLE_NAME: result.table_name,
+                UPLOAD_ID: result.upload_id,
+                USERNAME: result.username,
+                UPLOAD_TIME: result.upload_time,
+                ACTIVE: result.active,
+                NOTES: result.notes,
+            }
+            for result in results
+        ]
+
+    @classmethod
+    def get_active_upload_ids(cls, data_source_names):
+        """
+        :param data_source_names: list of data sources
+        :return: dict keyed by table name, valued with the sorted active upload ids.
+        Tables without any uploads are not included.
+        """
+        registry = current_app.upload_metadata_registry
+        rows_by_table = registry.get_rows_by_table(cls.load_data_upload_metadata_rows)
+        return registry.get_active_upload_ids(rows_by_table, data_source_names)
 
     @classmethod
     def get_data_upload_metadata(cls, data_source_names):
         """
 
         :param data_source_names: list of data sources
-        :param active_filter:
         :return: dict keyed by table name, valued with list of dicts describing the upload
         """
-
-        data_upload_metadata = cls.get_sqlalchemy_model_class_for_data_upload_metadata()
-        query = current_app.db_session.query(data_upload_metadata).filter(
-            data_upload_metadata.table_name.in_(data_source_names)
+        rows_by_table = current_app.upload_metadata_registry.get_rows_by_table(
+            cls.load_data_upload_metadata_rows
         )
-        results = query.all()
         identifiers_by_table = defaultdict(list)
-        for result in results:
-            identifiers_by_table[result.table_name].append(
-                {
-                    UPLOAD_ID: result.upload_id,
-                    USERNAME: result.username,
-                    UPLOAD_TIME: result.upload_time.strftime(DATETIME_FORMAT),
-                    ACTIVE: result.active,
-                    NOTES: result.notes,
-                }
-            )
+        for data_source_name in data_source_names:
+            for row in rows_by_table.get(data_source_name, []):
+                identifiers_by_table[data_source_name].append(
+                    {
+                        UPLOAD_ID: row[UPLOAD_ID],
+                        USERNAME: row[USERNAME],
+                        UPLOAD_TIME: row[UPLOAD_TIME].strftime(DATETIME_FORMAT),
+                        ACTIVE: row[ACTIVE],
+                        NOTES: row[NOTES],
+                    }
+                )
         return identifiers_by_table
 
     @classmethod
@@ -542,19 +1378,80 @@ class SqlDataInventory(SqlHandler, DataFrameConverter):
         Assumption: data_source for this upload is only one table, even though they can generally refer to more than one table
         :return: list of df columns not written to the db (no corresponding db column)
         """
-        uploaded_data_df = self.cast_dataframe_datatypes(uploaded_data_df)
+        return self.write_data_upload_chunks_to_backend(
+            [uploaded_data_df], username, notes
+        )
+
+    def write_csv_uploads_to_backend(self, csvfiles, username, notes):
+        """
+        Writes csv files as a single upload, reading them UPLOAD_CHUNK_SIZE rows at a time
+        :param csvfiles: file objects of csvs whose headers we have already validated
+        :return: list of csv columns not written to the db (no corresponding db column)
+        """
+        chunk_size = current_app.config[UPLOAD_CHUNK_SIZE]
+        # read_csv infers the dtypes of each chunk on its own, e.g. "007" would be 7
+        # in a chunk whose values are all numbers
+        dtypes = get_csv_dtypes_for_table(
+            self.table_lookup_by_name[self.data_source_name]
+        )
+        uploaded_data_dfs = (
+            uploaded_data_df
+            for csvfile in csvfiles
+            for uploaded_data_df in pd.read_csv(
+                csvfile, sep=",", comment="#", chunksize=chunk_size, dtype=dtypes
+            )
+        )
+        return self.write_data_upload_chunks_to_backend(
+            uploaded_data_dfs, username, notes
+        )
+
+    def write_data_upload_chunks_to_backend(self, uploaded_data_dfs, username, notes):
+        """
+        Writes a stream of dataframes as a single upload,
+        with a row index that runs on from one dataframe to the next.
+        The rows are copied to the table as the dataframes are read,
+        and the upload metadata is written once they are all in
+        :param uploaded_data_dfs: iterable of pandas dataframes
+        :return: list of df columns not written to the db (no corresponding db column)
+        """
         table = self.table_lookup_by_name[self.data_source_name]
         new_upload_id = self.get_new_upload_id_for_table(self.data_source_name)
-        uploaded_data_df = self.append_metadata_to_data(
-            data=uploaded_data_df, upload_id=new_upload_id
-        )
         # todo: handle custom pk columns
         # subset the columns to write to equal those in the db
         existing_columns = [c.name for c in table.columns]
-        ignored_columns = set(uploaded_data_df.columns) - set(existing_columns)
-        uploaded_data_df = uploaded_data_df[existing_columns]
+        ignored_columns = set()
+
+        def prepare_uploaded_data_dfs():
+            num_rows = 0
+            for uploaded_data_df in uploaded_data_dfs:
+                uploaded_data_df = self.cast_dataframe_datatypes_for_table(
+                    uploaded_data_df, table
+                )
+                uploaded_data_df.index = pd.RangeIndex(
+                    num_rows, num_rows + len(uploaded_data_df)
+                )
+                num_rows += len(uploaded_data_df)
+                uploaded_data_df = self.append_metadata_to_data(
+                    data=uploaded_data_df, upload_id=new_upload_id
+                )
+                ignored_columns.update(
+                    set(uploaded_data_df.columns) - set(existing_columns)
+                )
+                yield uploaded_data_df[existing_columns]
+
         conn = connect_to_db_using_psycopg2()
-        psycopg2_copy_from_stringio(conn, uploaded_data_df, self.data_source_name)
+        try:
+            psycopg2_copy_from_df_chunks(
+                conn,
+                prepare_uploaded_data_dfs(),
+                self.data_source_name,
+                column_types=[table.columns[c].type for c in existing_columns],
+            )
+        except (ValueError, KeyError, psycopg2.DataError) as error:
+            # bad file contents, e.g. unparsable csv, missing columns or mismatched types
+            raise ValidationError(str(error))
+        finally:
+            conn.close()
         self.write_upload_metadata_row(
             upload_time=self.get_upload_time(),
             upload_id=new_upload_id,
@@ -573,13 +1470,17 @@ class SqlDataInventory(SqlHandler, DataFrameConverter):
         )
         metadata_rows.delete()
         current_app.db_session.commit()
+        invalidate_data_caches()
 
 
 class CreateTablesFromCSVs(DataFrameConverter):
     """Infer a table schema from a CSV, and create a sql table from this definition"""
 
-    def __init__(self, db_url):
-        self.engine = create_engine(db_url)
+    def __init__(self, engine):
+        """
+        :param engine: sqlalchemy engine, usually the pooled engine of the app
+        """
+        self.engine = engine
         self.reflect_db_tables_to_sqlalchemy_classes()
         self.Base = None
         self.meta = MetaData(bind=self.engine)
@@ -598,8 +1499,14 @@ class CreateTablesFromCSVs(DataFrameConverter):
         self.create_new_table(
             table_name, schema, key_columns=key_column, if_exists=if_exists
         )
+        table = self.meta.tables[table_name]
         conn = connect_to_db_using_psycopg2()
-        success = psycopg2_copy_from_stringio(conn, data, table_name)
+        try:
+            success = psycopg2_copy_from_stringio(
+                conn, data, table_name, column_types=[c.type for c in table.columns]
+            )
+        finally:
+            conn.close()
         if not success:
             raise Exception
         return upload_id, upload_time, table_name
@@ -662,3 +1569,4 @@ class CreateTablesFromCSVs(DataFrameConverter):
                 columns.append(Column(name, sqlalchemy_dtype))
         _ = Table(table_name, self.meta, *columns)
         self.meta.create_all()
+        invalidate_table_definition_caches()
@@ -0,0 +1,80 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from flask import current_app
+
+from utility.cache import make_cache_key
+
+
+class CachedStatement:
+    """
+    A compiled select statement, with the values of its bound parameters for one execution.
+    Queries of the same shape share the compiled statement and only differ in their params
+    """
+
+    def __init__(self, compiled, column_names: list, column_types: list, params=None):
+        """
+        :param compiled: sqlalchemy Compiled object of the statement
+        :param column_names: names of the result columns
+        :param column_types: sqlalchemy type instances of the result columns
+        :param params: dict of the bound parameter values, keyed by parameter name
+        """
+        self.compiled = compiled
+        self.column_names = column_names
+        self.column_types = column_types
+        self.params = params or {}
+
+    @classmethod
+    def from_query(cls, query, params=None):
+        """
+        Compiles a query, e.g. one that isn't worth caching
+        :param query: sqlalchemy query object
+        :param params: dict of values for the bindparams of the query without a value
+        """
+        column_descriptions = query.column_descriptions
+        return cls(
+            query.statement.compile(dialect=query.session.bind.dialect),
+            [column["name"] for column in column_descriptions],
+            [column["type"] for column in column_descriptions],
+            params,
+        )
+
+    def with_params(self, params: dict):
+        return CachedStatement(
+            self.compiled, self.column_names, self.column_types, params
+        )
+
+    def get_bound_params(self) -> dict:
+        """
+        :return: dict of the values of all of the parameters of the statement,
+        including those set when the query was built
+        """
+        return self.compiled.construct_params(self.params)
+
+    def execute(self, connection, **execution_options):
+        """
+        Executes the compiled statement without compiling it again
+        :param connection: sqlalchemy connection, e.g. session.connection()
+        :return: sqlalchemy result proxy
+        """
+        return connection.execution_options(**execution_options).execute(
+            self.compiled, self.params
+        )
+
+
+def get_cached_statement(shape_key_parts: list, build_query, params: dict = None):
+    """
+    Compiles a query once per shape, reusing the compiled statement for every execution
+    of that shape. The params fill in the bindparams of the query, so the shape key parts must
+    identify everything about the query except their values
+    :param shape_key_parts: json-serializable description of the query shape
+    :param build_query: function building the sqlalchemy query of the shape, called on a cache miss
+    :param params: dict of values for the bindparams of the query
+    :return: CachedStatement
+    """
+    shape_key = make_cache_key(*shape_key_parts)
+    statement = current_app.statement_cache.get(shape_key)
+    if statement is None:
+        statement = CachedStatement.from_query(build_query())
+        current_app.statement_cache.set(shape_key, statement)
+    return statement.with_params(params)
@@ -0,0 +1,76 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from collections import defaultdict
+import threading
+import time
+
+from utility.cache import make_cache_key
+from utility.constants import ACTIVE, UPLOAD_ID, TABLE_NAME
+
+
+class UploadMetadataRegistry:
+    """
+    Process-wide copy of the data_upload_metadata table.
+    Every query filters on the active uploads of its tables, so rather than querying
+    the metadata table each time, the whole table is loaded once and kept until an
+    upload or admin write invalidates it. Writes made by other worker processes are
+    picked up after max_age_seconds.
+    """
+
+    def __init__(self, max_age_seconds: float = None):
+        """
+        :param max_age_seconds: how long the loaded metadata is trusted without a
+        local write. None means the metadata is only reloaded after local writes.
+        """
+        self.max_age_seconds = max_age_seconds
+        # hash of the active uploads- identical across processes for the same data
+        self.version = None
+        self._rows_by_table = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._rows_by_table = None
+
+    def is_stale(self) -> bool:
+        if self._rows_by_table is None:
+            return True
+        if self.max_age_seconds is None:
+            return False
+        return time.monotonic() - self._loaded_at > self.max_age_seconds
+
+    def get_rows_by_table(self, load_rows) -> dict:
+        """
+        :param load_rows: function returning a list of dicts, one per metadata table row
+        :return: dict keyed by table name, valued with lists of row dicts
+        """
+        with self._lock:
+            if self.is_stale():
+                rows_by_table = defaultdict(list)
+                for row in load_rows():
+                    rows_by_table[row[TABLE_NAME]].append(row)
+                self._rows_by_table = dict(rows_by_table)
+                self._loaded_at = time.monotonic()
+                self.version = make_cache_key(
+                    self.get_active_upload_ids(self._rows_by_table)
+                )
+            return self._rows_by_table
+
+    @staticmethod
+    def get_active_upload_ids(rows_by_table, table_names=None) -> dict:
+        """
+        :param rows_by_table: dict returned by get_rows_by_table
+        :param table_names: optional list of tables to restrict to
+        :return: dict keyed by table name, valued with the sorted active upload ids
+        """
+        if table_names is None:
+            table_names = rows_by_table.keys()
+        return {
+            table_name: sorted(
+                row[UPLOAD_ID] for row in rows_by_table[table_name] if row[ACTIVE]
+            )
+            for table_name in table_names
+            if table_name in rows_by_table
+        }
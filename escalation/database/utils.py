@@ -4,6 +4,9 @@
 from collections import OrderedDict
 from operator import eq, gt, ge, le, lt
 
+from sqlalchemy import any_, bindparam, cast
+from sqlalchemy.types import ARRAY
+
 from utility.constants import (
     SELECTOR_TYPE,
     FILTER,
@@ -11,6 +14,7 @@ from utility.constants import (
     NUMERICAL_FILTER,
     OPERATION,
     VALUE,
+    OPTION_COL,
 )
 
 
@@ -19,13 +23,25 @@ OPERATIONS_FOR_NUMERICAL_FILTERS = OrderedDict(
 )
 
 
-def sql_handler_filter_operation(data_column, filter_dict):
+def sql_handler_filter_operation(data_column, filter_dict, bind_name: str = None):
     """
     Applies filter operations for queries in the SqlHandler.
     :param data_column: sql column object
     :param filter_dict:
+    :param bind_name: optional name of a bound parameter to compare against instead of the
+    filter values, so the compiled statement can be reused with other values, see get_filter_param
     :return: an operation function that can be applied on the query when executed
     """
+    if bind_name is not None:
+        if filter_dict[SELECTOR_TYPE] == FILTER:
+            # one array parameter for any number of selected values
+            return data_column == any_(
+                cast(bindparam(bind_name), ARRAY(data_column.type))
+            )
+        operation_function = OPERATIONS_FOR_NUMERICAL_FILTERS[filter_dict[OPERATION]]
+        return operation_function(
+            data_column, bindparam(bind_name, type_=data_column.type)
+        )
     if filter_dict[SELECTOR_TYPE] == FILTER:
         entry_values_to_be_shown_in_plot = filter_dict[SELECTED]  # Always a list
         # data backends may handle a single value differently from multiple values for performance reasons
@@ -36,3 +52,23 @@ def sql_handler_filter_operation(data_column, filter_dict):
     elif filter_dict[SELECTOR_TYPE] == NUMERICAL_FILTER:
         operation_function = OPERATIONS_FOR_NUMERICAL_FILTERS[filter_dict[OPERATION]]
         return operation_function(data_column, filter_dict[VALUE])
+
+
+def get_filter_shape(filter_dict) -> list:
+    """
+    :param filter_dict:
+    :return: the parts of a filter that change the sql of a query, as opposed to its values
+    """
+    if filter_dict[SELECTOR_TYPE] == NUMERICAL_FILTER:
+        return [filter_dict[OPTION_COL], NUMERICAL_FILTER, filter_dict[OPERATION]]
+    return [filter_dict[OPTION_COL], FILTER]
+
+
+def get_filter_param(filter_dict):
+    """
+    :param filter_dict:
+    :return: the value of the bound parameter of a filter, see sql_handler_filter_operation
+    """
+    if filter_dict[SELECTOR_TYPE] == FILTER:
+        return list(filter_dict[SELECTED])
+    return filter_dict[VALUE]
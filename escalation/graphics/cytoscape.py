@@ -1,6 +1,5 @@
-import json
-
 from graphics.graphic_class import Graphic
+from graphics.utils.json_encoding import dumps_plot_json
 from utility.constants import (
     DATA,
     NODE_ID,
@@ -179,7 +178,7 @@ class Cytoscape(Graphic):
         cytoscape_dict[ELEMENTS] = elements
         cytoscape_dict[STYLE] = style_array_for_cytoscape
 
-        self.graph_json_str = json.dumps(cytoscape_dict)
+        self.graph_json_str = dumps_plot_json(cytoscape_dict)
 
     @staticmethod
     def get_graph_html_template() -> str:
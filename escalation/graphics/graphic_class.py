@@ -15,7 +15,12 @@ NUMERICAL_FILTER_DICT = {MAX: "<=", MIN: ">="}
 
 
 class Graphic(ABC):
-    def __init__(self, graphic_dict: dict, addendum_dict: dict = None):
+    def __init__(
+        self,
+        graphic_dict: dict,
+        addendum_dict: dict = None,
+        rendered_templates: dict = None,
+    ):
 
         """
         :param graphic_dict: Copy of part of the original config dict.
@@ -23,11 +28,14 @@ class Graphic(ABC):
         :param addendum_dict: e.g ImmutableMultiDict([('graphic_name', 'graphic_0'), ('selection_0', 'SHOW_ALL_ROW'),
          ('selection_2_upper_operation', '<='), ('selection_2_upper_value', '4'))])
         Should not pass an empty ImmutableMultiDict
+        :param rendered_templates: Optional output of render_templates for the same config,
+        rendered once rather than for every graphic object
         """
         if addendum_dict is None:
             addendum_dict = {}
         self.graphic_dict = graphic_dict
         self.addendum_dict = addendum_dict
+        self.rendered_templates = rendered_templates or {}
         self.select_info = []
         self.data = {}
         self.unique_entry_dict = {}
@@ -59,6 +67,14 @@ class Graphic(ABC):
         """
         raise NotImplementedError
 
+    def render_templates(self) -> dict:
+        """
+        Subclass this method if a subclass renders templates that only depend on the config,
+        see PlotlyPlot for an example
+        :return: dict of rendered template strings
+        """
+        return {}
+
     def set_unique_entry_dict(self, unique_entry_dict):
         self.unique_entry_dict = unique_entry_dict
 
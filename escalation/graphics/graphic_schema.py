@@ -216,6 +216,20 @@ class GraphicsConfigInterfaceBuilder(ABC):
                     TITLE: "Graph Description",
                     "description": "Text caption shown above the graph (optional)",
                 },
+                MAX_ROWS: {
+                    "type": "integer",
+                    TITLE: "Maximum Rows",
+                    "description": "Most rows of data the graphic loads (optional),"
+                    " can only lower the limit set for the whole app",
+                    MINIMUM: 1,
+                },
+                MAX_ROWS_FALLBACK: {
+                    "type": "string",
+                    TITLE: "Over Maximum Rows",
+                    "description": "What to do when the data is over the maximum rows:"
+                    " show a random sample or show no data (optional)",
+                    "enum": MAX_ROWS_FALLBACKS,
+                },
                 PLOT_SPECIFIC_INFO: {
                     "type": "object",
                     "title": "Plot Dictionary",
@@ -1,10 +1,21 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
 
-import json
-import plotly
+import copy
+
 from flask import render_template
+import numpy as np
+import pandas as pd
+
 from graphics.graphic_class import Graphic, get_key_for_form, make_filter_dict
+from graphics.utils.json_encoding import (
+    dumps_plot_json,
+    get_app_config,
+    is_numeric_column,
+    round_to_significant_digits,
+    to_json_values,
+    to_typed_array,
+)
 from utility.constants import (
     GROUPBY,
     SCATTER,
@@ -29,6 +40,12 @@ from utility.constants import (
     ERROR_Z,
     SELECTABLE_DATA_DICT,
     ENTRIES,
+    PLOTLY_TYPED_ARRAYS,
+    PLOTLY_TYPED_ARRAY_FLOAT32,
+    PLOTLY_SIGNIFICANT_DIGITS,
+    PLOTLY_SERVER_GROUPBY,
+    TARGET,
+    VALUE,
 )
 
 HOVER_TEMPLATE_HTML = "hover_template.html"
@@ -41,6 +58,11 @@ VISUALIZATION_TYPE = "type"
 PLOTLY_TYPE = "type"
 OPTIONS = "options"
 STYLES = "styles"
+NAME = "name"
+NAME_FORMAT = "nameformat"
+ENABLED = "enabled"
+GROUP_ESCAPE = "%{group}"
+TRACE_ESCAPE = "%{trace}"
 PLOT_OPTIONS = "plot_options"
 NA_FILL_IN = "NA"
 TABLE = "table"
@@ -53,6 +75,7 @@ AXIS_TO_SORT_ALONG = "x"
 AUTOMARGIN = "automargin"
 HOVERMODE = "hovermode"
 CLOSEST = "closest"
+DATE = "date"
 POSSIBLE_AXIS = [X, Y, Z]
 POSSIBLE_ERROR_AXES = [ERROR_X, ERROR_Y, ERROR_Z]
 
@@ -143,6 +166,119 @@ def add_toggle_layout_button(layout_dict: dict):
     return layout_dict
 
 
+def make_hover_rows(hover_columns: list) -> list:
+    """
+    Transposes the hover columns into a list of rows, for the customdata of a trace
+    :param hover_columns: list of pandas Series of the same length
+    :return: list of lists of json-ready values, one per row
+    """
+    dtypes = {hover_column.dtype for hover_column in hover_columns}
+    if len(dtypes) == 1:
+        (dtype,) = dtypes
+        if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+            values = np.column_stack(
+                [hover_column.to_numpy() for hover_column in hover_columns]
+            )
+            # numpy makes the rows in one pass, only NaN and infinities need nulls
+            if dtype.kind != "f" or np.isfinite(values).all():
+                return values.tolist()
+    columns = [to_json_values(hover_column) for hover_column in hover_columns]
+    return list(map(list, zip(*columns)))
+
+
+def make_null_labels(null_values: np.ndarray) -> [np.ndarray, list]:
+    """
+    :param null_values: numpy object array of nulls, e.g. None, NaN and NaT
+    :return: code of each value, and the string of each code
+    """
+    # nulls are mostly the same few objects, which print differently
+    ids = np.fromiter(map(id, null_values), dtype=np.int64, count=len(null_values))
+    codes, unique_ids = pd.factorize(ids)
+    first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+    labels = [str(null_values[row]) for row in first_rows]
+    # e.g. NaN floats made by different computations
+    label_codes, unique_labels = pd.factorize(np.array(labels, dtype=object))
+    return label_codes[codes], list(unique_labels)
+
+
+def make_group_labels(group_columns: list) -> list:
+    """
+    Labels each row with the comma separated values of the group columns, as in
+    ", ".join(map(str, row)), formatting each distinct combination of values once
+    :param group_columns: list of pandas Series of the same length
+    :return: list of strings, one per row
+    """
+    if not group_columns:
+        return []
+    combination_codes, combination_labels = make_group_codes(group_columns)
+    return combination_labels[combination_codes].tolist()
+
+
+def make_group_codes(group_columns: list) -> [np.ndarray, np.ndarray]:
+    """
+    :param group_columns: non-empty list of pandas Series of the same length
+    :return: code of the group of each row, and the label of each code, see make_group_labels
+    """
+    codes_per_column = []
+    labels_per_column = []
+    for group_column in group_columns:
+        codes, uniques = pd.factorize(group_column)
+        labels = [str(value) for value in uniques]
+        is_null = codes == -1
+        if is_null.any():
+            null_codes, null_labels = make_null_labels(
+                group_column[is_null].to_numpy(dtype=object)
+            )
+            codes[is_null] = len(labels) + null_codes
+            labels.extend(null_labels)
+        codes_per_column.append(codes)
+        labels_per_column.append(np.array(labels, dtype=object))
+    # labels of the combinations of values present, added a column at a time
+    combination_codes = codes_per_column[0]
+    combination_labels = labels_per_column[0]
+    for codes, labels in zip(codes_per_column[1:], labels_per_column[1:]):
+        pair_codes = combination_codes * len(labels) + codes
+        num_pairs = len(combination_labels) * len(labels)
+        if num_pairs <= len(pair_codes):
+            # few enough to count, rather than hash
+            is_present = np.bincount(pair_codes, minlength=num_pairs) > 0
+            present_pairs = np.flatnonzero(is_present)
+            combination_codes = (np.cumsum(is_present) - 1)[pair_codes]
+        else:
+            combination_codes, present_pairs = pd.factorize(pair_codes)
+        combination_labels = np.array(
+            [
+                f"{combination_label}, {label}"
+                for combination_label, label in zip(
+                    combination_labels[present_pairs // len(labels)],
+                    labels[present_pairs % len(labels)],
+                )
+            ],
+            dtype=object,
+        )
+    return combination_codes, combination_labels
+
+
+def merge_style(trace_dict: dict, style_dict: dict) -> dict:
+    """
+    Merges the style of a group into its trace, as plotly.js does: nested dicts are merged
+    and the other values, arrays included, replaced
+    :param trace_dict: plotly trace
+    :param style_dict: value of a style of the groupby transform, e.g. {"marker": {"color": "red"}}
+    :return: the trace
+    """
+    for key, value in style_dict.items():
+        if isinstance(value, dict) and isinstance(trace_dict.get(key), dict):
+            merge_style(trace_dict[key], value)
+        else:
+            trace_dict[key] = copy.deepcopy(value)
+    return trace_dict
+
+
+def render_hover_template(hover_column_names: list) -> str:
+    return render_template(HOVER_TEMPLATE_HTML, hover_column_names=hover_column_names)
+
+
 class PlotlyPlot(Graphic):
     def make_dict_for_html_plot(self):
         """
@@ -160,6 +296,8 @@ class PlotlyPlot(Graphic):
         # Future: if we support having more than graphic plotted need-
         # or len(plot_options[DATA]) > 1 with some other logic.
 
+        num_traces = len(plot_options[DATA])
+        traces = []
         for index, plotly_data_dict in enumerate(plot_options[DATA]):
             if GROUPBY in plotly_data_dict.get(TRANSFORMS, {}):
                 plot_options[LAYOUT] = add_toggle_layout_button(
@@ -170,10 +308,9 @@ class PlotlyPlot(Graphic):
                     plotly_data_dict[AXIS_TO_SORT_ALONG], inplace=True
                 )
                 data_sorted = True
-            for axis in POSSIBLE_AXIS:
-                if axis in plotly_data_dict:
-
-                    if index == 0:
+            if index == 0:
+                for axis in POSSIBLE_AXIS:
+                    if axis in plotly_data_dict:
                         # if there is no label, label the columns with the first lines/scatters column names
                         layout_dict = plot_options.get(LAYOUT, {})
                         if HOVERMODE not in layout_dict:
@@ -181,51 +318,186 @@ class PlotlyPlot(Graphic):
                         plot_options[LAYOUT] = add_layout_axis_defaults(
                             layout_dict, axis, plotly_data_dict[axis]
                         )
-                    # moving the contents of the data to where plotly expects it
-                    # from the output of the database
-                    plotly_data_dict[axis] = self.data[plotly_data_dict[axis]]
-            for error_axis in POSSIBLE_ERROR_AXES:
-                if error_axis in plotly_data_dict:
-                    plotly_data_dict[error_axis][ARRAY_STRING] = self.data[
-                        plotly_data_dict[error_axis][ARRAY_STRING]
-                    ]
-            if TRANSFORMS in plotly_data_dict:
-                plotly_data_dict[TRANSFORMS] = self.put_data_in_transforms(
-                    plotly_data_dict[TRANSFORMS]
+            groupby_dict = plotly_data_dict.get(TRANSFORMS, {}).get(GROUPBY)
+            if (
+                get_app_config(PLOTLY_SERVER_GROUPBY, False)
+                and groupby_dict is not None
+                and groupby_dict.get(ENABLED, True)
+            ):
+                split_traces = self.split_trace_by_groups(
+                    plotly_data_dict, index, num_traces
+                )
+            else:
+                split_traces = [(plotly_data_dict, self.data)]
+            for trace_dict, trace_data in split_traces:
+                traces.append(
+                    self.put_data_in_trace(trace_dict, trace_data, plot_options)
                 )
-            if HOVERTEXT in plotly_data_dict:
-                plotly_data_dict = self.get_hover_data_in_plotly_form(plotly_data_dict)
+        plot_options[DATA] = traces
 
-        self.graph_json_str = json.dumps(
-            plot_options, cls=plotly.utils.PlotlyJSONEncoder
-        )
+        self.graph_json_str = dumps_plot_json(plot_options)
 
-    def get_hover_data_in_plotly_form(self, plotly_data_dict):
-        hover_column_names = plotly_data_dict.pop(HOVERTEXT, [])
-        # transposes a list of lists of column data to a list of lists of row data
-        plotly_data_dict[CUSTOM_DATA] = list(
-            map(list, zip(*[self.data[col_name] for col_name in hover_column_names]),)
+    def put_data_in_trace(
+        self, plotly_data_dict: dict, data: pd.DataFrame, plot_options: dict
+    ) -> dict:
+        """
+        Replaces the column names of a trace with the data of the columns
+        :param plotly_data_dict: trace of the graphic config
+        :param data: rows of the trace
+        :param plot_options: the plot, whose layout gets the date axes
+        :return: plotly trace
+        """
+        for axis in POSSIBLE_AXIS:
+            if axis in plotly_data_dict:
+                # moving the contents of the data to where plotly expects it
+                # from the output of the database
+                column_name = plotly_data_dict[axis]
+                plotly_data_dict[axis] = self.make_trace_array(data[column_name], axis)
+                if isinstance(
+                    plotly_data_dict[axis], dict
+                ) and pd.api.types.is_datetime64_dtype(data[column_name]):
+                    # typed arrays send dates as numbers
+                    layout_dict = plot_options.setdefault(LAYOUT, {})
+                    layout_dict.setdefault(PLOT_AXIS.format(axis), {}).setdefault(
+                        TYPE, DATE
+                    )
+        for error_axis in POSSIBLE_ERROR_AXES:
+            if error_axis in plotly_data_dict:
+                plotly_data_dict[error_axis][ARRAY_STRING] = self.make_trace_array(
+                    data[plotly_data_dict[error_axis][ARRAY_STRING]], error_axis
+                )
+        if TRANSFORMS in plotly_data_dict:
+            plotly_data_dict[TRANSFORMS] = self.put_data_in_transforms(
+                plotly_data_dict[TRANSFORMS], data
+            )
+        if HOVERTEXT in plotly_data_dict:
+            plotly_data_dict = self.get_hover_data_in_plotly_form(
+                plotly_data_dict, data
+            )
+        return plotly_data_dict
+
+    def split_trace_by_groups(
+        self, plotly_data_dict: dict, trace_index: int, num_traces: int
+    ) -> list:
+        """
+        Does the work of the groupby transform of plotly.js on the server:
+        one trace per group, named and styled as plotly.js would,
+        rather than the whole data and the group of each point
+        :param plotly_data_dict: trace of the graphic config, with a groupby transform
+        :param trace_index: position of the trace in the plot, for its default name
+        :param num_traces: number of traces of the plot
+        :return: list of the trace and the rows of each group, in the order of their first row
+        """
+        transform_dict = dict(plotly_data_dict[TRANSFORMS])
+        groupby_dict = transform_dict.pop(GROUPBY)
+        base_trace_dict = {
+            key: value for key, value in plotly_data_dict.items() if key != TRANSFORMS
+        }
+        if transform_dict:
+            # e.g. aggregations, done by plotly.js on each group
+            base_trace_dict[TRANSFORMS] = transform_dict
+        if len(self.data) == 0:
+            return [(base_trace_dict, self.data)]
+        codes, labels = make_group_codes(
+            [self.data[col_name] for col_name in groupby_dict[GROUPS]]
         )
+        # plotly.js matches the style targets as strings
+        style_dicts = {
+            str(style[TARGET]): style.get(VALUE, {})
+            for style in groupby_dict.get(STYLES, [])
+        }
+        name_format = groupby_dict.get(
+            NAME_FORMAT,
+            GROUP_ESCAPE if num_traces == 1 else f"{GROUP_ESCAPE} ({TRACE_ESCAPE})",
+        )
+        trace_name = str(plotly_data_dict.get(NAME, f"trace {trace_index}"))
+        split_traces = []
+        for code, group_data in self.data.groupby(codes, sort=False):
+            label = labels[code]
+            trace_dict = copy.deepcopy(base_trace_dict)
+            trace_dict[NAME] = name_format.replace(GROUP_ESCAPE, label).replace(
+                TRACE_ESCAPE, trace_name
+            )
+            split_traces.append(
+                (merge_style(trace_dict, style_dicts.get(label, {})), group_data)
+            )
+        return split_traces
 
-        plotly_data_dict[HOVER_TEMPLATE] = render_template(
-            HOVER_TEMPLATE_HTML, hover_column_names=hover_column_names
+    @staticmethod
+    def make_trace_array(values: pd.Series, array_name: str):
+        """
+        :param values: data column
+        :param array_name: name of the trace array, e.g. x or error_y
+        :return: the data column, rounded as per PLOTLY_SIGNIFICANT_DIGITS,
+        or its typed array when PLOTLY_TYPED_ARRAYS is on
+        """
+        significant_digits = get_app_config(PLOTLY_SIGNIFICANT_DIGITS, {}).get(
+            array_name
         )
+        if significant_digits is not None and pd.api.types.is_float_dtype(
+            values.dtype
+        ):
+            values = pd.Series(
+                round_to_significant_digits(values.to_numpy(), significant_digits)
+            )
+        if get_app_config(PLOTLY_TYPED_ARRAYS, False):
+            typed_array = to_typed_array(
+                values, get_app_config(PLOTLY_TYPED_ARRAY_FLOAT32, False)
+            )
+            if typed_array is not None:
+                return typed_array
+        return values
+
+    def get_hover_data_in_plotly_form(self, plotly_data_dict, data):
+        hover_column_names = plotly_data_dict.pop(HOVERTEXT, [])
+        hover_columns = [data[col_name] for col_name in hover_column_names]
+        if (
+            get_app_config(PLOTLY_TYPED_ARRAYS, False)
+            and hover_columns
+            and all(is_numeric_column(hover_column) for hover_column in hover_columns)
+        ):
+            # one row of numbers per point
+            plotly_data_dict[CUSTOM_DATA] = to_typed_array(
+                np.column_stack(
+                    [hover_column.to_numpy() for hover_column in hover_columns]
+                ),
+                get_app_config(PLOTLY_TYPED_ARRAY_FLOAT32, False),
+            )
+        else:
+            plotly_data_dict[CUSTOM_DATA] = make_hover_rows(hover_columns)
+
+        hover_template = self.rendered_templates.get(tuple(hover_column_names))
+        if hover_template is None:
+            hover_template = render_hover_template(hover_column_names)
+        plotly_data_dict[HOVER_TEMPLATE] = hover_template
         return plotly_data_dict
 
-    def put_data_in_transforms(self, transform_dict):
+    def render_templates(self) -> dict:
+        """
+        Renders the hover template of each trace
+        :return: dict of hover templates keyed by the tuple of hover column names
+        """
+        return {
+            tuple(plotly_data_dict[HOVERTEXT]): render_hover_template(
+                plotly_data_dict[HOVERTEXT]
+            )
+            for plotly_data_dict in self.graphic_dict[PLOT_SPECIFIC_INFO][DATA]
+            if HOVERTEXT in plotly_data_dict
+        }
+
+    @staticmethod
+    def put_data_in_transforms(transform_dict, data):
         """
         puts the data into the transform dictionary in the form 1st elem, 2 elem, ...
         :param transform_list:
+        :param data: rows of the trace
         :return:
         """
 
         def concatenate_columns(transform_dict):
-            transform_dict[GROUPS] = [
-                ", ".join(map(str, data_list))
-                for data_list in zip(
-                    *[self.data[col_name] for col_name in transform_dict[GROUPS]]
-                )
-            ]
+            transform_dict[GROUPS] = make_group_labels(
+                [data[col_name] for col_name in transform_dict[GROUPS]]
+            )
             return transform_dict
 
         transform_list = []
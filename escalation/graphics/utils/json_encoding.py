@@ -0,0 +1,239 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+"""
+Encodes the plot payloads of the graphics into json.
+The data columns are converted to json-ready lists a whole column at a time,
+rather than dispatched through the plotly encoder one object at a time.
+The output is the same as json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder):
+NaN, infinities, NaT and None are encoded as null, and datetimes as iso format strings.
+Numeric columns can instead be sent as binary typed arrays, see to_typed_array
+"""
+
+import base64
+import json
+
+from flask import current_app, has_app_context
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+import plotly
+
+from utility.constants import PLOT_JSON_BACKEND
+
+STDLIB_JSON_BACKEND = "json"
+ORJSON_BACKEND = "orjson"
+# object columns of these types are converted by tolist, the others value by value
+PLAIN_OBJECT_DTYPES = {
+    "string",
+    "integer",
+    "floating",
+    "mixed-integer-float",
+    "boolean",
+    "empty",
+}
+NANOSECONDS_PER_SECOND = 10 ** 9
+NANOSECONDS_PER_MILLISECOND = 10 ** 6
+NANOSECONDS_PER_MICROSECOND = 1000
+# keys and dtypes of the typed arrays of plotly.js
+DTYPE = "dtype"
+BDATA = "bdata"
+SHAPE = "shape"
+TYPED_ARRAY_DTYPES = {"i1", "u1", "i2", "u2", "i4", "u4", "f4", "f8"}
+
+
+def get_app_config(key: str, default=None):
+    # graphics are also built outside of an app, e.g. in the tests
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def to_json_values(values) -> list:
+    """
+    :param values: pandas Series or Index, or numpy array
+    :return: list of json-ready python values, nulls as None
+    """
+    if isinstance(values, (pd.Series, pd.Index)):
+        if pd.api.types.is_datetime64_dtype(values.dtype):
+            return datetime64_to_json_values(values.to_numpy())
+        if (
+            pd.api.types.is_extension_array_dtype(values.dtype)
+            or values.dtype.kind == "m"
+        ):
+            # e.g. categories, timezones or timedeltas, as the pandas objects
+            return object_to_json_values(values.to_numpy(dtype=object))
+        values = values.to_numpy()
+    if values.ndim > 1:
+        return [to_json_values(row) for row in values]
+    if values.dtype.kind in "biumM":
+        # numpy datetimes are encoded as tolist makes them, as by the plotly encoder
+        return values.tolist()
+    if values.dtype.kind == "f":
+        is_finite = np.isfinite(values)
+        if is_finite.all():
+            return values.tolist()
+        return np.where(is_finite, values, None).tolist()
+    return object_to_json_values(values)
+
+
+def datetime64_to_json_values(values: np.ndarray) -> list:
+    """
+    Formats naive datetimes the way Timestamp.isoformat does, with the fraction of
+    a second only for the values that have one
+    :param values: numpy datetime64 array
+    :return: list of iso format strings, NaT as None
+    """
+    nanoseconds = values.astype("datetime64[ns]")
+    is_null = np.isnat(nanoseconds)
+    fractions = nanoseconds.view("int64") % NANOSECONDS_PER_SECOND
+    if (fractions[~is_null] % NANOSECONDS_PER_MICROSECOND).any():
+        # nanoseconds are rare enough to format one by one
+        return object_to_json_values(pd.DatetimeIndex(nanoseconds).to_numpy(object))
+    strings = np.datetime_as_string(nanoseconds, unit="s")
+    if fractions[~is_null].any():
+        strings = np.where(
+            fractions == 0, strings, np.datetime_as_string(nanoseconds, unit="us"),
+        )
+    return np.where(is_null, None, strings).tolist()
+
+
+def object_to_json_values(values: np.ndarray) -> list:
+    """
+    :param values: numpy object array
+    :return: list of json-ready python values, nulls as None
+    """
+    is_null = pd.isna(values)
+    if is_null.any():
+        values = np.where(is_null, None, values)
+    if infer_dtype(values, skipna=True) in PLAIN_OBJECT_DTYPES:
+        return values.tolist()
+    # e.g. dates, decimals or timestamps with a timezone
+    encoder = PlotJSONEncoder()
+    return [
+        value
+        if value is None or isinstance(value, (str, int, float))
+        else encoder.default(value)
+        for value in values.tolist()
+    ]
+
+
+def is_numeric_column(values) -> bool:
+    """
+    :param values: pandas Series
+    :return: whether the column holds numbers that can be sent as a typed array
+    """
+    return (
+        pd.api.types.is_numeric_dtype(values.dtype)
+        and not pd.api.types.is_bool_dtype(values.dtype)
+        and not pd.api.types.is_extension_array_dtype(values.dtype)
+    )
+
+
+def round_to_significant_digits(values: np.ndarray, significant_digits: int):
+    """
+    Rounded numbers make for shorter json, and compress better as typed arrays
+    :param values: numpy float array
+    :param significant_digits: number of significant digits to keep
+    :return: numpy float array
+    """
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        magnitudes = np.floor(np.log10(np.abs(values)))
+        scales = 10.0 ** (significant_digits - 1 - np.nan_to_num(magnitudes))
+        rounded_values = np.round(values * scales) / scales
+    # e.g. numbers too small to scale
+    return np.where(np.isfinite(rounded_values), rounded_values, values)
+
+
+def to_typed_array(values, use_float32: bool = False):
+    """
+    Encodes numbers in the typed array form of plotly.js, base64 of the little-endian bytes.
+    An f8 takes about 11 bytes rather than 20 as a json number, an f4 about 5
+    :param values: pandas Series of numbers or naive datetimes, or numpy array of numbers.
+    Datetimes are sent as milliseconds since the epoch, which plotly.js reads as dates on a date axis
+    :param use_float32: sends floats as float32, which keeps about 7 significant digits
+    :return: dict with the dtype and bdata of the array, and its shape when it has more than one dimension.
+    None for values of other types
+    """
+    if isinstance(values, (pd.Series, pd.Index)):
+        if pd.api.types.is_datetime64_dtype(values.dtype):
+            nanoseconds = values.to_numpy(dtype="datetime64[ns]")
+            values = np.where(
+                np.isnat(nanoseconds),
+                np.nan,
+                nanoseconds.view("int64") / NANOSECONDS_PER_MILLISECOND,
+            )
+            # float32 milliseconds would be off by minutes
+            use_float32 = False
+        elif is_numeric_column(values):
+            values = values.to_numpy()
+        else:
+            return None
+    if values.dtype.kind in "iu" and values.dtype.str[1:] not in TYPED_ARRAY_DTYPES:
+        # plotly.js has no 64 bit integer arrays
+        int32_info = np.iinfo(np.int32)
+        if values.size == 0 or (
+            values.min() >= int32_info.min and values.max() <= int32_info.max
+        ):
+            values = values.astype(np.int32)
+        else:
+            values = values.astype(np.float64)
+    elif values.dtype.kind == "f":
+        values = values.astype(np.float32 if use_float32 else np.float64)
+    elif values.dtype.kind not in "iu":
+        return None
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+    typed_array = {
+        DTYPE: values.dtype.str[1:],
+        BDATA: base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+    if values.ndim > 1:
+        typed_array[SHAPE] = ",".join(str(length) for length in values.shape)
+    return typed_array
+
+
+class PlotJSONEncoder(plotly.utils.PlotlyJSONEncoder):
+    """
+    PlotlyJSONEncoder that converts data columns and numpy scalars without trying
+    each of the encodings of the plotly encoder first
+    """
+
+    def default(self, obj):
+        if isinstance(obj, (pd.Series, pd.Index, np.ndarray)):
+            return to_json_values(obj)
+        if isinstance(obj, (np.integer, np.floating, np.bool_)):
+            return obj.item()
+        return super().default(obj)
+
+
+def dumps_with_json(obj) -> str:
+    return json.dumps(obj, cls=PlotJSONEncoder)
+
+
+def dumps_with_orjson(obj) -> str:
+    """
+    Same json content, without the spaces after the separators.
+    Needs the optional orjson package
+    """
+    import orjson
+
+    return orjson.dumps(
+        obj, default=PlotJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS
+    ).decode("utf-8")
+
+
+JSON_BACKENDS = {
+    STDLIB_JSON_BACKEND: dumps_with_json,
+    ORJSON_BACKEND: dumps_with_orjson,
+}
+
+
+def dumps_plot_json(obj, backend: str = None) -> str:
+    """
+    :param obj: plot payload, dicts and lists that may hold pandas Series, numpy arrays and scalars
+    :param backend: key of JSON_BACKENDS, defaults to the PLOT_JSON_BACKEND of the app
+    :return: json string
+    """
+    if backend is None:
+        backend = get_app_config(PLOT_JSON_BACKEND, STDLIB_JSON_BACKEND)
+    return JSON_BACKENDS[backend](obj)
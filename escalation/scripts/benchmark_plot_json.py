@@ -0,0 +1,161 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+"""
+Times the json encoding of a plotly scatter plot against the plotly json encoder,
+and checks that both give the same json.
+Then compares the size of the json with the typed array encodings.
+
+example usage, from the escalation folder:
+PYTHONPATH=. python scripts/benchmark_plot_json.py 1000000
+"""
+
+import copy
+import gzip
+import json
+import sys
+import time
+from unittest import mock
+
+from flask import Flask
+import numpy as np
+import pandas as pd
+import plotly
+
+from graphics import plotly_plot
+from graphics.plotly_plot import PlotlyPlot
+from graphics.utils.json_encoding import JSON_BACKENDS
+from utility.constants import (
+    DATA,
+    GROUPBY,
+    GROUPS,
+    HOVERTEXT,
+    PLOT_SPECIFIC_INFO,
+    PLOTLY_SIGNIFICANT_DIGITS,
+    PLOTLY_TYPED_ARRAYS,
+    PLOTLY_TYPED_ARRAY_FLOAT32,
+    TRANSFORMS,
+)
+
+HOVER_COLUMNS = ("sex", "measured_at")
+# app config of each typed array encoding
+TYPED_ARRAY_CONFIGS = {
+    "typed arrays": {PLOTLY_TYPED_ARRAYS: True},
+    "float32 typed arrays": {
+        PLOTLY_TYPED_ARRAYS: True,
+        PLOTLY_TYPED_ARRAY_FLOAT32: True,
+    },
+    "float32 typed arrays, 4 digits": {
+        PLOTLY_TYPED_ARRAYS: True,
+        PLOTLY_TYPED_ARRAY_FLOAT32: True,
+        PLOTLY_SIGNIFICANT_DIGITS: {"x": 4, "y": 4},
+    },
+}
+# scatter of numbers only, as typed arrays are only used for numbers and datetimes
+NUMERIC_GRAPHIC_DICT = {
+    PLOT_SPECIFIC_INFO: {
+        DATA: [
+            {
+                "type": "scattergl",
+                "mode": "markers",
+                "x": "body_mass_g",
+                "y": "culmen_length_mm",
+            }
+        ]
+    }
+}
+GRAPHIC_DICT = {
+    PLOT_SPECIFIC_INFO: {
+        DATA: [
+            {
+                "type": "scattergl",
+                "mode": "markers",
+                "x": "body_mass_g",
+                "y": "flipper_length_mm",
+                HOVERTEXT: list(HOVER_COLUMNS),
+                TRANSFORMS: {GROUPBY: {GROUPS: ["island"]}},
+            }
+        ]
+    }
+}
+
+
+def make_data(num_rows: int) -> pd.DataFrame:
+    random_state = np.random.RandomState(0)
+    body_mass = random_state.normal(4000, 800, num_rows)
+    # missing measurements
+    body_mass[::50] = np.nan
+    return pd.DataFrame(
+        {
+            "body_mass_g": body_mass,
+            "flipper_length_mm": random_state.randint(170, 230, num_rows),
+            "culmen_length_mm": random_state.uniform(30, 60, num_rows),
+            "sex": random_state.choice(["MALE", "FEMALE", None], num_rows),
+            "island": random_state.choice(["Biscoe", "Dream", "Torgersen"], num_rows),
+            "measured_at": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(random_state.randint(0, 10 ** 8, num_rows), unit="s"),
+        }
+    )
+
+
+def make_graph_json(data: pd.DataFrame, graphic_dict: dict = None) -> [str, float]:
+    plot = PlotlyPlot(
+        copy.deepcopy(graphic_dict or GRAPHIC_DICT),
+        rendered_templates={HOVER_COLUMNS: "hover"},
+    )
+    plot.data = data.copy()
+    start_time = time.perf_counter()
+    plot.make_dict_for_html_plot()
+    return plot.graph_json_str, time.perf_counter() - start_time
+
+
+def benchmark(num_rows: int):
+    data = make_data(num_rows)
+    # the plotly encoder, handed the pandas columns and numpy scalars as they are
+    with mock.patch.object(
+        plotly_plot,
+        "dumps_plot_json",
+        lambda obj: json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder),
+    ), mock.patch.object(plotly_plot, "to_json_values", lambda values: values):
+        plotly_json, plotly_seconds = make_graph_json(data)
+    print(f"{num_rows} rows, plotly encoder: {plotly_seconds:.2f}s")
+    for backend in JSON_BACKENDS:
+        try:
+            with mock.patch.object(
+                plotly_plot, "dumps_plot_json", JSON_BACKENDS[backend]
+            ):
+                graph_json, seconds = make_graph_json(data)
+        except ImportError:
+            print(f"{backend}: not installed")
+            continue
+        assert json.loads(graph_json) == json.loads(plotly_json)
+        print(
+            f"{backend}: {seconds:.2f}s, {plotly_seconds / seconds:.1f}x faster, "
+            f"same output: {graph_json == plotly_json}"
+        )
+    print_typed_array_sizes(data)
+
+
+def print_size(encoding: str, graph_json: str, seconds: float):
+    graph_bytes = graph_json.encode("utf-8")
+    gzip_bytes = gzip.compress(graph_bytes, compresslevel=6)
+    print(
+        f"{encoding}: {len(graph_bytes) / 1024 ** 2:.1f}MB, "
+        f"{len(gzip_bytes) / 1024 ** 2:.1f}MB gzipped, {seconds:.2f}s"
+    )
+
+
+def print_typed_array_sizes(data: pd.DataFrame):
+    print("numeric scatter:")
+    graph_json, seconds = make_graph_json(data, NUMERIC_GRAPHIC_DICT)
+    print_size("json", graph_json, seconds)
+    for encoding, config in TYPED_ARRAY_CONFIGS.items():
+        app = Flask(__name__)
+        app.config.update(config)
+        with app.app_context():
+            graph_json, seconds = make_graph_json(data, NUMERIC_GRAPHIC_DICT)
+        print_size(encoding, graph_json, seconds)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,93 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+"""
+Times the hover rows and groupby labels of a plotly trace against building them
+a row at a time, and checks that both give the same output.
+
+example usage, from the escalation folder:
+PYTHONPATH=. python scripts/benchmark_trace_assembly.py 10000 100000 1000000
+"""
+
+import gc
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from graphics.plotly_plot import make_group_labels, make_hover_rows
+from graphics.utils.json_encoding import to_json_values
+
+HOVER_COLUMNS = ("sex", "measured_at", "body_mass_g")
+GROUP_COLUMNS = ("island", "sex")
+DEFAULT_NUM_ROWS = (10000, 100000, 1000000)
+
+
+def make_data(num_rows: int) -> pd.DataFrame:
+    random_state = np.random.RandomState(0)
+    body_mass = random_state.normal(4000, 800, num_rows)
+    # missing measurements
+    body_mass[::50] = np.nan
+    return pd.DataFrame(
+        {
+            "body_mass_g": body_mass,
+            "sex": random_state.choice(["MALE", "FEMALE", None], num_rows),
+            "island": random_state.choice(["Biscoe", "Dream", "Torgersen"], num_rows),
+            "measured_at": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(random_state.randint(0, 10 ** 8, num_rows), unit="s"),
+        }
+    )
+
+
+def make_hover_rows_by_row(hover_columns: list) -> list:
+    return list(
+        map(list, zip(*[to_json_values(hover_column) for hover_column in hover_columns]))
+    )
+
+
+def make_group_labels_by_row(group_columns: list) -> list:
+    return [", ".join(map(str, data_list)) for data_list in zip(*group_columns)]
+
+
+def time_call(function, columns: list) -> [str, float]:
+    # the lists of a previous run would slow down the garbage collections of this one
+    gc.collect()
+    start_time = time.perf_counter()
+    result = function(columns)
+    seconds = time.perf_counter() - start_time
+    return json.dumps(result), seconds
+
+
+def compare(name: str, by_row_function, function, columns: list):
+    by_row_result, by_row_seconds = time_call(by_row_function, columns)
+    result, seconds = time_call(function, columns)
+    assert result == by_row_result
+    print(
+        f"  {name}: {by_row_seconds:.3f}s by row, {seconds:.3f}s vectorized, "
+        f"{by_row_seconds / seconds:.1f}x faster"
+    )
+
+
+def benchmark(num_rows: int):
+    data = make_data(num_rows)
+    print(f"{num_rows} rows:")
+    compare(
+        "hover rows",
+        make_hover_rows_by_row,
+        make_hover_rows,
+        [data[column_name] for column_name in HOVER_COLUMNS],
+    )
+    for num_group_columns in range(1, len(GROUP_COLUMNS) + 1):
+        compare(
+            f"groupby labels of {num_group_columns} column(s)",
+            make_group_labels_by_row,
+            make_group_labels,
+            [data[column_name] for column_name in GROUP_COLUMNS[:num_group_columns]],
+        )
+
+
+if __name__ == "__main__":
+    for num_rows in [int(arg) for arg in sys.argv[1:]] or DEFAULT_NUM_ROWS:
+        benchmark(num_rows)
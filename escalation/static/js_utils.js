@@ -1,13 +1,131 @@
 // Copyright [2020] [Two Six Labs, LLC]
 // Licensed under the Apache License, Version 2.0
 
+// functions drawing the plot json of each graphic on a dashboard page, keyed by graphic name
+const graphic_renderers = {};
+// cytoscape graphs on the page, keyed by their container id
+const cytoscape_instances = {};
+
 function post_to_server(id_on_web_page) {
-    //This allows the web page to focus where the plot was updated instead of starting at the top of the web page
     let web_form=$('#form_'.concat(id_on_web_page));
+    const update_url = web_form.data('update_url');
+    if (update_url && window.fetch) {
+        update_graphic(id_on_web_page, web_form[0], update_url);
+        return;
+    }
+    //This allows the web page to focus where the plot was updated instead of starting at the top of the web page
     web_form.attr('action','#'.concat(id_on_web_page));
     web_form.submit();
 }
 
+function update_graphic(graphic_name, web_form, update_url) {
+    // only the graphic whose selectors changed is recomputed and redrawn
+    fetch(update_url, {method: "POST", body: new FormData(web_form), credentials: "same-origin"})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        })
+        .then(function (graphic_data) {
+            web_form.process.value = 'true';
+            let selectors_div = $('#selectors_'.concat(graphic_name));
+            selectors_div.html(graphic_data["selector_html"]);
+            selectors_div.find('.selectpicker').selectpicker();
+            show_data_notice(graphic_name, graphic_data["data_notice"]);
+            if (graphic_data["plot_info"] !== null) {
+                graphic_renderers[graphic_name](graphic_data["plot_info"]);
+            }
+        })
+        .catch(function () {
+            // fall back to reloading the whole page
+            $(web_form).attr('action','#'.concat(graphic_name));
+            web_form.submit();
+        });
+}
+
+function show_data_notice(graphic_name, data_notice) {
+    let notice_div = document.getElementById("notice_".concat(graphic_name));
+    notice_div.textContent = data_notice || "";
+    notice_div.hidden = !data_notice;
+}
+
+function load_graphic(graphic_name, data_url) {
+    fetch(data_url, {credentials: "same-origin"})
+        .then(response => response.json())
+        .then(function (graphic_data) {
+            show_data_notice(graphic_name, graphic_data["data_notice"]);
+            if (graphic_data["plot_info"] !== null) {
+                graphic_renderers[graphic_name](graphic_data["plot_info"]);
+            }
+        })
+        .catch(() => show_data_notice(graphic_name, "This graphic could not be loaded."));
+}
+
+function load_graphic_when_visible(graphic_name, chart_id, data_url) {
+    // graphics below the fold are only fetched once they are about to be scrolled into view
+    if (!("IntersectionObserver" in window)) {
+        load_graphic(graphic_name, data_url);
+        return;
+    }
+    const observer = new IntersectionObserver(function (entries) {
+        if (entries.some(entry => entry.isIntersecting)) {
+            observer.disconnect();
+            load_graphic(graphic_name, data_url);
+        }
+    }, {rootMargin: "200px"});
+    observer.observe(document.getElementById(chart_id));
+}
+
+// the typed arrays of the plot json, as sent when PLOTLY_TYPED_ARRAYS is on
+const typed_array_classes = {
+    i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+    i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+};
+
+function decode_typed_arrays(value) {
+    // replaces the {dtype, bdata, shape} objects in the plot json with typed arrays,
+    // for the plotly.js versions that don't read them themselves
+    if (value === null || typeof value !== "object") {
+        return value;
+    }
+    if (Array.isArray(value)) {
+        // lists of numbers or strings don't hold typed arrays
+        if (value.length > 0 && value[0] !== null && typeof value[0] === "object") {
+            for (let i = 0; i < value.length; i++) {
+                value[i] = decode_typed_arrays(value[i]);
+            }
+        }
+        return value;
+    }
+    if (typeof value.bdata === "string" && value.dtype in typed_array_classes) {
+        return decode_typed_array(value);
+    }
+    for (const key of Object.keys(value)) {
+        value[key] = decode_typed_arrays(value[key]);
+    }
+    return value;
+}
+
+function decode_typed_array(typed_array) {
+    const binary = atob(typed_array.bdata);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    const values = new typed_array_classes[typed_array.dtype](bytes.buffer);
+    if (!typed_array.shape) {
+        return values;
+    }
+    // two dimensional arrays (e.g. customdata) are lists of rows
+    const [num_rows, num_columns] = typed_array.shape.split(",").map(Number);
+    const rows = new Array(num_rows);
+    for (let i = 0; i < num_rows; i++) {
+        rows[i] = Array.from(values.subarray(i * num_columns, (i + 1) * num_columns));
+    }
+    return rows;
+}
+
 function reset_form(id_on_web_page) {
     //This allows the web page to focus where the plot was updated instead of starting at the top of the web page
     $('#form_'.concat(id_on_web_page))[0].process.value='';
@@ -11,7 +11,6 @@ from types import MappingProxyType
 import pandas as pd
 import pytest
 from flask import current_app
-from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 from werkzeug.datastructures import FileStorage
 
@@ -60,8 +59,7 @@ def addendum_dict():
 @pytest.fixture()
 def rebuild_test_database(test_app_client_sql_backed, mocker):
     # drop all tables associated with the testing app Sqlalchemy Base
-    engine = create_engine(TESTING_DB_URI)
-    current_app.engine = engine
+    engine = current_app.engine
     current_app.Base.metadata.drop_all(bind=engine)
     current_app.Base.metadata.create_all(bind=engine)
 
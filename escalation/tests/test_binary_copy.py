@@ -0,0 +1,191 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import datetime
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+import pytest
+from sqlalchemy.types import (
+    ARRAY,
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    Numeric,
+    Text,
+)
+
+from database import binary_copy
+from database.binary_copy import (
+    BinaryCopyUnsupported,
+    encode_df_as_binary_copy,
+    supports_binary_copy,
+)
+from database.sql_handler import (
+    SqlDataInventory,
+    connect_to_db_using_psycopg2,
+    psycopg2_copy_from_df_chunks,
+)
+from test_app_deploy_data.models import Temperature
+from utility.constants import DATA_SOURCE_TYPE, MAIN_DATA_SOURCE, UPLOAD_CHUNK_SIZE
+
+COLUMN_TYPES = [Integer(), BigInteger(), Float(), Text(), DateTime(), Date(), Boolean()]
+CREATE_TABLE_SQL = (
+    "create temporary table binary_copy_test (integer_column integer, "
+    "bigint_column bigint, float_column double precision, text_column text, "
+    "datetime_column timestamp, date_column date, boolean_column boolean)"
+)
+
+
+@pytest.fixture()
+def binary_copy_test_df():
+    df = pd.DataFrame(
+        {
+            "integer_column": [1, None, -3],
+            "bigint_column": [2 ** 40, 0, None],
+            "float_column": [1.5, np.nan, -0.25],
+            "text_column": ["Adelie", None, "Gentoo"],
+            "datetime_column": pd.to_datetime(
+                ["2020-01-02 03:04:05.678901", None, "1999-12-31 23:59:59"]
+            ),
+            "date_column": pd.to_datetime(["2020-01-02", "1970-01-01", None]),
+            "boolean_column": [True, None, False],
+        }
+    )
+    df["integer_column"] = df["integer_column"].astype("Int64")
+    return df
+
+
+def test_encode_df_as_binary_copy(test_app_client_sql_backed, binary_copy_test_df):
+    conn = connect_to_db_using_psycopg2()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_TABLE_SQL)
+        # split into chunks to check that they make a single stream
+        df_chunks = [binary_copy_test_df.iloc[:2], binary_copy_test_df.iloc[2:]]
+        psycopg2_copy_from_df_chunks(
+            conn, df_chunks, "binary_copy_test", column_types=COLUMN_TYPES
+        )
+        with conn.cursor() as cursor:
+            cursor.execute("select * from binary_copy_test")
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+    assert rows == [
+        (
+            1,
+            2 ** 40,
+            1.5,
+            "Adelie",
+            datetime.datetime(2020, 1, 2, 3, 4, 5, 678901),
+            datetime.date(2020, 1, 2),
+            True,
+        ),
+        (None, 0, None, None, None, datetime.date(1970, 1, 1), None),
+        (
+            -3,
+            None,
+            -0.25,
+            "Gentoo",
+            datetime.datetime(1999, 12, 31, 23, 59, 59),
+            None,
+            False,
+        ),
+    ]
+
+
+def test_encode_df_as_binary_copy_unsupported():
+    assert not supports_binary_copy([Integer(), ARRAY(Integer)])
+    assert not supports_binary_copy([Numeric()])
+    df = pd.DataFrame({"integer_column": [1.5, 2]})
+    with pytest.raises(BinaryCopyUnsupported):
+        encode_df_as_binary_copy(df, [Integer()])
+    df = pd.DataFrame({"datetime_column": ["2020-01-02", "2020-01-03"]})
+    with pytest.raises(BinaryCopyUnsupported):
+        encode_df_as_binary_copy(df, [DateTime()])
+    df = pd.DataFrame({"text_column": ["Adelie", "Gen\x00too"]})
+    with pytest.raises(BinaryCopyUnsupported):
+        encode_df_as_binary_copy(df, [Text()])
+
+
+def test_encode_df_as_binary_copy_slices(binary_copy_test_df):
+    binary_copy_bytes = encode_df_as_binary_copy(binary_copy_test_df, COLUMN_TYPES)
+    # the rows are the same whatever the number of slices they are encoded in
+    with mock.patch.object(binary_copy, "BINARY_COPY_SLICE_ROWS", 2):
+        assert (
+            encode_df_as_binary_copy(binary_copy_test_df, COLUMN_TYPES)
+            == binary_copy_bytes
+        )
+    # text values are separated by their lengths
+    text_bytes = encode_df_as_binary_copy(
+        pd.DataFrame({"text_column": ["é", None, ""]}), [Text()]
+    )
+    assert text_bytes == (
+        b"\x00\x01\x00\x00\x00\x02\xc3\xa9"
+        b"\x00\x01\xff\xff\xff\xff"
+        b"\x00\x01\x00\x00\x00\x00"
+    )
+
+
+def test_copy_falls_back_to_csv_for_later_chunks(test_app_client_sql_backed):
+    conn = connect_to_db_using_psycopg2()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "create temporary table binary_copy_test (integer_column integer, "
+                "text_column text)"
+            )
+        df_chunks = [
+            # all null, so any dtype encodes
+            pd.DataFrame({"integer_column": [None], "text_column": ["Adelie"]}),
+            pd.DataFrame({"integer_column": [2], "text_column": ["Chinstrap"]}),
+            # strings that postgres parses as integers, but binary can't encode
+            pd.DataFrame({"integer_column": ["3"], "text_column": ["Gentoo"]}),
+            pd.DataFrame({"integer_column": [4], "text_column": [None]}),
+        ]
+        psycopg2_copy_from_df_chunks(
+            conn, df_chunks, "binary_copy_test", column_types=[Integer(), Text()]
+        )
+        with conn.cursor() as cursor:
+            cursor.execute("select * from binary_copy_test")
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+    assert rows == [(None, "Adelie"), (2, "Chinstrap"), (3, "Gentoo"), (4, None)]
+
+
+def test_csv_upload_with_datetimes_is_binary(rebuild_test_database):
+    current_app.config[UPLOAD_CHUNK_SIZE] = 2
+    data_inventory = SqlDataInventory(
+        {MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: "temperature"}}
+    )
+    csv_file = StringIO(
+        "Date,Temp\n1981-01-01,20.7\n1981-01-02 06:30:00,17.9\n,18.8\n"
+    )
+    with mock.patch.object(
+        binary_copy,
+        "make_binary_copy_chunks",
+        wraps=binary_copy.make_binary_copy_chunks,
+    ) as make_binary_copy_chunks:
+        data_inventory.write_csv_uploads_to_backend([csv_file], "test_user", "")
+    # read_csv leaves the datetimes as text, they are parsed for the binary format
+    # rather than sending the stream as csv
+    csv_dfs = make_binary_copy_chunks.call_args[0][3]
+    assert csv_dfs == []
+    upload_id = data_inventory.get_new_upload_id_for_table("temperature") - 1
+    rows = (
+        current_app.db_session.query(Temperature.Date, Temperature.Temp)
+        .filter(Temperature.upload_id == upload_id)
+        .order_by(Temperature.row_index)
+        .all()
+    )
+    assert rows == [
+        (datetime.datetime(1981, 1, 1), 20.7),
+        (datetime.datetime(1981, 1, 2, 6, 30), 17.9),
+        (None, 18.8),
+    ]
@@ -0,0 +1,52 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import datetime
+
+from utility.cache import LRUCache, make_cache_key
+
+
+def test_make_cache_key():
+    key = make_cache_key({"a": 1, "b": [1, 2]}, "graphic_0")
+    assert key == make_cache_key({"b": [1, 2], "a": 1}, "graphic_0")
+    assert key != make_cache_key({"a": 1, "b": [2, 1]}, "graphic_0")
+    # values json can't serialize are stringified rather than raising
+    assert make_cache_key(datetime.datetime(1981, 1, 1)) == make_cache_key(
+        datetime.datetime(1981, 1, 1)
+    )
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # touching a makes b the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get("b") is None
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def test_lru_cache_size_bound():
+    cache = LRUCache(max_entries=10, max_size=10, sizeof=len)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    assert len(cache) == 2
+    cache.set("c", "123")
+    assert "a" not in cache
+    assert cache.current_size == 8
+    # values bigger than the whole cache are never stored
+    cache.set("d", "12345678901")
+    assert "d" not in cache
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.current_size == 0
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(max_entries=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
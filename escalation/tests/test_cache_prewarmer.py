@@ -0,0 +1,98 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import threading
+import time
+
+from flask import Flask
+
+from utility.cache_prewarmer import CachePrewarmer, LEADER_LOCK_FILE
+
+
+def wait_until(condition, timeout_seconds=5):
+    deadline = time.time() + timeout_seconds
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_cache_prewarmer_serves_stale_until_refreshed():
+    data_version = [1]
+    refreshed_versions = []
+    refresh_started = threading.Event()
+    finish_refresh = threading.Event()
+
+    def refresh():
+        refresh_started.set()
+        finish_refresh.wait(5)
+        refreshed_versions.append(data_version[0])
+
+    prewarmer = CachePrewarmer(
+        Flask(__name__), refresh, lambda: data_version[0], stale_max_seconds=60
+    )
+    finish_refresh.set()
+    prewarmer.start()
+    wait_until(lambda: prewarmer.refresh_count == 1)
+    assert refreshed_versions == [1]
+    assert not prewarmer.serves_stale()
+
+    refresh_started.clear()
+    finish_refresh.clear()
+    data_version[0] = 2
+    prewarmer.request_refresh()
+    assert prewarmer.serves_stale()
+    assert refresh_started.wait(5)
+    assert prewarmer.serves_stale()
+    finish_refresh.set()
+    wait_until(lambda: prewarmer.refresh_count == 2)
+    assert refreshed_versions == [1, 2]
+    assert not prewarmer.serves_stale()
+
+
+def test_cache_prewarmer_refresh_if_needed():
+    data_version = [1]
+    refreshed_versions = []
+    prewarmer = CachePrewarmer(
+        Flask(__name__),
+        lambda: refreshed_versions.append(data_version[0]),
+        lambda: data_version[0],
+        interval_seconds=0.2,
+    )
+    assert prewarmer.refresh_if_needed()
+    assert not prewarmer.refresh_if_needed()
+    # written by another process
+    data_version[0] = 2
+    assert prewarmer.refresh_if_needed()
+    assert not prewarmer.refresh_if_needed()
+    time.sleep(0.2)
+    assert prewarmer.refresh_if_needed()
+    assert refreshed_versions == [1, 2, 2]
+    # only served from a running prewarmer
+    prewarmer.request_refresh()
+    assert not prewarmer.serves_stale()
+
+
+def test_cache_prewarmer_leader_lock(tmp_path):
+    leader_lock_path = str(tmp_path / LEADER_LOCK_FILE)
+    refreshes = []
+    prewarmers = [
+        CachePrewarmer(
+            Flask(__name__),
+            lambda name=name: refreshes.append(name),
+            lambda: 1,
+            poll_seconds=0.05,
+            stale_max_seconds=60,
+            leader_lock_path=leader_lock_path,
+        )
+        for name in ["first", "second"]
+    ]
+    for prewarmer in prewarmers:
+        prewarmer.start()
+    wait_until(lambda: refreshes)
+    time.sleep(0.2)
+    # only one of the worker processes runs the prewarm queries
+    assert [prewarmer.is_leader for prewarmer in prewarmers].count(True) == 1
+    assert len(refreshes) == 1
+    follower = next(prewarmer for prewarmer in prewarmers if not prewarmer.is_leader)
+    # the follower renders for its viewers, as it doesn't refresh its caches
+    follower.request_refresh()
+    assert not follower.serves_stale()
@@ -0,0 +1,49 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import gzip
+import json
+
+from flask import current_app
+import pytest
+
+from utility.constants import RESPONSE_COMPRESSION_LEVEL
+
+PLOT_JSON = json.dumps({"x": list(range(1000)), "y": list(range(1000))})
+
+
+@pytest.fixture()
+def compression_client(test_app_client_sql_backed):
+    test_app_client_sql_backed.add_url_rule(
+        "/plot_json",
+        "plot_json",
+        lambda: current_app.response_class(PLOT_JSON, mimetype="application/json"),
+    )
+    test_app_client_sql_backed.add_url_rule("/small", "small", lambda: "small")
+    return test_app_client_sql_backed.test_client()
+
+
+def test_compress_response(compression_client):
+    response = compression_client.get(
+        "/plot_json", headers={"Accept-Encoding": "gzip, deflate"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) < len(PLOT_JSON)
+    assert gzip.decompress(response.data).decode() == PLOT_JSON
+    # the compressed body is reused
+    assert len(current_app.compression_cache) == 1
+    response = compression_client.get("/plot_json", headers={"Accept-Encoding": "gzip"})
+    assert gzip.decompress(response.data).decode() == PLOT_JSON
+    assert current_app.compression_cache.hits == 1
+
+    # not accepted by the client
+    response = compression_client.get("/plot_json")
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data(as_text=True) == PLOT_JSON
+    # too small to be worth it
+    response = compression_client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    # turned off
+    current_app.config[RESPONSE_COMPRESSION_LEVEL] = 0
+    response = compression_client.get("/plot_json", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,38 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+from base64 import b64encode
+
+from flask import current_app
+import pandas as pd
+
+from database.connection_pool import get_pool_statistics
+from database.sql_handler import CreateTablesFromCSVs, REPLACE
+from utility.constants import DATABASE_POOL_SIZE
+
+
+def test_bulk_writes_return_connections(
+    rebuild_test_database, sql_data_inventory_fixture, penguin_size_csv_file
+):
+    penguin_size_df = pd.read_csv(penguin_size_csv_file)
+    for _ in range(current_app.config[DATABASE_POOL_SIZE] + 1):
+        sql_data_inventory_fixture.write_data_upload_to_backend(
+            penguin_size_df, "test_user", "test_notes"
+        )
+    csv_sql_creator = CreateTablesFromCSVs(current_app.engine)
+    csv_sql_creator.create_and_fill_new_sql_table_from_df(
+        "pool_test_table", penguin_size_df, REPLACE
+    )
+    pool_statistics = get_pool_statistics(current_app.engine)
+    # only the session holds a connection, the copies gave theirs back
+    assert pool_statistics["checked_out"] <= 1
+    assert pool_statistics["overflow"] <= 0
+
+
+def test_database_pool_view(test_app_client_sql_backed):
+    client = test_app_client_sql_backed.test_client()
+    credentials = b64encode(b"admin:escalation").decode("utf-8")
+    response = client.get(
+        "/admin/database_pool", headers={"Authorization": f"Basic {credentials}"}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["size"] == current_app.config[DATABASE_POOL_SIZE]
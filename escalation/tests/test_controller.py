@@ -3,12 +3,16 @@
 import copy
 import json
 
+from flask import current_app
+
 from tests.conftest import PEARL_HARBOR
 from controller import (
+    assemble_html_with_graphs_from_page_config,
     create_labels_for_available_pages,
     get_datasource_metadata_formatted_for_admin_panel,
-    make_dict_of_graphic_objects,
+    make_page_plan,
 )
+from graphics.utils.available_graphics import AVAILABLE_GRAPHICS
 from tests.conftest import graphic_json_fixture, addendum_dict
 from utility.constants import (
     ACTIVE_SELECTORS,
@@ -17,40 +21,44 @@ from utility.constants import (
     FILTER,
     GRAPHIC_NUM,
     DATA_FILTERS,
+    DATA,
+    DATA_NOTICE,
+    GRAPHIC_ASSEMBLY_MAX_WORKERS,
+    JINJA_PLOT_INFO,
+    OBJECT,
+    PLOT_ID,
+    PLOT_MANAGER,
+    PLOT_SPECIFIC_INFO,
 )
 
 
-def test_make_dict_of_graphic_classes(graphic_json_fixture, addendum_dict):
+def test_make_graphic_object(
+    test_app_client_sql_backed, graphic_json_fixture, addendum_dict
+):
     single_page_config_dict = graphic_json_fixture
-    single_page_config_dict_test = copy.deepcopy(single_page_config_dict)
-    graphic_class_dict = make_dict_of_graphic_objects(
-        single_page_config_dict_test, None
-    )
+    page_plan = make_page_plan(copy.deepcopy(single_page_config_dict))
+    graphic_object = page_plan[GRAPHIC_NUM.format(0)].make_graphic_object(None)
     # add instructions should call the other two methods which I am already testing for.
     # So I want to make sure it in actually doing something
     assert (
-        graphic_class_dict[GRAPHIC_NUM.format(0)].graphic_dict
-        != single_page_config_dict[GRAPHIC_NUM.format(0)]
+        graphic_object.graphic_dict != single_page_config_dict[GRAPHIC_NUM.format(0)]
     )
-    assert DATA_FILTERS not in graphic_class_dict[GRAPHIC_NUM.format(0)].graphic_dict
+    assert DATA_FILTERS not in graphic_object.graphic_dict
 
-    single_page_config_dict_test = copy.deepcopy(single_page_config_dict)
-    graphic_class_dict = make_dict_of_graphic_objects(
-        single_page_config_dict_test, addendum_dict
+    graphic_object = page_plan[GRAPHIC_NUM.format(0)].make_graphic_object(
+        addendum_dict[GRAPHIC_NUM.format(0)]
     )
-    assert DATA_FILTERS in graphic_class_dict[GRAPHIC_NUM.format(0)].graphic_dict
+    assert DATA_FILTERS in graphic_object.graphic_dict
 
 
-def test_make_dict_of_graphic_classes_with_different_addendum(
-    graphic_json_fixture, addendum_dict
+def test_make_graphic_object_with_empty_addendum(
+    test_app_client_sql_backed, graphic_json_fixture, addendum_dict
 ):
-    single_page_config_dict = graphic_json_fixture
-    single_page_config_dict_test = copy.deepcopy(single_page_config_dict)
-    new_addendum_dict = {"a_different_graph": addendum_dict[GRAPHIC_NUM.format(0)]}
-    graphic_class_dict = make_dict_of_graphic_objects(
-        single_page_config_dict_test, new_addendum_dict
-    )
-    graphic_0_dict = graphic_class_dict[GRAPHIC_NUM.format(0)].graphic_dict
+    page_plan = make_page_plan(copy.deepcopy(graphic_json_fixture))
+    graphic_plan = page_plan[GRAPHIC_NUM.format(0)]
+    # selections of another graphic don't leave the plan modified
+    graphic_plan.make_graphic_object(addendum_dict[GRAPHIC_NUM.format(0)])
+    graphic_0_dict = graphic_plan.make_graphic_object({}).graphic_dict
     assert len(graphic_0_dict[SELECTABLE_DATA_DICT][FILTER][0][ACTIVE_SELECTORS]) == 1
     assert (
         SHOW_ALL_ROW
@@ -58,6 +66,31 @@ def test_make_dict_of_graphic_classes_with_different_addendum(
     )
 
 
+def test_make_page_plan(
+    test_app_client_sql_backed, graphic_json_fixture, addendum_dict
+):
+    page_config_dict = copy.deepcopy(graphic_json_fixture)
+    page_plan = make_page_plan(page_config_dict)
+    graphic_plan = page_plan[GRAPHIC_NUM.format(0)]
+    for graphic_addendum_dict in [None, addendum_dict[GRAPHIC_NUM.format(0)]]:
+        graphic_dict = copy.deepcopy(graphic_json_fixture[GRAPHIC_NUM.format(0)])
+        graphic_class = AVAILABLE_GRAPHICS[graphic_dict[PLOT_MANAGER]][OBJECT]
+        expected_graphic_object = graphic_class(
+            graphic_dict, graphic_addendum_dict or {}
+        )
+        expected_graphic_object.add_instructions_to_config_dict()
+        graphic_object = graphic_plan.make_graphic_object(graphic_addendum_dict)
+        assert graphic_object.graphic_dict == expected_graphic_object.graphic_dict
+        # every graphic object gets a copy to modify
+        graphic_object.graphic_dict[PLOT_SPECIFIC_INFO][DATA].clear()
+        assert graphic_plan.make_graphic_object(graphic_addendum_dict).graphic_dict[
+            PLOT_SPECIFIC_INFO
+        ][DATA]
+    # the hover template is rendered once for the plan
+    assert len(graphic_plan.rendered_templates) == 1
+    assert page_config_dict == graphic_json_fixture
+
+
 def test_extract_buttons(main_json_sql_backend_fixture):
     aval_pg = main_json_sql_backend_fixture["available_pages"]
     buttons = create_labels_for_available_pages(aval_pg)
@@ -74,6 +107,30 @@ def test_assemble_html_with_graphs_from_page_config():
     assert False
 
 
+def test_assemble_html_with_graphs_in_parallel(
+    rebuild_test_database, graphic_json_fixture
+):
+    current_app.config[GRAPHIC_ASSEMBLY_MAX_WORKERS] = 1
+    serial_plot_specs = assemble_html_with_graphs_from_page_config(
+        make_page_plan(copy.deepcopy(graphic_json_fixture))
+    )
+    # a graphic that fails doesn't take down the rest of the page
+    graphic_json_fixture[GRAPHIC_NUM.format(0)][PLOT_SPECIFIC_INFO][DATA][0][
+        "x"
+    ] = "penguin_size:not_a_column"
+    current_app.config[GRAPHIC_ASSEMBLY_MAX_WORKERS] = 4
+    current_app.graphic_cache.clear()
+    plot_specs = assemble_html_with_graphs_from_page_config(
+        make_page_plan(graphic_json_fixture)
+    )
+    assert [plot_spec[PLOT_ID] for plot_spec in plot_specs] == list(
+        graphic_json_fixture.keys()
+    )
+    assert plot_specs[0][JINJA_PLOT_INFO] is None
+    assert plot_specs[0][DATA_NOTICE]
+    assert plot_specs[1:] == serial_plot_specs[1:]
+
+
 def test_assemble_plot_from_instructions():
     assert False
 
@@ -1,5 +1,28 @@
+import json
+
+from flask import current_app
+import pytest
 from werkzeug.datastructures import ImmutableMultiDict
+from werkzeug.http import parse_cookie
 
+from controller import make_pages_dict
+from database.sql_handler import SqlDataInventory
+from utility.constants import (
+    ACTIVE,
+    ADDENDUM_DICT,
+    AVAILABLE_PAGES,
+    AVAILABLE_PAGES_DICT,
+    DATA,
+    DATA_NOTICE,
+    DEFERRED_GRAPHIC_LOADING,
+    GRAPHIC_MAX_ROWS,
+    INACTIVE,
+    PLOTLY_SIGNIFICANT_DIGITS,
+    PLOTLY_TYPED_ARRAYS,
+    JINJA_PLOT_INFO,
+    SELECTOR_HTML,
+    TEST_APP_DEPLOY_DATA,
+)
 from views.dashboard import add_form_to_addendum_dict
 
 
@@ -26,3 +49,169 @@ def test_add_form_to_addendum_dict():
     new_addendum_dict = {}
     add_form_to_addendum_dict(form, new_addendum_dict)
     assert new_addendum_dict == addendum_dict
+
+
+@pytest.fixture()
+def dashboard_client(
+    rebuild_test_database, test_app_client_sql_backed, main_json_sql_backend_fixture
+):
+    test_app_client_sql_backed.config[AVAILABLE_PAGES_DICT] = make_pages_dict(
+        main_json_sql_backend_fixture[AVAILABLE_PAGES], TEST_APP_DEPLOY_DATA
+    )
+    return test_app_client_sql_backed.test_client()
+
+
+def test_graphic_data(dashboard_client):
+    response = dashboard_client.get("/dashboard/penguin/big_penguins/data")
+    assert response.status_code == 200
+    graphic_data = response.get_json()
+    assert graphic_data[JINJA_PLOT_INFO][DATA]
+    assert graphic_data[DATA_NOTICE] is None
+
+    response = dashboard_client.get("/dashboard/penguin/not_a_graphic/data")
+    assert response.status_code == 404
+    response = dashboard_client.get("/dashboard/not_a_page/big_penguins/data")
+    assert response.status_code == 404
+
+
+def test_graphic_page_deferred(dashboard_client):
+    current_app.config[DEFERRED_GRAPHIC_LOADING] = True
+    response = dashboard_client.get("/dashboard/penguin")
+    assert response.status_code == 200
+    assert b"load_graphic_when_visible" in response.data
+    assert b"/dashboard/penguin/big_penguins/data" in response.data
+    # the selectors are rendered with the page
+    assert b"selectpicker" in response.data
+
+
+def test_graphic_data_post(dashboard_client):
+    form = {
+        "graphic_name": "big_penguins",
+        "process": "true",
+        "filter_0": "MALE",
+        "filter_1": "Dream",
+        "numerical_filter_0_max_value": "",
+        "numerical_filter_0_min_value": "",
+    }
+    response = dashboard_client.post("/dashboard/penguin/big_penguins/data", data=form)
+    assert response.status_code == 200
+    graphic_data = response.get_json()
+    assert graphic_data[JINJA_PLOT_INFO][DATA]
+    assert "selectpicker" in graphic_data[SELECTOR_HTML]
+    # the new selections are stored for this graphic only
+    cookies = parse_cookie(response.headers["Set-Cookie"])
+    addendum_dict = json.loads(cookies[ADDENDUM_DICT])
+    assert addendum_dict == {
+        "big_penguins": {
+            "filter_0": ["MALE"],
+            "filter_1": ["Dream"],
+            "numerical_filter_0_max_value": [""],
+            "numerical_filter_0_min_value": [""],
+        }
+    }
+
+
+def test_graphic_page_etag(dashboard_client, mocker):
+    response = dashboard_client.get("/dashboard/penguin")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # a matching etag is answered without building any graphic
+    data_handler = current_app.config.data_handler
+    current_app.config.data_handler = mocker.MagicMock(side_effect=AssertionError)
+    response = dashboard_client.get(
+        "/dashboard/penguin", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    response = dashboard_client.get(
+        "/dashboard/penguin/big_penguins/data", headers={"If-None-Match": etag}
+    )
+    assert response.status_code != 304
+    current_app.config.data_handler = data_handler
+
+    # new data means a new etag
+    SqlDataInventory.update_data_upload_metadata_active(
+        "penguin_size", {"id_1": ACTIVE, "id_2": INACTIVE}
+    )
+    response = dashboard_client.get(
+        "/dashboard/penguin", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize(
+    "config_key,config_value",
+    [
+        (DEFERRED_GRAPHIC_LOADING, True),
+        (GRAPHIC_MAX_ROWS, 5),
+        (PLOTLY_TYPED_ARRAYS, True),
+        (PLOTLY_SIGNIFICANT_DIGITS, {"x": 3}),
+    ],
+)
+def test_graphic_page_etag_app_config(dashboard_client, config_key, config_value):
+    response = dashboard_client.get("/dashboard/penguin")
+    etag = response.headers["ETag"]
+    # config that changes the page means a new etag
+    current_app.config[config_key] = config_value
+    response = dashboard_client.get(
+        "/dashboard/penguin", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_graphic_data_etag(dashboard_client):
+    response = dashboard_client.get("/dashboard/penguin/big_penguins/data")
+    etag = response.headers["ETag"]
+    response = dashboard_client.get(
+        "/dashboard/penguin/big_penguins/data", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_graphic_page_gzip_etag(dashboard_client):
+    response = dashboard_client.get("/dashboard/penguin")
+    etag = response.headers["ETag"]
+    response = dashboard_client.get(
+        "/dashboard/penguin", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    # the gzip body is not the uncompressed one, so its etag differs
+    gzip_etag = response.headers["ETag"]
+    assert gzip_etag == etag[:-1] + '-gzip"'
+    response = dashboard_client.get(
+        "/dashboard/penguin",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag},
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == gzip_etag
+    response = dashboard_client.get(
+        "/dashboard/penguin", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_graphic_data_stale_render(dashboard_client, monkeypatch):
+    response = dashboard_client.get("/dashboard/penguin/big_penguins/data")
+    graphic_data = response.get_json()
+
+    # new data, that the background refresh hasn't rendered yet
+    monkeypatch.setattr(current_app.cache_prewarmer, "serves_stale", lambda: True)
+    SqlDataInventory.update_data_upload_metadata_active(
+        "penguin_size", {"id_1": INACTIVE, "id_2": ACTIVE}
+    )
+    response = dashboard_client.get("/dashboard/penguin/big_penguins/data")
+    assert response.get_json() == graphic_data
+    # the previous render must not be cached as the render of the new data
+    assert "ETag" not in response.headers
+    response = dashboard_client.get("/dashboard/penguin")
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+    monkeypatch.setattr(current_app.cache_prewarmer, "serves_stale", lambda: False)
+    response = dashboard_client.get("/dashboard/penguin/big_penguins/data")
+    assert response.get_json() != graphic_data
+    assert "ETag" in response.headers
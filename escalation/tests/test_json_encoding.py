@@ -0,0 +1,100 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import base64
+from datetime import date
+from decimal import Decimal
+import json
+
+import numpy as np
+import pandas as pd
+import plotly
+import pytest
+
+from graphics.utils.json_encoding import (
+    ORJSON_BACKEND,
+    dumps_plot_json,
+    round_to_significant_digits,
+    to_json_values,
+    to_typed_array,
+)
+
+
+@pytest.fixture()
+def plot_payload():
+    data = pd.DataFrame(
+        {
+            "float": [1.5, np.nan, np.inf, -0.25],
+            "int": [1, 2, 3, 4],
+            "bool": [True, False, True, False],
+            "string": ["MALE", None, np.nan, "FEMALE"],
+            "datetime": pd.to_datetime(
+                ["2020-01-01", None, "2020-01-02 03:04:05.5", "1941-12-07 07:55"]
+            ),
+            "date": [date(2020, 1, 1), None, date(2020, 1, 3), date(2020, 1, 4)],
+            "decimal": [Decimal("1.5"), None, Decimal("2"), Decimal("0.1")],
+            "category": pd.Categorical(["a", "b", None, "a"]),
+            "timezone": pd.to_datetime(["2020-01-01"] * 4).tz_localize("UTC"),
+        }
+    )
+    return {
+        "data": [{"x": data[column], "name": column} for column in data.columns]
+        + [
+            {
+                "x": data["int"].to_numpy(),
+                "customdata": [[np.int64(1), np.float64(np.nan), pd.NaT, "a"]],
+            }
+        ],
+        "layout": {"title": "NaN and Infinity in a title", "width": np.int64(500)},
+    }
+
+
+def test_dumps_plot_json(plot_payload):
+    plotly_json = json.dumps(plot_payload, cls=plotly.utils.PlotlyJSONEncoder)
+    assert dumps_plot_json(plot_payload) == plotly_json
+
+
+def test_dumps_plot_json_orjson(plot_payload):
+    pytest.importorskip("orjson")
+    plotly_json = json.dumps(plot_payload, cls=plotly.utils.PlotlyJSONEncoder)
+    graph_json = dumps_plot_json(plot_payload, backend=ORJSON_BACKEND)
+    assert json.loads(graph_json) == json.loads(plotly_json)
+
+
+def test_to_json_values():
+    assert to_json_values(pd.Series([1.0, np.nan])) == [1.0, None]
+    assert to_json_values(np.array([[1.0, np.nan], [np.inf, 2.0]])) == [
+        [1.0, None],
+        [None, 2.0],
+    ]
+    assert to_json_values(
+        pd.Series(pd.to_datetime(["2020-01-01 00:00:00.000000001", None]))
+    ) == ["2020-01-01T00:00:00.000000001", None]
+
+
+def test_to_typed_array():
+    typed_array = to_typed_array(pd.Series([1, 2, 2 ** 40]))
+    assert typed_array["dtype"] == "f8"
+    assert np.frombuffer(base64.b64decode(typed_array["bdata"]), "<f8").tolist() == [
+        1,
+        2,
+        2 ** 40,
+    ]
+    assert to_typed_array(np.array([1, 2], dtype=np.int64))["dtype"] == "i4"
+    assert to_typed_array(np.array([1, 2], dtype=np.uint8))["dtype"] == "u1"
+    assert to_typed_array(np.array([[1.5, 2], [3, 4]]), use_float32=True) == {
+        "dtype": "f4",
+        "bdata": base64.b64encode(
+            np.array([1.5, 2, 3, 4], dtype="<f4").tobytes()
+        ).decode("ascii"),
+        "shape": "2,2",
+    }
+    assert to_typed_array(pd.Series(["a", "b"])) is None
+    assert to_typed_array(pd.Series([True, False])) is None
+
+
+def test_round_to_significant_digits():
+    values = np.array([123456.0, -0.00123456, 0.0, np.nan, np.inf, 1e-320])
+    np.testing.assert_array_equal(
+        round_to_significant_digits(values, 3),
+        np.array([123000.0, -0.00123, 0.0, np.nan, np.inf, 1e-320]),
+    )
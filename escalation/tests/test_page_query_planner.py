@@ -0,0 +1,90 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from flask import current_app
+
+from database.page_query_planner import PageQueryPlanner
+from database.sql_handler import SqlHandler
+from utility.constants import (
+    COLUMN_NAME,
+    DATA_SOURCE_TYPE,
+    FILTER,
+    MAIN_DATA_SOURCE,
+    OPTION_TYPE,
+    SELECTED,
+)
+
+PENGUIN_SIZE_SMALL = "penguin_size_small"
+BODY_MASS = f"{PENGUIN_SIZE_SMALL}:body_mass_g"
+FLIPPER_LENGTH = f"{PENGUIN_SIZE_SMALL}:flipper_length_mm"
+SEX = f"{PENGUIN_SIZE_SMALL}:sex"
+ISLAND = f"{PENGUIN_SIZE_SMALL}:island"
+
+
+def make_data_sources():
+    return {MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: PENGUIN_SIZE_SMALL}}
+
+
+def test_coalesced_column_data(rebuild_test_database):
+    query_cache = current_app.query_cache
+    query_cache.clear()
+    query_planner = PageQueryPlanner()
+    graphic_columns = [{BODY_MASS}, {FLIPPER_LENGTH, SEX}]
+    data_handlers = []
+    for columns in graphic_columns:
+        data_sources = make_data_sources()
+        data_sources_key = query_planner.plan_graphic(
+            data_sources, columns, [], None, None, [SEX]
+        )
+        data_handlers.append(
+            query_planner.get_data_handler(SqlHandler(data_sources), data_sources_key)
+        )
+    for data_handler, columns in zip(data_handlers, graphic_columns):
+        graphic_data = data_handler.get_column_data(columns, [])
+        assert set(graphic_data.columns) == columns
+        expected_data = SqlHandler(make_data_sources()).get_column_data(columns)
+        column_order = sorted(columns)
+        assert sorted(graphic_data[column_order].itertuples(index=False)) == sorted(
+            expected_data[column_order].itertuples(index=False)
+        )
+    # one query for the page, and one for each of the expected responses
+    assert len(query_cache) == 3
+
+    # calls that weren't planned get their own query
+    filters = [{OPTION_TYPE: FILTER, COLUMN_NAME: SEX, SELECTED: ["MALE"]}]
+    assert len(data_handlers[0].get_column_data({BODY_MASS}, filters)) == 1
+
+
+def test_coalesced_column_unique_entries(rebuild_test_database, monkeypatch):
+    query_planner = PageQueryPlanner()
+    unique_entry_columns = [[SEX], [ISLAND, SEX]]
+    data_handlers = []
+    queried_columns = []
+    for columns in unique_entry_columns:
+        data_sources = make_data_sources()
+        data_sources_key = query_planner.plan_graphic(
+            data_sources, {BODY_MASS}, [], None, None, columns
+        )
+        data_handler = SqlHandler(data_sources)
+        get_column_unique_entries = data_handler.get_column_unique_entries
+
+        def log_column_unique_entries(cols, *args, **kwargs):
+            queried_columns.append(cols)
+            return get_column_unique_entries(cols, *args, **kwargs)
+
+        monkeypatch.setattr(
+            data_handler, "get_column_unique_entries", log_column_unique_entries
+        )
+        data_handlers.append(
+            query_planner.get_data_handler(data_handler, data_sources_key)
+        )
+    expected_entries = SqlHandler(make_data_sources()).get_column_unique_entries(
+        [SEX, ISLAND]
+    )
+    for data_handler, columns in zip(data_handlers, unique_entry_columns):
+        unique_entries = data_handler.get_column_unique_entries(columns, filters=[])
+        assert unique_entries == {col: expected_entries[col] for col in columns}
+        # graphics modify their entry lists
+        unique_entries[SEX].append("not an entry")
+    # the columns of both graphics are fetched together, once
+    assert queried_columns == [[SEX, ISLAND]]
@@ -1,8 +1,13 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
+import base64
 import copy
 
+from flask import current_app
+
 from graphics.plotly_plot import (
+    make_group_labels,
+    make_hover_rows,
     PlotlyPlot,
     LAYOUT,
     TITLE,
@@ -10,8 +15,10 @@ from graphics.plotly_plot import (
     VISUALIZATION_TYPE,
     TRANSFORMS,
 )
+from graphics.utils.json_encoding import to_json_values
 import pytest
 import json
+import numpy as np
 import pandas as pd
 
 from utility.constants import (
@@ -24,6 +31,11 @@ from utility.constants import (
     GROUPS,
     TARGET,
     PLOT_SPECIFIC_INFO,
+    PLOTLY_TYPED_ARRAYS,
+    PLOTLY_TYPED_ARRAY_FLOAT32,
+    PLOTLY_SIGNIFICANT_DIGITS,
+    PLOTLY_SERVER_GROUPBY,
+    GROUPBY,
 )
 
 TITLE1 = "random_num"
@@ -98,3 +110,198 @@ def test_plotly_visualization_options(make_data, test_app_client_sql_backed):
     assert transform_dict[0][AGGREGATIONS][0]["func"] == "avg"
     assert transform_dict[0][AGGREGATIONS][1]["target"] == "y"
     assert transform_dict[0][AGGREGATIONS][1]["func"] == "avg"
+
+
+def decode_typed_array(typed_array: dict) -> np.ndarray:
+    values = np.frombuffer(
+        base64.b64decode(typed_array["bdata"]), dtype="<" + typed_array["dtype"]
+    )
+    if "shape" in typed_array:
+        shape = [int(length) for length in typed_array["shape"].split(",")]
+        values = values.reshape(shape)
+    return values
+
+
+def test_plotly_typed_arrays(make_data, test_app_client_sql_backed):
+    current_app.config[PLOTLY_TYPED_ARRAYS] = True
+    current_app.config[PLOTLY_TYPED_ARRAY_FLOAT32] = True
+    current_app.config[PLOTLY_SIGNIFICANT_DIGITS] = {"y": 2}
+    data = make_data.assign(
+        measured_at=pd.to_datetime(["2020-01-01", "2020-01-02", None]),
+        flipper_length=[181.123, np.nan, 195.5],
+        sex=["MALE", "FEMALE", None],
+    )
+    graphic_dict = {
+        PLOT_SPECIFIC_INFO: {
+            DATA: [
+                {
+                    "type": "scatter",
+                    "x": "measured_at",
+                    "y": "flipper_length",
+                    "mode": "markers",
+                    "error_y": {"array": TITLE1},
+                    HOVERTEXT: [TITLE1, TITLE2],
+                },
+                {"type": "scatter", "x": TITLE1, "y": "sex", HOVERTEXT: ["sex"]},
+            ]
+        }
+    }
+    ploty_test = PlotlyPlot(graphic_dict, rendered_templates={})
+    ploty_test.data = data
+    ploty_test.make_dict_for_html_plot()
+    graph_dict = json.loads(ploty_test.graph_json_str)
+    trace = graph_dict[DATA][0]
+    # datetimes are milliseconds on a date axis
+    assert trace["x"]["dtype"] == "f8"
+    x_values = decode_typed_array(trace["x"])
+    assert x_values[0] == pd.Timestamp("2020-01-01").value / 10 ** 6
+    assert np.isnan(x_values[2])
+    assert graph_dict[LAYOUT][PLOT_AXIS.format("x")][VISUALIZATION_TYPE] == "date"
+    assert trace["y"]["dtype"] == "f4"
+    np.testing.assert_array_equal(
+        decode_typed_array(trace["y"]), np.array([180, np.nan, 200], dtype="f4")
+    )
+    assert trace["error_y"]["array"]["dtype"] == "i4"
+    np.testing.assert_array_equal(
+        decode_typed_array(trace["customdata"]), data[[TITLE1, TITLE2]].to_numpy()
+    )
+    # strings are sent as json
+    trace = graph_dict[DATA][1]
+    assert decode_typed_array(trace["x"]).tolist() == data[TITLE1].tolist()
+    assert trace["y"] == ["MALE", "FEMALE", None]
+    assert trace["customdata"] == [["MALE"], ["FEMALE"], [None]]
+
+
+def test_make_hover_rows_and_group_labels():
+    data = pd.DataFrame(
+        {
+            "float": [1.5, np.nan, 1.5, 2.0, np.nan],
+            "finite": [0.5, 1.0, 2.5, -3.0, 4.0],
+            "int": [1, 2, 1, 2, 1],
+            "object": ["a", None, np.nan, "a", "b"],
+            "datetime": pd.to_datetime(
+                ["2020-01-01", None, "2020-01-01", "2020-01-02 03:00", None]
+            ),
+            "bool": [True, False, True, True, False],
+            "category": pd.Categorical(["x", None, "x", "y", "y"]),
+        }
+    )
+    column_lists = [[column_name] for column_name in data.columns] + [
+        ["float", "object"],
+        ["object", "datetime", "category"],
+        ["int", "bool"],
+        ["int", "int"],
+        ["finite", "finite"],
+        ["finite", "float"],
+    ]
+    for column_names in column_lists:
+        columns = [data[column_name] for column_name in column_names]
+        # as the rows were made one at a time
+        assert make_hover_rows(columns) == list(
+            map(list, zip(*[to_json_values(column) for column in columns]))
+        )
+        assert make_group_labels(columns) == [
+            ", ".join(map(str, row)) for row in zip(*columns)
+        ]
+    assert make_group_labels([data["float"], data["object"]]) == [
+        "1.5, a",
+        "nan, None",
+        "1.5, nan",
+        "2.0, a",
+        "nan, b",
+    ]
+    assert make_hover_rows([]) == make_group_labels([]) == []
+
+
+def test_plotly_server_groupby(test_app_client_sql_backed):
+    current_app.config[PLOTLY_SERVER_GROUPBY] = True
+    data = pd.DataFrame(
+        {
+            TITLE1: [1, 2, 3, 4, 5],
+            TITLE2: [10, 20, 30, 40, 50],
+            "island": ["Dream", "Biscoe", "Dream", None, "Biscoe"],
+            "sex": ["MALE", "MALE", "FEMALE", "MALE", "MALE"],
+        }
+    )
+    graphic_dict = {
+        PLOT_SPECIFIC_INFO: {
+            DATA: [
+                {
+                    "type": "scatter",
+                    "mode": "markers",
+                    "x": TITLE1,
+                    "y": TITLE2,
+                    "marker": {"size": 4, "color": "grey"},
+                    HOVERTEXT: ["sex"],
+                    TRANSFORMS: {
+                        GROUPBY: {
+                            GROUPS: ["island"],
+                            "styles": [
+                                {TARGET: "Dream", "value": {"marker": {"color": "red"}}}
+                            ],
+                        },
+                    },
+                },
+                {
+                    "type": "scatter",
+                    "mode": "markers",
+                    "x": TITLE1,
+                    "y": TITLE2,
+                    "name": "penguins",
+                    TRANSFORMS: {
+                        GROUPBY: {GROUPS: ["island", "sex"]},
+                        AGGREGATE: [
+                            {
+                                GROUPS: [TITLE2],
+                                AGGREGATIONS: [{TARGET: "x", "func": "avg"}],
+                            }
+                        ],
+                    },
+                },
+                {
+                    "type": "scatter",
+                    "x": TITLE1,
+                    "y": TITLE2,
+                    TRANSFORMS: {
+                        AGGREGATE: [
+                            {
+                                GROUPS: ["sex"],
+                                AGGREGATIONS: [{TARGET: "y", "func": "sum"}],
+                            }
+                        ],
+                    },
+                },
+            ]
+        }
+    }
+    ploty_test = PlotlyPlot(graphic_dict, rendered_templates={})
+    ploty_test.data = data
+    ploty_test.make_dict_for_html_plot()
+    traces = json.loads(ploty_test.graph_json_str)[DATA]
+    # traces without a groupby are left whole
+    assert traces.pop()[TRANSFORMS][0][GROUPS] == data["sex"].tolist()
+    # one trace per group, in the order of their first row
+    assert [trace["name"] for trace in traces] == [
+        "Dream (trace 0)",
+        "Biscoe (trace 0)",
+        "None (trace 0)",
+        "Dream, MALE (penguins)",
+        "Biscoe, MALE (penguins)",
+        "Dream, FEMALE (penguins)",
+        "None, MALE (penguins)",
+    ]
+    assert traces[0]["x"] == [1, 3]
+    assert traces[0]["y"] == [10, 30]
+    assert traces[0]["customdata"] == [["MALE"], ["FEMALE"]]
+    assert traces[0]["marker"] == {"size": 4, "color": "red"}
+    assert traces[1]["x"] == [2, 5]
+    assert traces[1]["marker"] == {"size": 4, "color": "grey"}
+    assert TRANSFORMS not in traces[0]
+    # the other transforms apply within each group
+    assert traces[4][TRANSFORMS] == [
+        {
+            GROUPS: ["20", "50"],
+            AGGREGATIONS: [{TARGET: "x", "func": "avg"}],
+            "type": AGGREGATE,
+        }
+    ]
@@ -0,0 +1,116 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import threading
+import time
+
+from flask import current_app
+import pytest
+
+from utility.cache import make_cache_key
+from utility.constants import SINGLE_FLIGHT_LOCK_DIR, SQLALCHEMY_DATABASE_URI
+from utility.single_flight import SingleFlight
+
+
+def make_slow_compute(calls: list):
+    def compute():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return {"plot": len(calls)}
+
+    return compute
+
+
+def test_single_flight_within_process():
+    single_flight = SingleFlight()
+    calls = []
+    compute = make_slow_compute(calls)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(single_flight.run, "graphic_key", compute)
+            for _ in range(4)
+        ]
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert results == [{"plot": 1}] * 4
+    # once done, the next call computes again
+    assert single_flight.run("graphic_key", compute) == {"plot": 2}
+
+
+def test_single_flight_across_processes(tmp_path):
+    # each instance stands in for a worker process sharing the lock directory
+    single_flights = [SingleFlight(lock_dir=str(tmp_path)) for _ in range(2)]
+    calls = []
+    compute = make_slow_compute(calls)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first_future = executor.submit(single_flights[0].run, "graphic_key", compute)
+        time.sleep(0.05)
+        second_future = executor.submit(
+            single_flights[1].run, "graphic_key", compute
+        )
+        assert first_future.result() == second_future.result() == {"plot": 1}
+    assert len(calls) == 1
+    assert single_flights[1].run("graphic_key", compute) == {"plot": 2}
+
+
+def test_single_flight_across_processes_result_types(tmp_path):
+    single_flights = [SingleFlight(lock_dir=str(tmp_path)) for _ in range(2)]
+    calls = []
+    # json would turn the tuple into a list and the int key into a string,
+    # and can't write the datetime at all
+    expected_result = {"plot": (1, 2), 3: datetime(2020, 1, 2)}
+
+    def compute():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return dict(expected_result)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first_future = executor.submit(single_flights[0].run, "graphic_key", compute)
+        time.sleep(0.05)
+        second_future = executor.submit(
+            single_flights[1].run, "graphic_key", compute
+        )
+        # the waiting process gets the types the result was computed with
+        assert first_future.result() == second_future.result() == expected_result
+    assert len(calls) == 1
+
+
+def test_single_flight_shared_lock_dir(tmp_path):
+    tmp_path.chmod(0o777)
+    # results are unpickled, so a directory others can write to isn't shared
+    assert SingleFlight(lock_dir=str(tmp_path)).lock_dir is None
+    tmp_path.chmod(0o700)
+    assert SingleFlight(lock_dir=str(tmp_path)).lock_dir == str(tmp_path)
+
+
+def test_single_flight_lock_dir_per_database(test_app_client_sql_backed):
+    # apps on other databases don't read each other's results
+    assert current_app.single_flight.lock_dir == os.path.join(
+        current_app.config[SINGLE_FLIGHT_LOCK_DIR],
+        make_cache_key(str(current_app.config[SQLALCHEMY_DATABASE_URI])),
+    )
+    assert current_app.single_flight.lock_dir.startswith(current_app.instance_path)
+
+
+def test_single_flight_error():
+    single_flight = SingleFlight()
+    leader_started = threading.Event()
+
+    def fail():
+        leader_started.set()
+        time.sleep(0.1)
+        raise ValueError("query failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader_future = executor.submit(single_flight.run, "graphic_key", fail)
+        leader_started.wait()
+        waiter_future = executor.submit(
+            single_flight.run, "graphic_key", lambda: "built"
+        )
+        with pytest.raises(ValueError):
+            leader_future.result()
+        # the waiter builds the result itself
+        assert waiter_future.result() == "built"
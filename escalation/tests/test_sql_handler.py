@@ -1,14 +1,28 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
 
+import gzip
+from io import BytesIO, StringIO
+
+from flask import current_app
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 import datetime
 from sqlalchemy.types import Integer, Text, Float, DateTime, ARRAY, Boolean
 
-from database.sql_handler import SqlDataInventory, SqlHandler
+from database.sql_handler import (
+    SqlDataInventory,
+    SqlHandler,
+    gzip_chunks,
+    psycopg2_copy_query_to_csv_chunks,
+)
+from database import sql_handler
+from database.connection_pool import get_pool_statistics
 from utility.constants import *
 from test_app_deploy_data.models import PenguinSize, DataUploadMetadata
+from utility.exceptions import ValidationError
 
 PENGUIN_SIZE = "penguin_size"
 PENGUIN_SIZE_SMALL = "penguin_size_small"
@@ -45,6 +59,38 @@ def test_sql_handler_init(sql_handler_fixture):
     assert "mean_penguin_stat" == data_sources[1][DATA_SOURCE_TYPE]
 
 
+def test_sql_handler_selectable_registry(sql_handler_fixture):
+    selectable_registry = current_app.selectable_registry
+    data_sources = {
+        MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: "penguin_size"},
+        ADDITIONAL_DATA_SOURCES: [
+            {
+                DATA_SOURCE_TYPE: "mean_penguin_stat",
+                JOIN_KEYS: [
+                    ("penguin_size:study_name", "mean_penguin_stat:study_name"),
+                    ("penguin_size:sex", "mean_penguin_stat:sex"),
+                    ("penguin_size:species", "mean_penguin_stat:species"),
+                ],
+            },
+        ],
+    }
+    assert SqlHandler(data_sources).column_lookup_by_name is (
+        sql_handler_fixture.column_lookup_by_name
+    )
+    assert (
+        data_sources[ADDITIONAL_DATA_SOURCES][0][DATA_LOCATION]
+        is sql_handler_fixture.table_lookup_by_name["mean_penguin_stat"]
+    )
+    selectable_registry.clear()
+    sql_handler = SqlHandler(data_sources)
+    assert len(selectable_registry) == 1
+    assert sql_handler.column_lookup_by_name is not (
+        sql_handler_fixture.column_lookup_by_name
+    )
+    SqlHandler({MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: PENGUIN_SIZE_SMALL}})
+    assert len(selectable_registry) == 2
+
+
 def test_get_column_data_no_filter(get_sql_handler_fixture_small):
     # also test apply filters to data
     data_dict = {
@@ -126,6 +172,35 @@ def test_get_column_unique_entries(sql_handler_fixture):
     }
 
 
+def test_get_column_unique_entry_counts(sql_handler_fixture):
+    island_col = "penguin_size:island"
+    sex_col = "penguin_size:sex"
+    rows = sql_handler_fixture.get_column_data({island_col, sex_col})
+    unique_counts = sql_handler_fixture.get_column_unique_entry_counts(
+        [sex_col, island_col]
+    )
+    assert unique_counts[island_col] == rows[island_col].value_counts().to_dict()
+    assert unique_counts[sex_col] == rows[sex_col].value_counts().to_dict()
+
+    # only the filtered selector column is restricted by the filters
+    filters = [
+        {
+            OPTION_TYPE: FILTER,
+            COLUMN_NAME: sex_col,
+            SELECTED: ["MALE"],
+            FILTERED_SELECTOR: True,
+        },
+        {OPTION_TYPE: FILTER, COLUMN_NAME: island_col, SELECTED: ["Biscoe"]},
+    ]
+    unique_counts = sql_handler_fixture.get_column_unique_entry_counts(
+        [sex_col, island_col], filters=filters
+    )
+    assert unique_counts[sex_col] == {
+        "MALE": ((rows[sex_col] == "MALE") & (rows[island_col] == "Biscoe")).sum()
+    }
+    assert unique_counts[island_col] == rows[island_col].value_counts().to_dict()
+
+
 def test_build_combined_data_table(sql_handler_fixture):
     penguin_size = pd.concat(
         [
@@ -299,6 +374,77 @@ def test_write_data_upload_to_backend(
     assert upload_ids_in_db == expected_upload_ids
 
 
+def test_write_csv_uploads_to_backend(
+    rebuild_test_database, penguin_size_csv_file, sql_data_inventory_fixture
+):
+    current_app.config[UPLOAD_CHUNK_SIZE] = 100
+    penguin_size_df = pd.read_csv(penguin_size_csv_file)
+    penguin_size_csv_file.seek(0)
+    second_file = StringIO(penguin_size_df.head(10).to_csv(index=False))
+    ignored_columns = sql_data_inventory_fixture.write_csv_uploads_to_backend(
+        [penguin_size_csv_file, second_file], "test_user", "test_notes"
+    )
+    assert ignored_columns == set()
+    row_indices = [
+        row.row_index
+        for row in current_app.db_session.query(PenguinSize.row_index)
+        .filter(PenguinSize.upload_id == 3)
+        .order_by(PenguinSize.row_index)
+    ]
+    # the files and their chunks make one upload with a single row index
+    assert row_indices == list(range(len(penguin_size_df) + 10))
+
+
+def test_write_csv_uploads_to_backend_chunk_dtypes(
+    rebuild_test_database, penguin_size_csv_file, sql_data_inventory_fixture
+):
+    current_app.config[UPLOAD_CHUNK_SIZE] = 2
+    penguin_size_df = pd.read_csv(penguin_size_csv_file).head(4)
+    # the first chunk only has numbers in the text column
+    penguin_size_df["sex"] = ["007", "8", "MALE", None]
+    sql_data_inventory_fixture.write_csv_uploads_to_backend(
+        [StringIO(penguin_size_df.to_csv(index=False))], "test_user", "test_notes"
+    )
+    sexes = [
+        row.sex
+        for row in current_app.db_session.query(PenguinSize.sex)
+        .filter(PenguinSize.upload_id == 3)
+        .order_by(PenguinSize.row_index)
+    ]
+    assert sexes == ["007", "8", "MALE", None]
+
+
+def test_cast_dataframe_datatypes_for_table(sql_data_inventory_fixture):
+    table = sql_data_inventory_fixture.table_lookup_by_name[PENGUIN_SIZE]
+    df = pd.DataFrame(
+        {"sex": pd.Series(["007", "8"], dtype=object), "body_mass_g": [3750.0, None]}
+    )
+    cast_df = sql_data_inventory_fixture.cast_dataframe_datatypes_for_table(df, table)
+    # the text column is left as text, whatever its values
+    assert cast_df["sex"].tolist() == ["007", "8"]
+    assert cast_df["body_mass_g"].dtype == "Int64"
+
+
+def test_write_csv_uploads_to_backend_bad_content(
+    rebuild_test_database, penguin_size_csv_file, sql_data_inventory_fixture
+):
+    current_app.config[UPLOAD_CHUNK_SIZE] = 100
+    penguin_size_df = pd.read_csv(penguin_size_csv_file)
+    penguin_size_csv_file.seek(0)
+    penguin_size_df["body_mass_g"] = "heavy"
+    bad_file = StringIO(penguin_size_df.to_csv(index=False))
+    with pytest.raises(ValidationError):
+        sql_data_inventory_fixture.write_csv_uploads_to_backend(
+            [penguin_size_csv_file, bad_file], "test_user", "test_notes"
+        )
+    # nothing from the upload is written, including the chunks before the bad one
+    upload_ids = current_app.db_session.query(PenguinSize.upload_id).distinct()
+    assert sorted(row.upload_id for row in upload_ids) == [1, 2]
+    assert SqlDataInventory.get_active_upload_ids([PENGUIN_SIZE]) == {
+        PENGUIN_SIZE: [1, 2]
+    }
+
+
 def test_get_table_data(get_sql_handler_fixture_small):
     result = get_sql_handler_fixture_small.get_table_data()
 
@@ -311,3 +457,265 @@ def test_get_table_data(get_sql_handler_fixture_small):
         result.sort_index().sort_index(axis=1)
         == penguin_small.sort_index().sort_index(axis=1)
     )
+
+
+def test_get_table_data_as_csv_chunks(get_sql_handler_fixture_small):
+    csv_bytes = b"".join(get_sql_handler_fixture_small.get_table_data_as_csv_chunks())
+    result = pd.read_csv(BytesIO(csv_bytes))
+    expected = get_sql_handler_fixture_small.get_table_data()
+    pd.testing.assert_frame_equal(
+        result.sort_values(INDEX_COLUMN).reset_index(drop=True),
+        expected.sort_values(INDEX_COLUMN).reset_index(drop=True),
+        check_dtype=False,
+    )
+    # gzip_chunks makes a valid gzip stream of the same csv
+    gzip_bytes = b"".join(gzip_chunks([csv_bytes[:10], csv_bytes[10:]]))
+    assert gzip.decompress(gzip_bytes) == csv_bytes
+
+
+def test_get_table_data_as_csv_chunks_closed_early(get_sql_handler_fixture_small):
+    csv_chunks = get_sql_handler_fixture_small.get_table_data_as_csv_chunks()
+    # the header row comes first
+    assert next(csv_chunks).startswith(b"upload_id,row_index")
+    # closing before the end stops the copy without leaking the connection
+    csv_chunks.close()
+    assert len(get_sql_handler_fixture_small.get_table_data()) == 3
+
+
+def test_copy_query_to_csv_chunks_not_iterated(get_sql_handler_fixture_small):
+    query, _ = get_sql_handler_fixture_small.build_table_query()
+    checked_out = get_pool_statistics(current_app.engine)["checked_out"]
+    csv_chunks = psycopg2_copy_query_to_csv_chunks(query)
+    # the connection is only checked out once the chunks are read
+    assert get_pool_statistics(current_app.engine)["checked_out"] == checked_out
+    csv_chunks.close()
+    assert get_pool_statistics(current_app.engine)["checked_out"] == checked_out
+
+
+@pytest.mark.parametrize("export_format", [ARROW_FORMAT, PARQUET_FORMAT])
+def test_get_table_data_as_export_chunks(get_sql_handler_fixture_small, export_format):
+    current_app.config[QUERY_FETCH_CHUNK_SIZE] = 2
+    export_bytes = b"".join(
+        get_sql_handler_fixture_small.get_table_data_as_export_chunks(
+            export_format=export_format
+        )
+    )
+    if export_format == ARROW_FORMAT:
+        table = pa.ipc.open_stream(export_bytes).read_all()
+    else:
+        parquet_file = pq.ParquetFile(pa.BufferReader(export_bytes))
+        # a row group per fetched chunk
+        assert parquet_file.num_row_groups == 2
+        table = parquet_file.read()
+    assert table.schema.field(BODY_MASS).type == pa.int64()
+    assert table.schema.field(SEX).type == pa.string()
+    pd.testing.assert_frame_equal(
+        table.to_pandas(), get_sql_handler_fixture_small.get_table_data()
+    )
+
+
+def test_get_table_data_as_export_chunks_no_rows(get_sql_handler_fixture_small):
+    column = f"{PENGUIN_SIZE_SMALL}:{ISLAND}"
+    export_bytes = b"".join(
+        get_sql_handler_fixture_small.get_table_data_as_export_chunks(
+            [{OPTION_TYPE: FILTER, OPTION_COL: column, SELECTED: ["Atlantis"]}],
+            export_format=ARROW_FORMAT,
+        )
+    )
+    table = pa.ipc.open_stream(export_bytes).read_all()
+    assert table.num_rows == 0
+    assert table.schema.field(BODY_MASS).type == pa.int64()
+
+
+def test_get_column_data_cache(sql_data_inventory_fixture, test_app_client_sql_backed):
+    data_dict = {f"{PENGUIN_SIZE}:{BODY_MASS}"}
+    query_cache = test_app_client_sql_backed.query_cache
+    first_response = sql_data_inventory_fixture.get_column_data(data_dict)
+    num_rows_all_uploads = first_response.shape[0]
+    assert len(query_cache) == 1
+    # modifying the returned data doesn't change the cached response
+    first_response.drop(first_response.index, inplace=True)
+    second_response = sql_data_inventory_fixture.get_column_data(data_dict)
+    assert second_response.shape[0] == num_rows_all_uploads
+    assert query_cache.hits == 1
+
+    # changing which uploads are active invalidates the cache
+    SqlDataInventory.update_data_upload_metadata_active(
+        PENGUIN_SIZE, {"id_1": ACTIVE, "id_2": INACTIVE}
+    )
+    assert len(query_cache) == 0
+    response = sql_data_inventory_fixture.get_column_data(data_dict)
+    assert 0 < response.shape[0] < num_rows_all_uploads
+
+
+def test_get_column_data_statement_cache(get_sql_handler_fixture_small):
+    statement_cache = current_app.statement_cache
+    statement_cache.clear()
+    body_mass_col = f"{PENGUIN_SIZE_SMALL}:{BODY_MASS}"
+    sex_col = f"{PENGUIN_SIZE_SMALL}:{SEX}"
+
+    def get_body_mass(selected):
+        filters = [{OPTION_TYPE: FILTER, OPTION_COL: sex_col, SELECTED: selected}]
+        response = get_sql_handler_fixture_small.get_column_data(
+            {body_mass_col}, filters
+        )
+        return sorted(response[body_mass_col])
+
+    assert get_body_mass(["MALE"]) == [3750]
+    num_statements = len(statement_cache)
+    # other values and any number of them reuse the compiled statement
+    assert get_body_mass(["FEMALE"]) == [3250, 3800]
+    assert get_body_mass(["MALE", "FEMALE"]) == [3250, 3750, 3800]
+    assert len(statement_cache) == num_statements
+
+    # the unique entries of filtered selectors are a statement of their own
+    filters = [
+        {
+            OPTION_TYPE: FILTER,
+            COLUMN_NAME: sex_col,
+            SELECTED: ["MALE"],
+            FILTERED_SELECTOR: True,
+        }
+    ]
+    unique_counts = get_sql_handler_fixture_small.get_column_unique_entry_counts(
+        [sex_col], filters=filters
+    )
+    assert unique_counts[sex_col] == {"MALE": 1}
+    filters[0][SELECTED] = ["FEMALE"]
+    unique_counts = get_sql_handler_fixture_small.get_column_unique_entry_counts(
+        [sex_col], filters=filters
+    )
+    assert unique_counts[sex_col] == {"FEMALE": 2}
+    assert len(statement_cache) == num_statements + 1
+
+
+def test_get_active_upload_ids(rebuild_test_database, test_app_client_sql_backed):
+    assert SqlDataInventory.get_active_upload_ids([PENGUIN_SIZE]) == {
+        PENGUIN_SIZE: [1, 2]
+    }
+    SqlDataInventory.update_data_upload_metadata_active(
+        PENGUIN_SIZE, {"id_1": INACTIVE, "id_2": ACTIVE}
+    )
+    # the registry is refreshed by the admin write
+    assert SqlDataInventory.get_active_upload_ids([PENGUIN_SIZE]) == {
+        PENGUIN_SIZE: [2]
+    }
+
+
+@pytest.mark.parametrize(
+    "table_name,sort_columns",
+    [
+        (PENGUIN_SIZE, [UPLOAD_ID, INDEX_COLUMN]),
+        ("temperature", [UPLOAD_ID, INDEX_COLUMN]),
+        ("penguin_lter_small", [UPLOAD_ID, INDEX_COLUMN]),
+        # has a boolean column
+        (DATA_UPLOAD_METADATA, [TABLE_NAME, UPLOAD_ID]),
+    ],
+)
+def test_copy_fetch_engine_matches_orm(
+    rebuild_test_database, table_name, sort_columns
+):
+    data_sources = {MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: table_name}}
+    current_app.config[QUERY_FETCH_ENGINE] = ORM_FETCH_ENGINE
+    orm_df = SqlHandler(data_sources).get_table_data()
+    current_app.config[QUERY_FETCH_ENGINE] = COPY_FETCH_ENGINE
+    copy_df = SqlHandler(data_sources).get_table_data()
+    pd.testing.assert_frame_equal(
+        orm_df.sort_values(sort_columns).reset_index(drop=True),
+        copy_df.sort_values(sort_columns).reset_index(drop=True),
+    )
+
+
+def test_copy_fetch_engine_streams_chunks(
+    rebuild_test_database, get_sql_handler_fixture_small, monkeypatch
+):
+    current_app.config[QUERY_FETCH_ENGINE] = ORM_FETCH_ENGINE
+    orm_df = get_sql_handler_fixture_small.get_table_data()
+    # rows are split across chunks, and the copy waits on the parser
+    monkeypatch.setattr(sql_handler, "COPY_STREAM_CHUNK_BYTES", 16)
+    monkeypatch.setattr(sql_handler, "COPY_STREAM_QUEUE_CHUNKS", 1)
+    current_app.config[QUERY_FETCH_ENGINE] = COPY_FETCH_ENGINE
+    copy_df = get_sql_handler_fixture_small.get_table_data()
+    pd.testing.assert_frame_equal(orm_df, copy_df)
+
+    # a parser that stops mid-copy doesn't leave the copy running
+    def read_first_chunk(reader, **kwargs):
+        reader.read(16)
+        raise ValueError
+
+    monkeypatch.setattr(sql_handler.pd, "read_csv", read_first_chunk)
+    with pytest.raises(ValueError):
+        get_sql_handler_fixture_small.get_table_data()
+    current_app.db_session.rollback()
+    monkeypatch.undo()
+    pd.testing.assert_frame_equal(
+        orm_df, get_sql_handler_fixture_small.get_table_data()
+    )
+
+
+def test_copy_fetch_engine_no_rows(rebuild_test_database, get_sql_handler_fixture_small):
+    current_app.config[QUERY_FETCH_ENGINE] = COPY_FETCH_ENGINE
+    column = f"{PENGUIN_SIZE_SMALL}:{ISLAND}"
+    response_df = get_sql_handler_fixture_small.get_column_data(
+        {column},
+        [{OPTION_TYPE: FILTER, OPTION_COL: column, SELECTED: ["Atlantis"]}],
+    )
+    assert list(response_df.columns) == [column]
+    assert response_df.empty
+
+
+@pytest.mark.parametrize(
+    "max_rows_fallback,expected_num_rows",
+    [(SAMPLE_ROWS, 5), (REFUSE_ROWS, 0)],
+)
+def test_get_column_data_max_rows(
+    sql_handler_fixture, max_rows_fallback, expected_num_rows
+):
+    column = f"{PENGUIN_SIZE}:{ISLAND}"
+    response_df = sql_handler_fixture.get_column_data(
+        {column}, max_rows=5, max_rows_fallback=max_rows_fallback
+    )
+    assert len(response_df) == expected_num_rows
+    assert list(response_df.columns) == [column]
+    assert response_df.attrs[DATA_NOTICE]
+
+
+@pytest.mark.parametrize(
+    "estimated_rows,notice_start,num_fetches",
+    # a low estimate is checked with the limited query before the fallback
+    [(10 ** 6, "About 1,000,000 rows", 1), (0, "More than", 2)],
+)
+def test_get_column_data_max_rows_estimate(
+    sql_handler_fixture, monkeypatch, estimated_rows, notice_start, num_fetches
+):
+    monkeypatch.setattr(
+        sql_handler, "psycopg2_estimate_query_rows", lambda statement: estimated_rows
+    )
+    fetched_statements = []
+    fetch_query_as_df = sql_handler_fixture.fetch_query_as_df
+    monkeypatch.setattr(
+        sql_handler_fixture,
+        "fetch_query_as_df",
+        lambda statement: fetched_statements.append(statement)
+        or fetch_query_as_df(statement),
+    )
+    column = f"{PENGUIN_SIZE}:{ISLAND}"
+    response_df = sql_handler_fixture.get_column_data(
+        {column}, max_rows=5, max_rows_fallback=SAMPLE_ROWS
+    )
+    assert len(response_df) == 5
+    assert response_df.attrs[DATA_NOTICE].startswith(notice_start)
+    assert len(fetched_statements) == num_fetches
+
+
+def test_get_column_data_under_max_rows(sql_handler_fixture):
+    column = f"{PENGUIN_SIZE}:{ISLAND}"
+    response_df = sql_handler_fixture.get_column_data({column}, max_rows=100000)
+    assert len(response_df) == len(sql_handler_fixture.get_column_data({column}))
+    assert response_df.attrs[DATA_NOTICE] is None
+    # the global budget applies when a graphic doesn't set one
+    current_app.config[GRAPHIC_MAX_ROWS] = 10
+    current_app.config[QUERY_FETCH_CHUNK_SIZE] = 3
+    response_df = sql_handler_fixture.get_column_data({column}, max_rows=100000)
+    assert len(response_df) == 10
+    assert response_df.attrs[DATA_NOTICE]
@@ -0,0 +1,64 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from database.upload_metadata_registry import UploadMetadataRegistry
+from utility.constants import ACTIVE, TABLE_NAME, UPLOAD_ID
+
+METADATA_ROWS = [
+    {TABLE_NAME: "penguin_size", UPLOAD_ID: 2, ACTIVE: True},
+    {TABLE_NAME: "penguin_size", UPLOAD_ID: 1, ACTIVE: True},
+    {TABLE_NAME: "penguin_size", UPLOAD_ID: 3, ACTIVE: False},
+    {TABLE_NAME: "temperature", UPLOAD_ID: 1, ACTIVE: True},
+]
+
+
+class CountingLoader:
+    def __init__(self, rows):
+        self.rows = rows
+        self.num_loads = 0
+
+    def __call__(self):
+        self.num_loads += 1
+        return self.rows
+
+
+def test_rows_are_loaded_once_until_invalidated():
+    registry = UploadMetadataRegistry()
+    load_rows = CountingLoader(METADATA_ROWS)
+    rows_by_table = registry.get_rows_by_table(load_rows)
+    registry.get_rows_by_table(load_rows)
+    assert load_rows.num_loads == 1
+    assert len(rows_by_table["penguin_size"]) == 3
+
+    version = registry.version
+    registry.invalidate()
+    registry.get_rows_by_table(load_rows)
+    assert load_rows.num_loads == 2
+    # the version only depends on the content of the metadata table
+    assert registry.version == version
+
+    load_rows.rows = METADATA_ROWS[:-1]
+    registry.invalidate()
+    registry.get_rows_by_table(load_rows)
+    assert registry.version != version
+
+
+def test_max_age():
+    registry = UploadMetadataRegistry(max_age_seconds=0)
+    load_rows = CountingLoader(METADATA_ROWS)
+    registry.get_rows_by_table(load_rows)
+    registry.get_rows_by_table(load_rows)
+    assert load_rows.num_loads == 2
+
+
+def test_get_active_upload_ids():
+    registry = UploadMetadataRegistry()
+    rows_by_table = registry.get_rows_by_table(CountingLoader(METADATA_ROWS))
+    assert registry.get_active_upload_ids(rows_by_table) == {
+        "penguin_size": [1, 2],
+        "temperature": [1],
+    }
+    # tables without any uploads are left out
+    assert registry.get_active_upload_ids(
+        rows_by_table, ["temperature", "mean_penguin_stat"]
+    ) == {"temperature": [1]}
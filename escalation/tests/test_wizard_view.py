@@ -0,0 +1,55 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+import json
+
+from utility.constants import (
+    CONFIG_DICT,
+    DATA,
+    DEFERRED_GRAPHIC_LOADING,
+    GRAPHIC_NUM,
+    LAYOUT,
+    PLOT_SPECIFIC_INFO,
+    PREVIEW,
+)
+from utility.wizard_utils import graphic_dict_to_graphic_component_dict
+
+
+def test_preview_graphic_json_config_deferred(
+    rebuild_test_database,
+    test_app_client_sql_backed_development_env,
+    graphic_json_fixture,
+):
+    # the preview has no page to load the plot later, so it ignores deferred loading
+    test_app_client_sql_backed_development_env.config[DEFERRED_GRAPHIC_LOADING] = True
+    client = test_app_client_sql_backed_development_env.test_client()
+    graphic_dict = graphic_json_fixture[GRAPHIC_NUM.format(1)]
+    # the layout of the fixture holds sets, which can't be posted as json
+    del graphic_dict[PLOT_SPECIFIC_INFO][LAYOUT]
+    component_dict = graphic_dict_to_graphic_component_dict(graphic_dict)
+    response = client.post(
+        "/wizard/graphic/preview", json={CONFIG_DICT: component_dict}
+    )
+    assert response.status_code == 200
+    # the plot json string of the graphic
+    preview = json.loads(json.loads(response.data)[PREVIEW])
+    assert preview[DATA]
+
+
+def test_preview_graphic_json_config_error(
+    rebuild_test_database,
+    test_app_client_sql_backed_development_env,
+    graphic_json_fixture,
+):
+    # a config error fails the preview, rather than showing a blank graphic
+    client = test_app_client_sql_backed_development_env.test_client()
+    graphic_dict = graphic_json_fixture[GRAPHIC_NUM.format(1)]
+    del graphic_dict[PLOT_SPECIFIC_INFO][LAYOUT]
+    graphic_dict[PLOT_SPECIFIC_INFO][DATA][0]["x"] = "penguin_size:not_a_column"
+    component_dict = graphic_dict_to_graphic_component_dict(graphic_dict)
+    response = client.post(
+        "/wizard/graphic/preview", json={CONFIG_DICT: component_dict}
+    )
+    assert response.status_code == 400
+    response_dict = json.loads(response.data)
+    assert not response_dict["success"]
+    assert "not_a_column" in response_dict["error"]
@@ -0,0 +1,92 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+
+def make_cache_key(*key_parts) -> str:
+    """
+    Builds a stable string key from json-serializable parts (dicts, lists, strings...)
+    Dict ordering is ignored, values json can't handle (e.g. datetimes) are stringified
+    :param key_parts: anything that identifies the cached value
+    :return: hex digest string
+    """
+    key_json = json.dumps(key_parts, sort_keys=True, default=str)
+    return hashlib.sha1(key_json.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process least recently used cache.
+    Bounded both by number of entries and by the total size of the cached values,
+    as measured by the sizeof function passed in.
+    A max_entries of 0 disables the cache.
+    """
+
+    def __init__(self, max_entries: int, max_size: int = None, sizeof=None):
+        """
+        :param max_entries: maximum number of values to keep
+        :param max_size: optional maximum sum of sizeof(value) over all cached values
+        :param sizeof: function returning the (approximate) size of a cached value
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key, value):
+        value_size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # values that can never fit are not cached at all
+            if self.max_entries <= 0 or (
+                self.max_size is not None and value_size > self.max_size
+            ):
+                return
+            self._entries[key] = (value, value_size)
+            self.current_size += value_size
+            while len(self._entries) > self.max_entries or (
+                self.max_size is not None and self.current_size > self.max_size
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_size = 0
+
+    def _remove(self, key):
+        _, value_size = self._entries.pop(key)
+        self.current_size -= value_size
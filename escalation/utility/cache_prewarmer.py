@@ -0,0 +1,160 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+import fcntl
+import threading
+import time
+
+# file name of the leader lock, in a directory private to the workers of the app
+LEADER_LOCK_FILE = "cache_prewarmer.leader"
+
+
+class CachePrewarmer:
+    """
+    Background thread of a worker process that renders the cached output ahead of the viewers,
+    so that the first viewer after an upload doesn't pay for the cold render.
+    A refresh runs when the thread starts, whenever the data version changes
+    (through a local write, see request_refresh, or a write of another process),
+    and every interval_seconds.
+    Until the refresh after a data change is done, the previous renders may be served, see serves_stale.
+    With a leader_lock_path, only the worker process holding the lock on it refreshes,
+    the others fill their caches from their viewers, and take over if the leader exits
+    """
+
+    def __init__(
+        self,
+        app,
+        refresh,
+        get_version,
+        interval_seconds: float = None,
+        poll_seconds: float = None,
+        stale_max_seconds: float = 0,
+        leader_lock_path: str = None,
+    ):
+        """
+        :param app: flask app, the refresh runs in an app context of its own
+        :param refresh: function rendering the output into the caches
+        :param get_version: function returning a json-serializable identifier of the state of the data
+        :param interval_seconds: how often to refresh while the data doesn't change, None for never
+        :param poll_seconds: how often to check the data version for writes of other processes,
+        None to only check after a local write or at the interval
+        :param stale_max_seconds: how long after a data change the previous renders may be served
+        :param leader_lock_path: file locked by the one process that refreshes,
+        None for every process to refresh
+        """
+        self.app = app
+        self.refresh = refresh
+        self.get_version = get_version
+        self.interval_seconds = interval_seconds
+        self.poll_seconds = poll_seconds
+        self.stale_max_seconds = stale_max_seconds
+        self.leader_lock_path = leader_lock_path
+        self.is_leader = leader_lock_path is None
+        self._leader_lock_file = None
+        self.version = None
+        self.refreshed_at = None
+        # monotonic time of the first data change that the renders don't include yet
+        self.stale_since = None
+        self.refresh_count = 0
+        self._change_count = 0
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.run, name="cache_prewarmer", daemon=True
+                )
+                self._thread.start()
+
+    def request_refresh(self):
+        """
+        Called when the data changed in this process
+        """
+        self.mark_stale()
+        self._wake.set()
+
+    def mark_stale(self):
+        with self._lock:
+            self._change_count += 1
+            if self.stale_since is None:
+                self.stale_since = time.monotonic()
+
+    def serves_stale(self) -> bool:
+        """
+        :return: whether a graphic missing from the cache may be served from its previous render,
+        rather than rendered by the request
+        """
+        stale_since = self.stale_since
+        return (
+            self._thread is not None
+            and self.is_leader
+            and stale_since is not None
+            and time.monotonic() - stale_since < self.stale_max_seconds
+        )
+
+    def get_wait_seconds(self):
+        wait_seconds = [
+            seconds
+            for seconds in [self.poll_seconds, self.interval_seconds]
+            if seconds is not None
+        ]
+        return min(wait_seconds, default=None)
+
+    def acquire_leader_lock(self) -> bool:
+        """
+        :return: whether this process is the one that refreshes.
+        The lock is held until the process exits
+        """
+        if self.is_leader:
+            return True
+        lock_file = open(self.leader_lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def run(self):
+        while True:
+            try:
+                # the other processes check whether the leader is gone at each wake up
+                if self.acquire_leader_lock():
+                    with self.app.app_context():
+                        self.refresh_if_needed()
+            except Exception:
+                # the viewers render what is missing, try again at the next wake up
+                self.app.logger.exception("Failed to refresh the cached renders")
+            self._wake.wait(self.get_wait_seconds())
+            self._wake.clear()
+
+    def refresh_if_needed(self) -> bool:
+        """
+        :return: whether a refresh ran
+        """
+        version = self.get_version()
+        if self.refresh_count > 0 and version != self.version:
+            # written by another process
+            self.mark_stale()
+        is_due = self.refreshed_at is None or (
+            self.interval_seconds is not None
+            and time.monotonic() - self.refreshed_at >= self.interval_seconds
+        )
+        if self.stale_since is None and not is_due:
+            return False
+        with self._lock:
+            change_count = self._change_count
+        self.refresh()
+        with self._lock:
+            # changes made during the refresh need another one
+            if self._change_count == change_count:
+                self.stale_since = None
+        self.version = version
+        self.refreshed_at = time.monotonic()
+        self.refresh_count += 1
+        return True
@@ -0,0 +1,77 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from utility.cache import make_cache_key
+from utility.constants import (
+    RESPONSE_COMPRESSION_LEVEL,
+    RESPONSE_COMPRESSION_MIN_BYTES,
+)
+
+GZIP = "gzip"
+# the gzip representation of a response is a different entity from the uncompressed one,
+# so it gets an etag of its own
+GZIP_ETAG_SUFFIX = "-gzip"
+# the dashboard pages inline their plot json, which compresses several times over
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/csv",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+}
+
+
+def compress_response(response):
+    """
+    after_request hook compressing the text responses that the client accepts gzip for.
+    Streamed responses (e.g. downloads) and files are left as they are,
+    the downloads compress their own streams, see download_data
+    :param response: flask response
+    :return: the response, with a gzip body and etag if it was worth compressing
+    """
+    level = current_app.config[RESPONSE_COMPRESSION_LEVEL]
+    if (
+        level <= 0
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if GZIP not in request.accept_encodings:
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config[RESPONSE_COMPRESSION_MIN_BYTES]:
+        return response
+    response.set_data(get_compressed_body(body, level))
+    response.headers["Content-Encoding"] = GZIP
+    etag, is_weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(etag + GZIP_ETAG_SUFFIX, weak=is_weak)
+    return response
+
+
+def get_compressed_body(body: bytes, level: int) -> bytes:
+    """
+    Compressing a page of plot json takes far longer than hashing it,
+    so the compressed bodies are kept and reused while the body doesn't change
+    :param body: bytes of the response
+    :param level: gzip compression level, 1 (fastest) to 9 (smallest)
+    :return: gzip bytes
+    """
+    cache_key = make_cache_key(GZIP, level, hashlib.sha1(body).hexdigest())
+    compressed_body = current_app.compression_cache.get(cache_key)
+    if compressed_body is None:
+        # without a timestamp, the same body always compresses to the same bytes
+        compressed_body = gzip.compress(body, compresslevel=level, mtime=0)
+        current_app.compression_cache.set(cache_key, compressed_body)
+    return compressed_body
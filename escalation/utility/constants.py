@@ -2,6 +2,7 @@
 # Licensed under the Apache License, Version 2.0
 
 APP_CONFIG_JSON = "app_config_json"
+APP_VERSION = "VERSION"
 AVAILABLE_PAGES_DICT = "available_pages_dict"
 CONFIG_FILE_FOLDER = "config_file_folder"
 MAIN_CONFIG = "main_config.json"
@@ -19,6 +20,12 @@ WEBPAGE_LABEL = "webpage_label"
 LINK = "link"
 GRAPHIC_TITLE = "title"
 GRAPHIC_DESC = "brief_desc"
+MAX_ROWS = "max_rows"
+MAX_ROWS_FALLBACK = "max_rows_fallback"
+# what to do with a graphic whose data is over its max_rows
+SAMPLE_ROWS = "sample"
+REFUSE_ROWS = "refuse"
+MAX_ROWS_FALLBACKS = [SAMPLE_ROWS, REFUSE_ROWS]
 DATA_BACKEND = "data_backend"
 POSTGRES = "psql"
 PLOT_ID = "plot_id"
@@ -31,6 +38,75 @@ ADDITIONAL_DATA_SOURCES = "additional_data_sources"
 SQLALCHEMY_DATABASE_URI = "SQLALCHEMY_DATABASE_URI"
 DEVELOPMENT = "development"
 
+# flask app config keys for the database connection pool
+DATABASE_POOL_SIZE = "DATABASE_POOL_SIZE"
+DATABASE_POOL_MAX_OVERFLOW = "DATABASE_POOL_MAX_OVERFLOW"
+DATABASE_POOL_TIMEOUT_SECONDS = "DATABASE_POOL_TIMEOUT_SECONDS"
+DATABASE_POOL_RECYCLE_SECONDS = "DATABASE_POOL_RECYCLE_SECONDS"
+DATABASE_POOL_PRE_PING = "DATABASE_POOL_PRE_PING"
+
+# flask app config keys for in-process caching
+QUERY_CACHE_MAX_ENTRIES = "QUERY_CACHE_MAX_ENTRIES"
+QUERY_CACHE_MAX_BYTES = "QUERY_CACHE_MAX_BYTES"
+GRAPHIC_CACHE_MAX_ENTRIES = "GRAPHIC_CACHE_MAX_ENTRIES"
+GRAPHIC_CACHE_MAX_BYTES = "GRAPHIC_CACHE_MAX_BYTES"
+SINGLE_FLIGHT_LOCK_DIR = "SINGLE_FLIGHT_LOCK_DIR"
+SINGLE_FLIGHT_TIMEOUT_SECONDS = "SINGLE_FLIGHT_TIMEOUT_SECONDS"
+SELECTABLE_REGISTRY_MAX_ENTRIES = "SELECTABLE_REGISTRY_MAX_ENTRIES"
+STATEMENT_CACHE_MAX_ENTRIES = "STATEMENT_CACHE_MAX_ENTRIES"
+UPLOAD_METADATA_MAX_AGE_SECONDS = "UPLOAD_METADATA_MAX_AGE_SECONDS"
+COMPRESSION_CACHE_MAX_ENTRIES = "COMPRESSION_CACHE_MAX_ENTRIES"
+COMPRESSION_CACHE_MAX_BYTES = "COMPRESSION_CACHE_MAX_BYTES"
+RENDER_CACHE_MAX_ENTRIES = "RENDER_CACHE_MAX_ENTRIES"
+RENDER_CACHE_MAX_BYTES = "RENDER_CACHE_MAX_BYTES"
+# flask app config keys for re-rendering the default state of the dashboards in the background
+CACHE_PREWARM_ENABLED = "CACHE_PREWARM_ENABLED"
+CACHE_PREWARM_INTERVAL_SECONDS = "CACHE_PREWARM_INTERVAL_SECONDS"
+CACHE_STALE_MAX_SECONDS = "CACHE_STALE_MAX_SECONDS"
+
+# flask app config key and values for how query results are fetched from postgres
+QUERY_FETCH_ENGINE = "QUERY_FETCH_ENGINE"
+ORM_FETCH_ENGINE = "orm"
+COPY_FETCH_ENGINE = "copy"
+QUERY_FETCH_CHUNK_SIZE = "QUERY_FETCH_CHUNK_SIZE"
+# uploaded csvs are read and copied to postgres this many rows at a time
+UPLOAD_CHUNK_SIZE = "UPLOAD_CHUNK_SIZE"
+
+# flask app config keys for the gzip compression of the responses
+RESPONSE_COMPRESSION_LEVEL = "RESPONSE_COMPRESSION_LEVEL"
+RESPONSE_COMPRESSION_MIN_BYTES = "RESPONSE_COMPRESSION_MIN_BYTES"
+
+# flask app config key for how the plots are encoded into json, see JSON_BACKENDS
+PLOT_JSON_BACKEND = "PLOT_JSON_BACKEND"
+# flask app config keys for sending the numeric plotly trace arrays as binary typed arrays
+PLOTLY_TYPED_ARRAYS = "PLOTLY_TYPED_ARRAYS"
+PLOTLY_TYPED_ARRAY_FLOAT32 = "PLOTLY_TYPED_ARRAY_FLOAT32"
+# number of significant digits kept per trace array, e.g. {"x": 6, "error_y": 3}
+PLOTLY_SIGNIFICANT_DIGITS = "PLOTLY_SIGNIFICANT_DIGITS"
+# flask app config key for splitting the groupby transforms of the plotly graphics
+# into one trace per group on the server
+PLOTLY_SERVER_GROUPBY = "PLOTLY_SERVER_GROUPBY"
+
+# flask app config keys for the row budget of a graphic
+GRAPHIC_MAX_ROWS = "GRAPHIC_MAX_ROWS"
+GRAPHIC_MAX_ROWS_FALLBACK = "GRAPHIC_MAX_ROWS_FALLBACK"
+# number of threads building the graphics of a page at the same time
+GRAPHIC_ASSEMBLY_MAX_WORKERS = "GRAPHIC_ASSEMBLY_MAX_WORKERS"
+# render the page without plots, each graphic fetches its plot when scrolled into view
+DEFERRED_GRAPHIC_LOADING = "DEFERRED_GRAPHIC_LOADING"
+# flask app config keys that change the plots served for the same graphic config and data,
+# part of the etags of the dashboards. New settings of the plot output belong here
+PLOT_OUTPUT_APP_CONFIG_KEYS = (
+    PLOT_JSON_BACKEND,
+    PLOTLY_TYPED_ARRAYS,
+    PLOTLY_TYPED_ARRAY_FLOAT32,
+    PLOTLY_SIGNIFICANT_DIGITS,
+    PLOTLY_SERVER_GROUPBY,
+    GRAPHIC_MAX_ROWS,
+    GRAPHIC_MAX_ROWS_FALLBACK,
+    DEFERRED_GRAPHIC_LOADING,
+)
+
 # Plotly constants
 LAYOUT = "layout"
 HEIGHT = "height"
@@ -127,6 +203,10 @@ JINJA_GRAPH_HTML_FILE = "graph_html_file"
 JINJA_SELECT_HTML_FILE = "select_html_file"
 JINJA_SELECT_INFO = "select_info"
 JINJA_PLOT_INFO = "plot_info"
+DATA_NOTICE = "data_notice"
+LOAD_DEFERRED = "load_deferred"
+STALE_RENDER = "stale_render"
+SELECTOR_HTML = "selector_html"
 ACTIVE_SELECTORS = "active_selector"
 
 
@@ -143,6 +223,11 @@ TABLE_NAME = "table_name"
 DATA_SOURCE = "data_source"
 CSVFILE = "csvfile"
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DOWNLOAD_FORMAT = "download_format"
+CSV_FORMAT = "csv"
+ARROW_FORMAT = "arrow"
+PARQUET_FORMAT = "parquet"
+DOWNLOAD_FORMATS = [CSV_FORMAT, ARROW_FORMAT, PARQUET_FORMAT]
 
 # addendum constants
 ADDENDUM_DICT = "addendum_dict"
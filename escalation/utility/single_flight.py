@@ -0,0 +1,178 @@
+# Copyright [2020] [Two Six Labs, LLC]
+# Licensed under the Apache License, Version 2.0
+
+import fcntl
+import os
+import pickle
+import stat
+import threading
+import time
+
+# results are only kept to hand them to workers that waited for them
+RESULT_MAX_AGE_SECONDS = 60
+LOCK_POLL_SECONDS = 0.05
+LOCK_FILE_EXTENSION = ".lock"
+RESULT_FILE_EXTENSION = ".pickle"
+TEMP_FILE_EXTENSION = ".tmp"
+SINGLE_FLIGHT_FILE_EXTENSIONS = (
+    LOCK_FILE_EXTENSION,
+    RESULT_FILE_EXTENSION,
+    TEMP_FILE_EXTENSION,
+)
+
+
+class Flight:
+    """A computation in progress in this process, that other threads can wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time, across the threads of this process
+    and across the worker processes sharing lock_dir.
+    Calls made while the same key is being computed wait and get its result,
+    rather than all running the same queries, e.g. when a shared dashboard link is opened
+    by many people at once or right after an upload invalidates the caches.
+    Results passed between processes go through pickle files, so the waiting processes get
+    the same types as the process that computed them. Results that can't be pickled are
+    computed again by the processes that waited for them
+    """
+
+    def __init__(self, lock_dir: str = None, timeout_seconds: float = 300):
+        """
+        :param lock_dir: directory of the lock and result files shared by the worker processes,
+        None to only coalesce within this process. The result files are unpickled,
+        so whoever can write to the directory can run code in this process:
+        it should only be shared by the workers of one app, and a directory that other users
+        can write to is not shared
+        :param timeout_seconds: how long to wait for another process before computing anyway
+        """
+        self.lock_dir = lock_dir
+        self.timeout_seconds = timeout_seconds
+        self._flights = {}
+        self._lock = threading.Lock()
+        if lock_dir is not None:
+            os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+            if not self.is_private_dir(lock_dir):
+                self.lock_dir = None
+
+    @staticmethod
+    def is_private_dir(path: str) -> bool:
+        """
+        :return: whether the directory is owned by this user and only writable by it
+        """
+        dir_stat = os.stat(path)
+        return dir_stat.st_uid == os.getuid() and not dir_stat.st_mode & (
+            stat.S_IWGRP | stat.S_IWOTH
+        )
+
+    def run(self, key: str, compute):
+        """
+        :param key: string identifying the result, safe to use in a file name (e.g. from make_cache_key)
+        :param compute: function computing the result
+        :return: the result of compute, from this call or from a concurrent one with the same key
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = Flight()
+                self._flights[key] = flight
+        if not is_leader:
+            flight.done.wait()
+            if not flight.failed:
+                return flight.result
+            # the error is raised by the call that hit it, this one tries for itself
+            return compute()
+        try:
+            flight.result = self.run_across_processes(key, compute)
+            return flight.result
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def run_across_processes(self, key: str, compute):
+        if self.lock_dir is None:
+            return compute()
+        lock_path = os.path.join(self.lock_dir, key + LOCK_FILE_EXTENSION)
+        result_path = os.path.join(self.lock_dir, key + RESULT_FILE_EXTENSION)
+        with open(lock_path, "a") as lock_file:
+            wait_start = time.time()
+            waited = not self.acquire_file_lock(lock_file)
+            try:
+                if waited:
+                    result = self.read_result(result_path, wait_start)
+                    if result is not None:
+                        return result
+                # marks the lock file as in use, see remove_old_files
+                os.utime(lock_path)
+                result = compute()
+                self.write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire_file_lock(self, lock_file) -> bool:
+        """
+        Waits up to timeout_seconds for another process holding the lock
+        :return: whether the lock was free right away
+        """
+        deadline = time.time() + self.timeout_seconds
+        is_free = True
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return is_free
+            except BlockingIOError:
+                is_free = False
+                if time.time() > deadline:
+                    # computing without the lock beats failing the request
+                    return is_free
+                time.sleep(LOCK_POLL_SECONDS)
+
+    @staticmethod
+    def read_result(result_path: str, written_after: float):
+        """
+        :return: the result written by the process we waited for, None if there is none
+        """
+        try:
+            if os.path.getmtime(result_path) < written_after:
+                return None
+            with open(result_path, "rb") as result_file:
+                return pickle.load(result_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def write_result(self, result_path: str, result):
+        try:
+            result_bytes = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        temp_path = f"{result_path}.{os.getpid()}{TEMP_FILE_EXTENSION}"
+        with open(temp_path, "wb") as result_file:
+            result_file.write(result_bytes)
+        # readers never see a partly written result
+        os.replace(temp_path, result_path)
+        self.remove_old_files()
+
+    def remove_old_files(self):
+        oldest_mtime = time.time() - RESULT_MAX_AGE_SECONDS
+        for file_name in os.listdir(self.lock_dir):
+            # other files are left alone, e.g. the leader lock of CachePrewarmer
+            if not file_name.endswith(SINGLE_FLIGHT_FILE_EXTENSIONS):
+                continue
+            file_path = os.path.join(self.lock_dir, file_name)
+            try:
+                if os.path.getmtime(file_path) < oldest_mtime:
+                    os.remove(file_path)
+            except OSError:
+                # removed by another process
+                pass
@@ -1,10 +1,11 @@
 # Copyright [2020] [Two Six Labs, LLC]
 # Licensed under the Apache License, Version 2.0
 
-from flask import current_app, render_template, Blueprint, request
+from flask import current_app, render_template, Blueprint, request, jsonify
 
 
 from controller import get_datasource_metadata_formatted_for_admin_panel
+from database.connection_pool import get_pool_statistics
 from utility.constants import DATA_SOURCES
 from app_deploy_data.authentication import auth
 
@@ -31,3 +32,10 @@ def submission():
         data_source_name, active_data_dict
     )
     return admin_page()
+
+
+@admin_blueprint.route("/admin/database_pool", methods=("GET",))
+@auth.login_required
+def database_pool():
+    # connections of this worker process, each worker has its own pool
+    return jsonify(get_pool_statistics(current_app.engine))
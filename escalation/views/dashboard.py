@@ -2,7 +2,14 @@
 # Licensed under the Apache License, Version 2.0
 import json
 
-from flask import current_app, render_template, Blueprint, request, make_response
+from flask import (
+    abort,
+    current_app,
+    render_template,
+    Blueprint,
+    request,
+    make_response,
+)
 from werkzeug.datastructures import ImmutableMultiDict
 from werkzeug.exceptions import BadRequest
 
@@ -17,10 +24,27 @@ from utility.constants import (
     ADDENDUM_DICT,
     DEVELOPMENT,
     GRAPHIC_NAME,
+    JINJA_PLOT_INFO,
+    JINJA_SELECT_INFO,
+    DATA_NOTICE,
+    SELECTOR_HTML,
+    STALE_RENDER,
+    APP_VERSION,
+    PLOT_OUTPUT_APP_CONFIG_KEYS,
+)
+from controller import (
+    get_data_for_page,
+    get_data_version_for_graphics,
+    get_single_graphic_info,
 )
-from controller import get_data_for_page
+from utility.cache import make_cache_key
+from utility.compression import GZIP_ETAG_SUFFIX
 
 DATA_LAYOUT = "data_layout.html"
+GRAPHIC_SELECTORS = "graphic_selectors.html"
+# flask app config that changes the html or the plot json of a dashboard response,
+# ENV shows the wizard links in the navbar
+ETAG_APP_CONFIG_KEYS = ("ENV",) + PLOT_OUTPUT_APP_CONFIG_KEYS
 
 dashboard_blueprint = Blueprint("dashboard", __name__)
 
@@ -40,11 +64,23 @@ def graphic_page(page_name):
     :param page_name:
     :return:
     """
-    # Do not read in cookies in development mode
-    if current_app.config.get("ENV") != DEVELOPMENT:
-        addendum_dict = json.loads(request.cookies.get(ADDENDUM_DICT, "{}"))
-    else:
-        addendum_dict = {}
+    addendum_dict = get_addendum_dict_from_cookies()
+    page_plan = current_app.config.get(AVAILABLE_PAGES_DICT).get(page_name)
+    etag = None
+    if request.method == "GET" and page_plan is not None:
+        # a page that was already sent is not rebuilt
+        etag = make_etag(
+            page_name,
+            {
+                graphic_name: graphic_plan.config_cache_key
+                for graphic_name, graphic_plan in page_plan.items()
+            },
+            addendum_dict,
+            get_data_version_for_graphics(page_plan.values()),
+        )
+        matching_etag = get_matching_etag(etag)
+        if matching_etag is not None:
+            return make_not_modified_response(matching_etag)
     if request.form:
         # request.form[PROCESS]=='' means the reset button sent the request
         if request.form[PROCESS]:
@@ -53,30 +89,147 @@ def graphic_page(page_name):
             addendum_dict = {}
     try:
         html_data_list = get_data_for_page(
-            single_page_config_dict=current_app.config.get(AVAILABLE_PAGES_DICT).get(
-                page_name
-            ),
-            addendum_dict=addendum_dict,
+            page_plan=page_plan, addendum_dict=addendum_dict
         )
     # This can happen during app configuration in the wizard, when refresh POSTS don't
     # match the expected format. Retry the render as if there were no POST data
     except BadRequest:
-        html_data_list = get_data_for_page(
-            single_page_config_dict=current_app.config.get(AVAILABLE_PAGES_DICT).get(
-                page_name
-            ),
-            addendum_dict=None,
-        )
+        html_data_list = get_data_for_page(page_plan=page_plan, addendum_dict=None)
     resp = make_response(
         render_template(
             DATA_LAYOUT, **{CURRENT_PAGE: page_name, JINJA_PLOT: html_data_list}
         )
     )
     # we're attaching a cookie tracking the state of the filters to the rendered template response.
+    set_addendum_dict_cookie(resp, addendum_dict)
+    # a page with previous renders in it is not the page of the etag data version
+    if etag is not None and not any(
+        html_data[STALE_RENDER] for html_data in html_data_list
+    ):
+        set_etag(resp, etag)
+    return resp
+
+
+@dashboard_blueprint.route(
+    "/dashboard/<page_name>/<graphic_name>/data", methods=["GET", "POST"]
+)
+def graphic_data(page_name, graphic_name):
+    """
+    Plot of a single graphic, fetched by the page when DEFERRED_GRAPHIC_LOADING is on.
+    A POST of the selector form of the graphic updates its selections in the ADDENDUM_DICT cookie,
+    and also returns the rendered selectors, so the page only redraws the changed graphic.
+    :param page_name:
+    :param graphic_name:
+    :return: json with the plot info and data notice of the graphic (and selector html for a POST)
+    """
+    page_plan = current_app.config.get(AVAILABLE_PAGES_DICT).get(page_name)
+    if page_plan is None or graphic_name not in page_plan:
+        abort(404)
+    addendum_dict = get_addendum_dict_from_cookies()
+    etag = None
+    if request.method == "GET":
+        etag = make_etag(
+            page_name,
+            graphic_name,
+            page_plan[graphic_name].config_cache_key,
+            addendum_dict.get(graphic_name, {}),
+            get_data_version_for_graphics([page_plan[graphic_name]]),
+        )
+        matching_etag = get_matching_etag(etag)
+        if matching_etag is not None:
+            return make_not_modified_response(matching_etag)
+    if request.method == "POST":
+        # request.form[PROCESS]=='' means the reset button sent the request
+        if request.form.get(PROCESS):
+            add_form_to_addendum_dict(request.form, addendum_dict)
+        else:
+            addendum_dict.pop(graphic_name, None)
+    graphic_info = get_single_graphic_info(
+        page_plan,
+        graphic_name,
+        addendum_dict,
+        with_select_info=request.method == "POST",
+    )
+    plot_info = graphic_info[JINJA_PLOT_INFO]
+    response_dict = {DATA_NOTICE: graphic_info[DATA_NOTICE]}
+    if request.method == "POST":
+        response_dict[SELECTOR_HTML] = render_template(
+            GRAPHIC_SELECTORS,
+            plot={JINJA_SELECT_INFO: graphic_info[JINJA_SELECT_INFO]},
+            plot_id=graphic_name,
+        )
+    # the plot info is already a json string, don't decode and encode it again
+    response_items = [
+        f'"{JINJA_PLOT_INFO}": {"null" if plot_info is None else plot_info}'
+    ] + [
+        f"{json.dumps(key)}: {json.dumps(value)}"
+        for key, value in response_dict.items()
+    ]
+    response_json = "{" + ", ".join(response_items) + "}"
+    resp = current_app.response_class(response_json, mimetype="application/json")
+    if request.method == "POST":
+        set_addendum_dict_cookie(resp, addendum_dict)
+    if etag is not None and not graphic_info[STALE_RENDER]:
+        set_etag(resp, etag)
+    return resp
+
+
+def make_etag(*etag_parts) -> str:
+    """
+    Strong ETag for a dashboard response. It is the same in every worker process
+    as long as the app version, the app config, the flask config in ETAG_APP_CONFIG_KEYS,
+    and the etag parts are the same
+    :param etag_parts: json-serializable values that the response is built from,
+    including the data version of the tables used
+    :return: etag string
+    """
+    return make_cache_key(
+        current_app.config[APP_VERSION],
+        dict(current_app.config[APP_CONFIG_JSON]),
+        {key: current_app.config.get(key) for key in ETAG_APP_CONFIG_KEYS},
+        *etag_parts,
+    )
+
+
+def get_matching_etag(etag: str):
+    """
+    :param etag: etag of the uncompressed response
+    :return: the etag the client sent for the response, as sent uncompressed or gzipped,
+    None if it sent neither
+    """
+    for representation_etag in [etag, etag + GZIP_ETAG_SUFFIX]:
+        if request.if_none_match.contains(representation_etag):
+            return representation_etag
+    return None
+
+
+def set_etag(resp, etag: str):
+    resp.set_etag(etag)
+    # the response depends on the filter selections stored in the cookie,
+    # and caches always need to check that the etag is still current
+    resp.vary.add("Cookie")
+    resp.cache_control.no_cache = True
+
+
+def make_not_modified_response(etag: str):
+    resp = current_app.response_class(status=304)
+    set_etag(resp, etag)
+    if etag.endswith(GZIP_ETAG_SUFFIX):
+        resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def get_addendum_dict_from_cookies() -> dict:
+    # Do not read in cookies in development mode
+    if current_app.config.get("ENV") != DEVELOPMENT:
+        return json.loads(request.cookies.get(ADDENDUM_DICT, "{}"))
+    return {}
+
+
+def set_addendum_dict_cookie(resp, addendum_dict: dict):
     # Do not write cookies in development mode
     if current_app.config.get("ENV") != DEVELOPMENT:
         resp.set_cookie(ADDENDUM_DICT, json.dumps(addendum_dict))
-    return resp
 
 
 @dashboard_blueprint.context_processor
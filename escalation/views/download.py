@@ -2,9 +2,18 @@
 # Licensed under the Apache License, Version 2.0
 import json
 
-from flask import current_app, render_template, Blueprint, request, Response
+from flask import (
+    abort,
+    current_app,
+    render_template,
+    Blueprint,
+    request,
+    Response,
+    stream_with_context,
+)
 
 from controller import get_datasource_metadata_formatted_for_admin_panel
+from database.sql_handler import gzip_chunks
 from utility.constants import (
     DATA_SOURCES,
     MAIN_DATA_SOURCE,
@@ -15,9 +24,21 @@ from utility.constants import (
     OPTION_COL,
     SELECTED,
     ACTIVE,
+    DOWNLOAD_FORMAT,
+    DOWNLOAD_FORMATS,
+    CSV_FORMAT,
+    ARROW_FORMAT,
+    PARQUET_FORMAT,
+    RESPONSE_COMPRESSION_LEVEL,
 )
 
 DOWNLOAD_HTML = "view_uploaded_data.html"
+# mimetype and file extension of each download format
+DOWNLOAD_FORMAT_FILE_TYPES = {
+    CSV_FORMAT: ("text/csv", "csv"),
+    ARROW_FORMAT: ("application/vnd.apache.arrow.stream", "arrows"),
+    PARQUET_FORMAT: ("application/vnd.apache.parquet", "parquet"),
+}
 
 download_blueprint = Blueprint("download", __name__)
 
@@ -26,7 +47,10 @@ download_blueprint = Blueprint("download", __name__)
 def download_page():
     data_source_dict = get_datasource_metadata_formatted_for_admin_panel()
     return render_template(
-        DOWNLOAD_HTML, data_source_dict=data_source_dict, admin=False
+        DOWNLOAD_HTML,
+        data_source_dict=data_source_dict,
+        admin=False,
+        download_formats=DOWNLOAD_FORMATS,
     )
 
 
@@ -34,6 +58,9 @@ def download_page():
 def download_data():
     download_data_dict = request.form.to_dict()
     data_source_name = download_data_dict.pop(DATA_SOURCES)
+    download_format = download_data_dict.pop(DOWNLOAD_FORMAT, CSV_FORMAT)
+    if download_format not in DOWNLOAD_FORMATS:
+        abort(400)
     data_inventory = current_app.config.data_handler(
         data_sources={MAIN_DATA_SOURCE: {DATA_SOURCE_TYPE: data_source_name}},
         only_use_active=False,
@@ -51,9 +78,25 @@ def download_data():
             ],
         }
     ]
-    df = data_inventory.get_table_data(data_source_filters)
+    # the file is streamed as it is written, rather than built in memory
+    export_chunks = data_inventory.get_table_data_as_export_chunks(
+        data_source_filters, download_format
+    )
+    mimetype, file_extension = DOWNLOAD_FORMAT_FILE_TYPES[download_format]
+    headers = {
+        "Content-disposition": f"attachment; filename={data_source_name}.{file_extension}"
+    }
+    # parquet pages are compressed already
+    compression_level = current_app.config[RESPONSE_COMPRESSION_LEVEL]
+    if (
+        download_format != PARQUET_FORMAT
+        and compression_level > 0
+        and "gzip" in request.accept_encodings
+    ):
+        export_chunks = gzip_chunks(export_chunks, compression_level)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    # the arrow formats read from the database session as they stream
     return Response(
-        df.to_csv(index=False),
-        mimetype="text/csv",
-        headers={"Content-disposition": f"attachment; filename={data_source_name}.csv"},
+        stream_with_context(export_chunks), mimetype=mimetype, headers=headers
     )
@@ -47,15 +47,18 @@ def validate_data_form(request_form, request_files):
 
 def validate_submission_content(csvfile, data_source_schema):
     """
-    This function validates the contents of an uplaoded file against the expected schema
-    Raises ValidationError if the file does not have the correct format/data types
+    This function validates the header of an uplaoded file against the expected schema,
+    without reading the rest of the file
+    Raises ValidationError if the file does not have the correct format
     :param csvfile: request.file from flask for the uploaded file
     :param data_source_schema: sqlalchemy columns to use for validation
-    :return: pandas dataframe of the uploaded csv
+    :return: list of the column names of the uploaded csv
     """
     try:
         filename = csvfile.filename
-        df = pd.read_csv(csvfile, sep=",", comment="#")
+        column_names = list(pd.read_csv(csvfile, sep=",", comment="#", nrows=0).columns)
+        # the file is read again in chunks when it is written to the db
+        csvfile.seek(0)
         existing_column_names = {
             x.split(TABLE_COLUMN_SEPARATOR)[-1] for x in data_source_schema
         }
@@ -64,14 +67,14 @@ def validate_submission_content(csvfile, data_source_schema):
             if app_added_column in existing_column_names:
                 existing_column_names.remove(app_added_column)
         # all of the columns in the existing data source are specified in upload
-        assert set(df.columns).issuperset(
+        assert set(column_names).issuperset(
             existing_column_names
-        ), f"Upload {filename} missing expected columns {existing_column_names - set(df.columns)}"
-        # todo: match data types
+        ), f"Upload {filename} missing expected columns {existing_column_names - set(column_names)}"
+        # data types are checked by postgres as the rows are written
         # todo- additional file type specific content validation
     except (AssertionError, ValueError) as e:
         raise ValidationError(str(e))
-    return df
+    return column_names
 
 
 def get_data_sources():
@@ -118,14 +121,12 @@ def submission():
         )
         data_source_schema = data_handler_class.get_column_names_for_data_source()
 
-        # validate each uploaded file before writing any to db
-        dfs = []
+        # validate the header of each uploaded file before writing any to db
         for file in files:
-            df = validate_submission_content(file, data_source_schema)
-            dfs.append(df)
-        # by combining dfs before upload we get a single upload_id and metadata write
-        df = pd.concat(dfs).reset_index(drop=True)
-        data_inventory.write_data_upload_to_backend(df, username, notes)
+            validate_submission_content(file, data_source_schema)
+        # the files are streamed to the db in chunks as a single upload, with a single
+        # upload_id and metadata write. Nothing is written if any chunk fails
+        data_inventory.write_csv_uploads_to_backend(files, username, notes)
         # write upload history table record at the same time
 
     except ValidationError as e:
@@ -9,7 +9,7 @@ from flask import current_app, render_template, Blueprint, request
 import pandas as pd
 from sqlacodegen.codegen import CodeGenerator
 
-from controller import get_data_for_page
+from controller import get_data_for_page, make_page_plan
 from database.sql_handler import CreateTablesFromCSVs, REPLACE, SqlDataInventory
 from graphics.graphic_schema import GraphicsConfigInterfaceBuilder
 from graphics.utils.available_graphics import (
@@ -228,7 +228,21 @@ def preview_graphic_json_config():
         config_information_dict[CONFIG_DICT]
     )
     # get_data_for_page needs a graphic label
-    plot_specs = get_data_for_page({PREVIEW: graphic_dict})
+    # the preview has no page to fetch a deferred plot, so the plot is always built here
+    try:
+        plot_specs = get_data_for_page(
+            make_page_plan({PREVIEW: graphic_dict}),
+            load_deferred=False,
+            catch_errors=False,
+        )
+    # show the error in the config to the wizard user, rather than a blank graphic
+    except Exception as e:
+        current_app.logger.exception("Failed to build the graphic preview")
+        return (
+            json.dumps({"success": False, "error": repr(e)}),
+            400,
+            {"ContentType": "application/json"},
+        )
     # plot_specs is more nested than we want for the preveiw so get the plot_dict and pass that to the html
     return (
         json.dumps({"success": True, PREVIEW: plot_specs[0][JINJA_PLOT_INFO]}),
@@ -330,7 +344,7 @@ def sql_backend_file_to_table_upload(upload_form, csvfiles):
     username = upload_form.get(USERNAME)
     notes = upload_form.get(NOTES)
 
-    csv_sql_creator = CreateTablesFromCSVs(current_app.config[SQLALCHEMY_DATABASE_URI])
+    csv_sql_creator = CreateTablesFromCSVs(current_app.engine)
     data = validate_wizard_upload_submission(
         table_name=table_name, csvfiles=csvfiles, csv_sql_creator=csv_sql_creator
     )